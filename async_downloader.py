@@ -0,0 +1,309 @@
+# async_downloader.py
+"""基于asyncio/aiohttp的片段下载引擎
+
+与download_tool.download_all_segments使用相同的片段命名、任务清单和重试策略，
+但所有请求在同一个事件循环线程中完成，共享一个aiohttp.ClientSession，
+并发数由信号量限制，可直接在server.py的采集进程中调用。
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+
+import aiohttp
+
+import metrics
+from download_tool import (SEGMENT_HEADERS, STREAM_CHUNK_SIZE, SegmentManifest, SegmentMerger, SegmentResult,
+                           backoff_delay, init_section_paths, is_retryable, merge_order, segment_extension)
+from hls_crypto import KeyCache, SegmentDecryptor, check_key_method, sequence_iv
+from segment_verify import verify_segment
+
+logger = logging.getLogger(__name__)
+
+
+def _partial_size(temp_path):
+    """上次中断留下的临时文件的大小，没有时为0"""
+    try:
+        return os.path.getsize(temp_path)
+    except FileNotFoundError:
+        return 0
+
+
+def _remove_partial(temp_path):
+    """删除临时文件，不存在时忽略"""
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _open_manifest(download_dir, urls, segment_paths):
+    """创建下载目录并读取、同步任务清单，返回(清单, 每个片段是否已完成的列表)"""
+    os.makedirs(download_dir, exist_ok=True)
+    manifest = SegmentManifest(SegmentManifest.manifest_path(download_dir))
+    manifest.sync(urls)
+    return manifest, [manifest.is_complete(i, path) for i, path in enumerate(segment_paths)]
+
+
+class AsyncSegmentDownloader:
+    """共享会话、信号量限流的异步片段下载器
+
+    用法:
+        async with AsyncSegmentDownloader(concurrency=64) as downloader:
+            await downloader.download(urls, "temp/xxx_segments")
+    """
+
+    def __init__(self, concurrency=64, max_retries=4, session=None, writer=None, verify=True):
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = session
+        self._owns_session = session is None
+        # 传入async_writer.AsyncFileWriter时，文件操作在写入线程中执行，否则在asyncio的默认线程池中执行，都不阻塞事件循环
+        self.writer = writer
+        # 每个片段下载完成后校验（在写入线程中进行），校验失败按可重试的失败重新下载
+        self.verify = verify
+        self.key_cache = KeyCache()
+        # 正在下载的密钥，并发请求同一个密钥URI时共享一个任务
+        self._key_fetches = {}
+        # 直播跟随中已下载或正在下载的初始化片段：{路径: 任务}
+        self._init_fetches = {}
+
+    async def __aenter__(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=SEGMENT_HEADERS)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """关闭自己创建的会话；外部传入的会话由调用方负责关闭"""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _fetch_key(self, uri):
+        async with self.session.get(uri, headers={"Referer": uri}) as resp:
+            resp.raise_for_status()
+            key = await resp.read()
+        self.key_cache.put(uri, key)
+        return key
+
+    async def get_key(self, uri):
+        """返回密钥URI对应的密钥，每个URI只下载一次"""
+        key = self.key_cache.get(uri)
+        if key is not None:
+            return key
+        task = self._key_fetches.get(uri)
+        if task is None:
+            task = self._key_fetches[uri] = asyncio.ensure_future(self._fetch_key(uri))
+            task.add_done_callback(lambda _: self._key_fetches.pop(uri, None))
+        return await task
+
+    async def make_decryptor(self, segment):
+        """为AES-128加密的片段创建解密器；URL字符串或未加密的片段返回None"""
+        key = getattr(segment, "key", None)
+        if key is None:
+            return None
+        check_key_method(key)
+        return SegmentDecryptor(await self.get_key(key.uri), key.iv or sequence_iv(segment.sequence))
+
+    async def _run(self, func, *args):
+        """执行阻塞的文件操作：有writer时交给写入线程，否则交给默认线程池，都不在事件循环中执行"""
+        if self.writer is not None:
+            return await self.writer.call(func, *args)
+        return await asyncio.to_thread(func, *args)
+
+    async def fetch_segment(self, url, filepath, decryptor=None, byterange=None):
+        """下载单个片段到filepath，流式写入临时文件后原子重命名，支持HTTP Range续传
+
+        传入decryptor时边下载边解密，加密片段总是从头下载。
+        byterange（m3u8_parser.ByteRange）表示片段只是资源中的一段，用Range请求只下载这一段。
+        """
+        temp_path = filepath + ".part"
+        resume_from = 0 if decryptor else await self._run(_partial_size, temp_path)
+        headers = {"Referer": url}
+        if byterange:
+            if resume_from >= byterange.length:
+                resume_from = 0
+            headers["Range"] = f"bytes={byterange.offset + resume_from}-{byterange.offset + byterange.length - 1}"
+        elif resume_from:
+            headers["Range"] = f"bytes={resume_from}-"
+        try:
+            async with self.session.get(url, headers=headers) as resp:
+                status = resp.status
+                if status == 416 and resume_from:
+                    await self._run(os.remove, temp_path)
+                    return await self.fetch_segment(url, filepath, byterange=byterange)
+                if status not in (200, 206):
+                    logger.warning(f"[SEGMENT FAILED] HTTP {status} for {url}")
+                    return SegmentResult(False, status, 0, None)
+                if resp.content_type == "text/html":
+                    logger.warning(f"[SEGMENT FAILED] HTML page with HTTP {status} for {url}")
+                    return SegmentResult(False, status, 0, None)
+                skip = limit = None
+                if status == 200:
+                    # 服务器忽略Range时返回完整资源，字节范围片段从中截取所需的一段
+                    resume_from = 0
+                    if byterange:
+                        skip, limit = byterange.offset, byterange.length
+                if limit is not None:
+                    expected_received = limit
+                # aiohttp会自动解压，压缩传输时Content-Length与接收的字节数不可比
+                elif resp.content_length is not None and "Content-Encoding" not in resp.headers:
+                    expected_received = resume_from + resp.content_length
+                else:
+                    expected_received = None
+                received = resume_from
+                f = await self._run(open, temp_path, 'ab' if resume_from else 'wb')
+                try:
+                    async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        if skip:
+                            dropped = min(skip, len(chunk))
+                            chunk, skip = chunk[dropped:], skip - dropped
+                            if not chunk:
+                                continue
+                        if limit is not None:
+                            chunk = chunk[:limit - (received - resume_from)]
+                        await self._run(f.write, decryptor.update(chunk) if decryptor else chunk)
+                        received += len(chunk)
+                        if limit is not None and received - resume_from >= limit:
+                            break
+                    if decryptor:
+                        await self._run(f.write, decryptor.finalize())
+                finally:
+                    await self._run(f.close)
+            size = await self._run(os.path.getsize, temp_path)
+            # 解密后的文件比密文少了填充，此时Content-Length只用于校验接收是否完整
+            expected_size = None if decryptor else expected_received
+            if expected_received is not None and received != expected_received:
+                logger.warning(f"[SEGMENT TRUNCATED] {received}/{expected_received} bytes for {url}")
+                if decryptor:
+                    await self._run(os.remove, temp_path)
+                return SegmentResult(False, status, size, expected_size)
+            await self._run(os.replace, temp_path, filepath)
+            return SegmentResult(True, status, size, expected_size)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logger.error(f"[SEGMENT ERROR] {e!r} for {url}")
+            return SegmentResult(False, None, 0, None)
+        except ValueError as e:
+            # 解密时密文不是整数个分组或填充错误：响应被截断、密钥不对或返回了错误页。与线程池引擎一样只让这个片段失败，
+            # 丢弃写了一半的临时文件后按可重试的失败处理
+            logger.error(f"[DECRYPT ERROR] {e!r} for {url}")
+            await self._run(_remove_partial, temp_path)
+            return SegmentResult(False, None, 0, None)
+
+    async def download_segment(self, segment, filepath):
+        """在并发限制内下载单个片段，可重试的失败按指数退避重试，返回最后一次的SegmentResult
+
+        segment可以是片段URL，也可以是m3u8_parser.Segment或InitSection（加密片段会边下载边解密，
+        字节范围片段只请求其中的一段）。
+        """
+        url = getattr(segment, "uri", segment)
+        task_start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                start = time.monotonic()
+                try:
+                    decryptor = await self.make_decryptor(segment)
+                # RuntimeError: 未安装cryptography，与线程池引擎一样只让这个片段失败，不中断整个下载
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, RuntimeError) as e:
+                    logger.error(f"[KEY ERROR] {e!r} for {url}")
+                    result = SegmentResult(False, None, 0, None)
+                else:
+                    result = await self.fetch_segment(url, filepath, decryptor, getattr(segment, "byterange", None))
+                    if result.ok and self.verify:
+                        result = await self._verify(url, filepath, result, getattr(segment, "duration", None))
+                metrics.SEGMENT_LATENCY.observe(time.monotonic() - start, engine="asyncio")
+            if result.ok or not is_retryable(result) or attempt == self.max_retries:
+                break
+            metrics.SEGMENT_RETRIES.inc(engine="asyncio")
+            await asyncio.sleep(backoff_delay(attempt))
+        metrics.record_segment("asyncio", url, result, attempt + 1, time.monotonic() - task_start)
+        return result
+
+    async def _verify(self, url, filepath, result, extinf):
+        """校验下载成功的片段；校验失败时删除文件，返回可重试的失败结果"""
+        verdict = await self._run(verify_segment, filepath, result.expected_size, extinf)
+        if verdict.ok:
+            return result
+        logger.warning(f"[SEGMENT INVALID] {verdict.problem}: {verdict.detail} for {url}")
+        metrics.SEGMENT_VERIFY_FAILURES.inc(engine="asyncio", problem=verdict.problem)
+        await self._run(os.remove, filepath)
+        return SegmentResult(False, None, 0, result.expected_size)
+
+    async def _download_one(self, index, segment, filepath, manifest, merger, position):
+        result = await self.download_segment(segment, filepath)
+        # 清单按间隔重写整个JSON文件，同样交给写入线程
+        await self._run(manifest.update, index, result)
+        if result.ok and merger:
+            merger.mark_done(position)
+        return result.ok
+
+    async def ensure_init_section(self, init_section, directory):
+        """直播跟随时按需下载初始化片段，返回其路径，下载失败时返回None
+
+        文件名由URI和字节范围的哈希得到，重启跟随后仍对应同一个#EXT-X-MAP；并发请求同一个初始化片段时共享一个任务。
+        """
+        path = os.path.join(directory, f"init_{zlib.crc32(repr(init_section).encode()):08x}.mp4")
+        task = self._init_fetches.get(path)
+        if task is None:
+            task = self._init_fetches[path] = asyncio.ensure_future(self.download_init_sections({init_section: path}))
+        if not await task:
+            self._init_fetches.pop(path, None)
+            return None
+        return path
+
+    async def download_init_sections(self, init_paths):
+        """下载尚未下载的初始化片段（#EXT-X-MAP），init_paths为{InitSection: 路径}，返回是否全部就绪"""
+        for init_section, path in init_paths.items():
+            if await self._run(os.path.exists, path):
+                continue
+            result = await self.download_segment(init_section, path)
+            if not result.ok:
+                logger.error(f"[SEGMENT FAILED] 初始化片段下载失败: {init_section.uri}")
+                return False
+        return True
+
+    async def download(self, segments, download_dir, merge_output=None):
+        """下载全部片段到download_dir，跳过任务清单中已完成的片段，返回是否全部成功
+
+        segments为片段URL列表或m3u8_parser.Segment列表；fMP4片段保存为.m4s，初始化片段先行下载。
+        指定merge_output时，边下载边把已完成的连续片段合并到该文件（合并在后台线程中进行）。
+        """
+        urls = [getattr(segment, "uri", segment) for segment in segments]
+        segment_paths = [os.path.join(download_dir, f"segment_{i:04d}"
+                                      f"{segment_extension(segment) if hasattr(segment, 'uri') else '.ts'}")
+                         for i, segment in enumerate(segments)]
+        init_paths = init_section_paths([segment for segment in segments if hasattr(segment, "uri")], download_dir)
+        merge_paths, merge_positions, init_positions = merge_order(segments, segment_paths, init_paths)
+        # 创建目录、读取清单和逐个检查已完成的片段都要访问磁盘，在写入线程中一次完成
+        manifest, completed = await self._run(_open_manifest, download_dir, urls, segment_paths)
+        merger = SegmentMerger(merge_paths, merge_output).start() if merge_output else None
+        inits_ok = await self.download_init_sections(init_paths)
+        if inits_ok and merger:
+            for position in init_positions:
+                merger.mark_done(position)
+        jobs = []
+        for i, segment in enumerate(segments):
+            if completed[i]:
+                if merger:
+                    merger.mark_done(merge_positions[i])
+            else:
+                jobs.append(self._download_one(i, segment, segment_paths[i], manifest, merger, merge_positions[i]))
+
+        start = time.monotonic()
+        logger.info(f"[SEGMENTS] {download_dir}: 共 {len(urls)} 个片段，需下载 {len(jobs)} 个，并发 {self.concurrency}")
+        try:
+            results = await asyncio.gather(*jobs)
+        finally:
+            await self._run(manifest.save)
+            merged = await asyncio.to_thread(merger.finish) if merger else True
+        failed = results.count(False)
+        logger.info(f"[SEGMENTS] {download_dir}: 完成 {len(urls) - failed}/{len(urls)}，"
+                    f"耗时 {time.monotonic() - start:.1f}s")
+        return failed == 0 and merged and inits_ok
@@ -0,0 +1,63 @@
+# async_writer.py
+"""事件循环之外的文件写入
+
+server.py的事件循环同时处理页面绑定回调、网络响应事件和下载任务，
+磁盘（尤其是网络存储）较慢时，直接在循环里写文件会阻塞所有消息处理。
+AsyncFileWriter把写入交给专用线程执行，并统计排队中的写入数量。
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path, data):
+    """先写入同目录的临时文件并落盘，再原子重命名为目标文件，读者不会看到写了一半的文件"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return len(data)
+
+
+class AsyncFileWriter:
+    """在专用线程中执行阻塞的文件操作，事件循环只等待结果
+
+    queue_depth为已提交但尚未完成的操作数，超过warn_depth时输出告警。
+    """
+
+    def __init__(self, workers=1, warn_depth=100, name="file-writer"):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.name = name
+        self.warn_depth = warn_depth
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+
+    async def call(self, func, *args):
+        """在写入线程中执行func(*args)并返回其结果"""
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        metrics.WRITER_QUEUE_DEPTH.set(self.queue_depth, writer=self.name)
+        if self.queue_depth == self.warn_depth:
+            logger.warning(f"[WRITER] 写入队列积压 {self.queue_depth} 个操作，磁盘可能过慢")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.queue_depth -= 1
+            self.completed += 1
+            metrics.WRITER_QUEUE_DEPTH.set(self.queue_depth, writer=self.name)
+
+    async def write(self, path, data):
+        """原子写入整个文件，返回写入的字节数"""
+        return await self.call(atomic_write, path, data)
+
+    def close(self):
+        """等待已提交的写入完成后关闭写入线程"""
+        self._executor.shutdown(wait=True)
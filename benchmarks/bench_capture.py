@@ -0,0 +1,164 @@
+# bench_capture.py
+"""server.py消息处理开销：把WS/XHR事件回放到RoomCapture.handle_from_page
+
+    python benchmarks/bench_capture.py                           # 合成的直播间事件
+    python benchmarks/bench_capture.py --batch 50                # 按页面脚本的批量格式回放
+    python benchmarks/bench_capture.py --recording events.jsonl  # 回放录制的pyReceive载荷
+
+分两个阶段：
+    handle      下载器替换为只计数的空实现，只测量解析、过滤和URL提取的开销
+    end-to-end  使用真实的M3U8Downloader，发现的m3u8从本地HLS替身服务器下载（仅合成事件，保证离线）
+录制文件每行一个pyReceive收到的JSON载荷（单个事件或{kind: "batch", events: [...]}）。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+import server  # noqa: E402
+from hls_server import HLSStandInServer  # noqa: E402
+
+
+class CountingDownloader:
+    """只记录download_m3u8调用次数的下载器，代替M3U8Downloader"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def spawn(self, coro):
+        coro.close()
+
+    def download_m3u8(self, url, response=None):
+        self.calls += 1
+        return asyncio.sleep(0)
+
+
+def synthetic_events(count, base_url, m3u8_ratio=0.01, playlists=20, seed=1):
+    """生成合成的页面事件：WS聊天/点赞消息、少量携带拉流地址的WS消息和XHR响应
+
+    拉流地址指向替身服务器上的playlists个不同播放列表，重复出现的URL考验去重。
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < m3u8_ratio:
+            url = f"{base_url}stream_{rng.randrange(playlists)}.m3u8?auth_key=1700000000-0-0-{i:x}"
+            payload = {"type": "liveInfo", "playUrl": url, "backupUrl": url, "extra": "x" * rng.randrange(200, 2000)}
+        elif roll < 0.5:
+            payload = {"type": "chat", "uid": rng.randrange(10 ** 9), "text": "老师讲得好" * rng.randrange(1, 40)}
+        elif roll < 0.9:
+            payload = {"type": "like", "count": rng.randrange(10 ** 6), "users": [rng.randrange(10 ** 9) for _ in range(50)]}
+        else:
+            events.append({"kind": "xhr_response", "url": f"{base_url}api/heartbeat?t={i}", "status": 200,
+                           "dataLength": 20, "dataPreview": '{"success": true}'})
+            continue
+        text = json.dumps(payload, ensure_ascii=False)
+        events.append({"kind": "ws_message_in", "url": "wss://example.invalid/ws", "dataLength": len(text),
+                       "dataPreview": text})
+    return events
+
+
+def load_recording(path):
+    """读取录制的pyReceive载荷，批量载荷展开为单个事件"""
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if isinstance(data, str):
+                data = json.loads(data)
+            events.extend((data.get("events") or []) if data.get("kind") == "batch" else [data])
+    return events
+
+
+def encode_payloads(events, batch):
+    """按页面脚本的发送格式编码为pyReceive收到的JSON字符串"""
+    if batch <= 1:
+        return [json.dumps(event, ensure_ascii=False) for event in events]
+    return [json.dumps({"kind": "batch", "events": events[i:i + batch]}, ensure_ascii=False)
+            for i in range(0, len(events), batch)]
+
+
+async def replay(room, payloads):
+    """逐条回放载荷，每条之后让出一次事件循环（与Playwright逐个回调的调度方式相同）"""
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag(0.01))
+    start = time.perf_counter()
+    for payload in payloads:
+        await room.handle_from_page(None, payload)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    lag_monitor.cancel()
+    return elapsed
+
+
+async def bench_handle(payloads, event_count):
+    downloader = CountingDownloader()
+    room = server.RoomCapture("bench", "about:blank", downloader)
+    elapsed = await replay(room, payloads)
+    print(f"handle      {len(payloads)} 次调用 / {event_count} 个事件  {elapsed * 1000:8.1f} ms  "
+          f"{elapsed / event_count * 1e6:7.2f} µs/事件  触发下载 {downloader.calls} 次")
+
+
+async def bench_end_to_end(payloads, event_count, work_dir):
+    downloader = await server.M3U8Downloader(download_dir=os.path.join(work_dir, "m3u8")).start()
+    room = server.RoomCapture("bench", "about:blank", downloader)
+    start = time.perf_counter()
+    await replay(room, payloads)
+    # 等待所有已发现播放列表的下载结束
+    while downloader.tasks:
+        await asyncio.gather(*list(downloader.tasks), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    saved = len([name for name in os.listdir(downloader.download_dir) if name.endswith(".m3u8")])
+    await downloader.close()
+    print(f"end-to-end  {event_count} 个事件  {elapsed * 1000:8.1f} ms  保存 {saved} 个播放列表  "
+          f"去重记录 {len(downloader.seen_keys)} 条")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="server.py消息处理基准测试")
+    parser.add_argument("--recording", help="录制的pyReceive载荷JSONL文件")
+    parser.add_argument("--events", type=int, default=20000, help="合成事件数量")
+    parser.add_argument("--batch", type=int, default=1, help="每次pyReceive调用携带的事件数")
+    parser.add_argument("--playlists", type=int, default=20, help="合成事件中不同播放列表的数量")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    # 基准测试只关心耗时，屏蔽逐条的日志输出
+    logging.getLogger().setLevel(logging.WARNING)
+    with HLSStandInServer(segment_count=10, segment_size=188) as stand_in:
+        if args.recording:
+            events = load_recording(args.recording)
+        else:
+            events = synthetic_events(args.events, stand_in.base_url, playlists=args.playlists)
+        payloads = encode_payloads(events, args.batch)
+        print(f"{len(events)} 个事件，{len(payloads)} 次pyReceive调用，"
+              f"共 {sum(map(len, payloads)) / 1024 / 1024:.1f} MB")
+        asyncio.run(bench_handle(payloads, len(events)))
+        if not args.recording:
+            work_dir = tempfile.mkdtemp(prefix="bench_capture_")
+            try:
+                asyncio.run(bench_end_to_end(payloads, len(events), work_dir))
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    lag_count = metrics.EVENT_LOOP_LAG.count()
+    if lag_count:
+        print(f"事件循环延迟: 平均 {metrics.EVENT_LOOP_LAG.total() / lag_count * 1000:.2f} ms（{lag_count} 次测量）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
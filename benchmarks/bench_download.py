@@ -0,0 +1,156 @@
+# bench_download.py
+"""download_tool.download_all_segments的吞吐量、内存峰值和片段延迟分位数
+
+在本地HLS替身服务器上下载全部片段，可模拟请求延迟、限速和随机503：
+    python benchmarks/bench_download.py --segments 500 --latency 0.02 --bandwidth 2000000 --error-rate 0.02
+    python benchmarks/bench_download.py --master --max-height 720      # 从主播放列表选择变体
+    python benchmarks/bench_download.py --trace-memory                  # 用tracemalloc统计Python堆峰值
+    python benchmarks/bench_download.py --byterange --merge             # fMP4字节范围播放列表，相邻范围合并请求
+    python benchmarks/bench_download.py --segment-size 8000000 --chunk-size 2 --latency 0.1   # 大片段分块并行
+
+延迟为每次download_ts_segment调用的耗时（含重试中的每一次），分位数按排序后取值；
+合并的字节范围请求和分块下载不经过download_ts_segment，此时以替身服务器统计的请求数为准。
+有错误注入时总耗时包含指数退避的等待，比较时应使用相同的--error-rate。
+--trace-memory会减慢分配，开启时吞吐量数字不可与未开启时比较。
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_tool  # noqa: E402
+from hls_server import HLSStandInServer  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def max_rss_mb():
+    """进程的常驻内存峰值（MB）；Linux上ru_maxrss单位为KB，macOS上为字节"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+@contextlib.contextmanager
+def record_latencies(latencies):
+    """替换download_tool.download_ts_segment，记录每次调用的耗时"""
+    original = download_tool.download_ts_segment
+    lock = threading.Lock()
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    download_tool.download_ts_segment = timed
+    try:
+        yield
+    finally:
+        download_tool.download_ts_segment = original
+
+
+def run(server, args):
+    """下载一遍全部片段，返回结果字典"""
+    if args.master:
+        content, base_url = server.master_playlist(), server.master_url
+    elif args.byterange:
+        content, base_url = server.byterange_playlist(), server.byterange_url
+    else:
+        content, base_url = server.playlist(), server.playlist_url
+    work_dir = tempfile.mkdtemp(prefix="bench_download_")
+    latencies = []
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        # 屏蔽逐片段的进度输出，避免打印本身影响计时
+        with record_latencies(latencies), contextlib.redirect_stdout(io.StringIO()):
+            ok = download_tool.download_all_segments(
+                content, os.path.join(work_dir, "segments"), base_url=base_url,
+                min_workers=args.min_workers, max_workers=args.max_workers, max_retries=args.max_retries,
+                merge_output=os.path.join(work_dir, "merged.ts") if args.merge else None,
+                max_height=args.max_height, progress=False,
+                chunk_size=int(args.chunk_size * 1024 * 1024) if args.chunk_size else None)
+        elapsed = time.perf_counter() - start
+    finally:
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+        if args.trace_memory:
+            tracemalloc.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    latencies.sort()
+    return {
+        "ok": ok,
+        "elapsed": elapsed,
+        "mb_per_s": server.segment_count * server.segment_size / 1024 / 1024 / elapsed,
+        "requests": len(latencies),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1] if latencies else 0.0,
+        "traced_peak_mb": traced_peak / 1024 / 1024 if traced_peak is not None else None,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="download_all_segments下载基准测试")
+    parser.add_argument("--segments", type=int, default=300)
+    parser.add_argument("--segment-size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.02, help="替身服务器每个请求的延迟（秒）")
+    parser.add_argument("--bandwidth", type=float, help="替身服务器每个连接的发送速率上限（字节/秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="片段请求返回503的比例")
+    parser.add_argument("--master", action="store_true", help="从主播放列表开始，测试变体选择")
+    parser.add_argument("--byterange", action="store_true", help="使用fMP4字节范围播放列表")
+    parser.add_argument("--chunk-size", type=float, metavar="MB", help="大于该大小的片段拆成并行的Range分块")
+    parser.add_argument("--max-height", type=int)
+    parser.add_argument("--min-workers", type=int, default=2)
+    parser.add_argument("--max-workers", type=int, default=16)
+    parser.add_argument("--max-retries", type=int, default=4)
+    parser.add_argument("--merge", action="store_true", help="边下载边合并")
+    parser.add_argument("--trace-memory", action="store_true", help="用tracemalloc统计Python堆峰值")
+    parser.add_argument("--repeat", type=int, default=1)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    with HLSStandInServer(args.segments, args.segment_size, args.latency, bandwidth=args.bandwidth,
+                          error_rate=args.error_rate) as server:
+        for i in range(args.repeat):
+            result = run(server, args)
+            memory = f"RSS峰值 {result['max_rss_mb']:.0f} MB" if result["max_rss_mb"] is not None else ""
+            if result["traced_peak_mb"] is not None:
+                memory += f"  Python堆峰值 {result['traced_peak_mb']:.1f} MB"
+            print(f"#{i + 1} {'OK' if result['ok'] else 'FAILED':<6} {result['elapsed']:7.2f}s  "
+                  f"{result['mb_per_s']:8.2f} MB/s  请求 {result['requests']}  "
+                  f"p50 {result['p50'] * 1000:.1f}ms  p95 {result['p95'] * 1000:.1f}ms  "
+                  f"p99 {result['p99'] * 1000:.1f}ms  max {result['max'] * 1000:.1f}ms  {memory}")
+        print(f"替身服务器: 片段请求 {server.requests} 次，注入错误 {server.errors} 次")
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
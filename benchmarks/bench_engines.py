@@ -0,0 +1,64 @@
+# bench_engines.py
+"""对比线程池引擎（download_tool.download_all_segments）与asyncio引擎（AsyncSegmentDownloader）
+
+两者下载同一个本地HLS替身服务器上的全部片段，输出耗时与吞吐量。
+    python benchmarks/bench_engines.py --segments 500 --segment-size 262144 --latency 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_tool  # noqa: E402
+from async_downloader import AsyncSegmentDownloader  # noqa: E402
+from hls_server import HLSStandInServer  # noqa: E402
+
+
+def bench_threaded(server, download_dir, workers):
+    content = "\n".join(server.segment_urls())
+    start = time.perf_counter()
+    # 屏蔽逐片段的进度输出，避免打印本身影响计时
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = download_tool.download_all_segments(content, download_dir, min_workers=workers, max_workers=workers)
+    return ok, time.perf_counter() - start
+
+
+def bench_async(server, download_dir, concurrency):
+    async def run():
+        async with AsyncSegmentDownloader(concurrency=concurrency) as downloader:
+            return await downloader.download(server.segment_urls(), download_dir)
+
+    start = time.perf_counter()
+    ok = asyncio.run(run())
+    return ok, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程池引擎与asyncio引擎的下载基准测试")
+    parser.add_argument("--segments", type=int, default=300)
+    parser.add_argument("--segment-size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.02, help="替身服务器每个请求的延迟（秒）")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    total_mb = args.segments * args.segment_size / 1024 / 1024
+    with HLSStandInServer(args.segments, args.segment_size, args.latency) as server:
+        for name, bench in (("threadpool", bench_threaded), ("asyncio", bench_async)):
+            work_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+            try:
+                ok, elapsed = bench(server, os.path.join(work_dir, "segments"), args.concurrency)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            print(f"{name:<10} {'OK' if ok else 'FAILED':<6} {elapsed:7.2f}s  {total_mb / elapsed:8.2f} MB/s  "
+                  f"{args.segments / elapsed:8.1f} seg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# bench_parser.py
+"""m3u8_parser在大型合成播放列表上的解析耗时
+
+    python benchmarks/bench_parser.py --segments 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m3u8_parser import parse_playlist  # noqa: E402
+
+
+def synthetic_playlist(segment_count, encrypted=False, byterange=False):
+    """生成合成的媒体播放列表：每100个片段轮换一次密钥并插入一个不连续标记"""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:4", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:1000"]
+    for i in range(segment_count):
+        if i % 100 == 0:
+            if i:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if encrypted:
+                lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="keys/{i // 100}.key",IV=0x{i:032x}')
+        lines.append("#EXTINF:4.000,")
+        if byterange:
+            lines.append("#EXT-X-BYTERANGE:524288")
+            lines.append("media.ts?auth_key=1700000000-0-0-abcdef")
+        else:
+            lines.append(f"{i:08d}.ts?auth_key=1700000000-0-0-abcdef")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="m3u8解析基准测试")
+    parser.add_argument("--segments", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    base_url = "https://dtliving-sz.dingtalk.com/live/stream.m3u8"
+    for name, options in (("plain", {}), ("encrypted", {"encrypted": True}), ("byterange", {"byterange": True})):
+        text = synthetic_playlist(args.segments, **options)
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            playlist = parse_playlist(text, base_url)
+            best = min(best, time.perf_counter() - start)
+        # 顺带校验解析结果，避免基准测量的是错误的解析
+        assert len(playlist.segments) == args.segments and playlist.ended
+        assert playlist.segments[-1].sequence == 1000 + args.segments - 1
+        if options.get("byterange"):
+            assert playlist.segments[-1].byterange.offset == (args.segments - 1) * 524288
+        print(f"{name:<10} {args.segments} 个片段 {len(text) / 1024 / 1024:6.1f} MB  "
+              f"{best * 1000:8.1f} ms  {args.segments / best / 1000:8.1f} k片段/s")
+
+
+if __name__ == "__main__":
+    main()
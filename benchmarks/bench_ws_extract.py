@@ -0,0 +1,95 @@
+# bench_ws_extract.py
+"""WS消息m3u8 URL提取的微基准：对比原先的4个正则逐条findall与预编译合并模式+子串预过滤
+
+    python benchmarks/bench_ws_extract.py                          # 使用合成的直播间消息
+    python benchmarks/bench_ws_extract.py --recording ws.jsonl     # 使用录制的WS消息
+
+录制文件每行一个pyReceive收到的JSON对象（kind为ws_message，取其dataPreview字段）。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import extract_m3u8_urls  # noqa: E402
+
+LEGACY_PATTERNS = [
+    r'(https?://[^\s<>"\'{}|\\^`]+?\.m3u8[^\s<>"\'{}|\\^`]*)',
+    r'(https?://[^\s<>"\'{}|\\^`]*?/live/[^\s<>"\'{}|\\^`]*\.m3u8[^\s<>"\'{}|\\^`]*)',
+    r'(http?://[^\s<>"\'{}|\\^`]+?\.m3u8[^\s<>"\'{}|\\^`]*)',
+    r'(http?://[^\s<>"\'{}|\\^`]*?/live/[^\s<>"\'{}|\\^`]*\.m3u8[^\s<>"\'{}|\\^`]*)',
+]
+
+
+def legacy_extract(text):
+    """原handle_from_page中的提取方式，返回全部匹配（含重复）"""
+    matches = []
+    for pattern in LEGACY_PATTERNS:
+        matches.extend(re.findall(pattern, text, re.IGNORECASE))
+    return matches
+
+
+def synthetic_messages(count, m3u8_ratio=0.01, seed=1):
+    """生成合成的直播间WS消息：大部分是聊天和点赞，少量携带拉流地址"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < m3u8_ratio:
+            url = f"https://dtliving-sz.dingtalk.com/live/{rng.randrange(10**8)}.m3u8?auth_key=1700000000-0-0-{i:x}"
+            payload = {"type": "liveInfo", "playUrl": url, "backupUrl": url, "extra": "x" * rng.randrange(200, 2000)}
+        elif roll < 0.6:
+            payload = {"type": "chat", "uid": rng.randrange(10**9), "text": "老师讲得好" * rng.randrange(1, 40)}
+        else:
+            payload = {"type": "like", "count": rng.randrange(10**6), "users": [rng.randrange(10**9) for _ in range(50)]}
+        messages.append(json.dumps(payload, ensure_ascii=False))
+    return messages
+
+
+def load_recording(path):
+    messages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if isinstance(data, str):
+                data = json.loads(data)
+            if data.get("kind") == "ws_message":
+                messages.append(data.get("dataPreview", ""))
+    return messages
+
+
+def bench(func, messages, repeat):
+    best = float("inf")
+    found = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = sum(len(func(message)) for message in messages)
+        best = min(best, time.perf_counter() - start)
+    return best, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WS消息m3u8提取微基准")
+    parser.add_argument("--recording", help="录制的WS消息JSONL文件")
+    parser.add_argument("--messages", type=int, default=20000, help="合成消息数量")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = load_recording(args.recording) if args.recording else synthetic_messages(args.messages)
+    print(f"{len(messages)} 条消息，共 {sum(map(len, messages)) / 1024 / 1024:.1f} MB")
+    for name, func in (("legacy", legacy_extract), ("combined", extract_m3u8_urls)):
+        elapsed, found = bench(func, messages, args.repeat)
+        print(f"{name:<10} {elapsed * 1000:8.1f} ms  {elapsed / len(messages) * 1e6:7.2f} µs/条  "
+              f"匹配 {found} 个（每个匹配都会触发一次download_m3u8任务）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# hls_server.py
+"""本地HLS替身服务器：在本机端口上提供合成的m3u8播放列表和TS片段，供基准测试离线使用
+
+    GET /live/master.m3u8           主播放列表，每个码率变体指向同一组片段
+    GET /live/stream.m3u8           媒体播放列表（片段为相对路径）
+    GET /live/stream_{n}.m3u8       码率变体n的媒体播放列表，内容与stream.m3u8相同
+    GET /live/seg_{n}.ts            第n个片段，支持Range请求
+    GET /live/byterange.m3u8        fMP4字节范围播放列表：初始化片段和全部片段都是media.mp4中的字节范围
+    GET /live/media.mp4             字节范围播放列表引用的单个资源，支持Range请求
+    GET /live/encrypted.m3u8        AES-128加密的媒体播放列表（不写IV，按媒体序列号推导）
+    GET /live/key.bin               加密播放列表的密钥
+    GET /live/enc_{n}.ts            第n个片段的密文（需要cryptography），支持Range请求
+"""
+import argparse
+import http.server
+import random
+import re
+import threading
+import time
+
+
+class HLSStandInServer:
+    """在后台线程中运行的HLS替身服务器
+
+    segment_count: 片段数量
+    segment_size: 每个片段的字节数，向下取整为188的整数倍
+    latency: 每个请求在返回响应头之前的延迟（秒）
+    bandwidth: 每个连接的发送速率上限（字节/秒），None表示不限速
+    error_rate: 片段请求返回503的比例，按seed生成，可重复
+    variants: 主播放列表中各码率变体的带宽（bps）
+    """
+
+    # 限速时每次发送的数据块大小
+    THROTTLE_CHUNK = 64 * 1024
+
+    def __init__(self, segment_count=200, segment_size=512 * 1024, latency=0.0, port=0, bandwidth=None,
+                 error_rate=0.0, variants=(800000, 2000000, 4000000), seed=1):
+        self.segment_count = segment_count
+        # 向下取整为完整的TS包，否则片段校验会把它当作截断的片段
+        self.segment_size = segment_size = max(188, segment_size - segment_size % 188)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.variants = tuple(variants)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        # 所有片段共享同一块数据，由空的TS包组成
+        self.segment_body = (b"\x47" + b"\x00" * 187) * (segment_size // 188)
+        # 字节范围播放列表使用的fMP4：初始化片段为一个ftyp box，每个片段为一个mdat box
+        self.init_body = b"\x00\x00\x00\x18ftypiso6\x00\x00\x00\x00iso6mp41"
+        self._media_body = None
+        # 加密播放列表使用的密钥和按序号缓存的密文
+        self.key = bytes(range(16))
+        self._encrypted_bodies = {}
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/live/"
+
+    @property
+    def playlist_url(self):
+        return self.base_url + "stream.m3u8"
+
+    def playlist(self):
+        """生成媒体播放列表文本"""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(self.segment_count):
+            lines.append("#EXTINF:4.000,")
+            lines.append(f"seg_{i}.ts?auth_key=bench-{i}")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def master_playlist(self):
+        """生成主播放列表文本，分辨率高度随带宽递增"""
+        lines = ["#EXTM3U"]
+        for i, bandwidth in enumerate(self.variants):
+            height = 360 * (i + 1)
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 16 // 9}x{height},'
+                         f'CODECS="avc1.64001f,mp4a.40.2"')
+            lines.append(f"stream_{i}.m3u8")
+        return "\n".join(lines) + "\n"
+
+    @property
+    def master_url(self):
+        return self.base_url + "master.m3u8"
+
+    @property
+    def byterange_url(self):
+        return self.base_url + "byterange.m3u8"
+
+    def byterange_playlist(self):
+        """生成fMP4字节范围播放列表：#EXT-X-MAP和各片段依次引用media.mp4中首尾相接的字节范围"""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0",
+                 f'#EXT-X-MAP:URI="media.mp4",BYTERANGE="{len(self.init_body)}@0"']
+        for i in range(self.segment_count):
+            lines.append("#EXTINF:4.000,")
+            # 省略偏移时紧接上一个媒体片段，#EXT-X-MAP不算，第一个片段需要写明偏移
+            lines.append(f"#EXT-X-BYTERANGE:{self.segment_size}" + ("" if i else f"@{len(self.init_body)}"))
+            lines.append("media.mp4")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def fmp4_segment(self, i):
+        """字节范围播放列表中第i个片段的内容：一个mdat box，载荷填充为i % 256，切分错位时能看出来"""
+        return self.segment_size.to_bytes(4, "big") + b"mdat" + bytes([i % 256]) * (self.segment_size - 8)
+
+    @property
+    def media_body(self):
+        """media.mp4的内容：初始化片段之后是全部片段，第一次请求时生成"""
+        with self._lock:
+            if self._media_body is None:
+                self._media_body = self.init_body + b"".join(map(self.fmp4_segment, range(self.segment_count)))
+            return self._media_body
+
+    @property
+    def encrypted_url(self):
+        return self.base_url + "encrypted.m3u8"
+
+    def encrypted_playlist(self):
+        """生成AES-128加密的媒体播放列表文本"""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0",
+                 '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"']
+        for i in range(self.segment_count):
+            lines.append("#EXTINF:4.000,")
+            lines.append(f"enc_{i}.ts")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def encrypted_segment(self, i):
+        """第i个片段的密文：segment_body按PKCS7填充后用key和序号IV做AES-128-CBC加密"""
+        with self._lock:
+            body = self._encrypted_bodies.get(i)
+            if body is None:
+                from cryptography.hazmat.primitives import padding
+                from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+                padder = padding.PKCS7(128).padder()
+                plain = padder.update(self.segment_body) + padder.finalize()
+                encryptor = Cipher(algorithms.AES(self.key), modes.CBC(i.to_bytes(16, "big"))).encryptor()
+                body = self._encrypted_bodies[i] = encryptor.update(plain) + encryptor.finalize()
+            return body
+
+    def _should_fail(self):
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def segment_urls(self):
+        """所有片段的绝对URL"""
+        return [f"{self.base_url}seg_{i}.ts?auth_key=bench-{i}" for i in range(self.segment_count)]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                path = self.path.split("?", 1)[0]
+                if path == "/live/master.m3u8":
+                    self._send(200, server.master_playlist().encode("utf-8"), "application/vnd.apple.mpegurl")
+                elif re.fullmatch(r"/live/stream(_\d+)?\.m3u8", path):
+                    self._send(200, server.playlist().encode("utf-8"), "application/vnd.apple.mpegurl")
+                elif path == "/live/byterange.m3u8":
+                    self._send(200, server.byterange_playlist().encode("utf-8"), "application/vnd.apple.mpegurl")
+                elif path == "/live/encrypted.m3u8":
+                    self._send(200, server.encrypted_playlist().encode("utf-8"), "application/vnd.apple.mpegurl")
+                elif path == "/live/key.bin":
+                    self._send(200, server.key, "application/octet-stream")
+                elif re.fullmatch(r"/live/enc_\d+\.ts", path):
+                    self._send_segment(server.encrypted_segment(int(path[len("/live/enc_"):-len(".ts")])))
+                elif re.fullmatch(r"/live/seg_\d+\.ts", path) or path == "/live/media.mp4":
+                    if server._should_fail():
+                        self._send(503, b"busy", "text/plain")
+                    else:
+                        self._send_segment(server.media_body if path == "/live/media.mp4" else server.segment_body)
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+            def _send_segment(self, body):
+                match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if not match:
+                    self._send(200, body, "video/mp2t")
+                    return
+                start = int(match.group(1))
+                end = min(int(match.group(2)), len(body) - 1) if match.group(2) else len(body) - 1
+                if start > end:
+                    self._send(416, b"", "video/mp2t", {"Content-Range": f"bytes */{len(body)}"})
+                    return
+                self._send(206, memoryview(body)[start:end + 1], "video/mp2t",
+                           {"Content-Range": f"bytes {start}-{end}/{len(body)}"})
+
+            def _send(self, status, body, content_type, extra_headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (extra_headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if not server.bandwidth:
+                    self.wfile.write(body)
+                    return
+                # 按带宽上限分块发送，模拟慢速链路
+                chunk_time = server.THROTTLE_CHUNK / server.bandwidth
+                view = memoryview(body)
+                for offset in range(0, len(body), server.THROTTLE_CHUNK):
+                    self.wfile.write(view[offset:offset + server.THROTTLE_CHUNK])
+                    time.sleep(chunk_time)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地HLS替身服务器")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--segments", type=int, default=200, help="片段数量")
+    parser.add_argument("--segment-size", type=int, default=512 * 1024, help="每个片段的字节数")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--bandwidth", type=float, help="每个连接的发送速率上限（字节/秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="片段请求返回503的比例")
+    args = parser.parse_args()
+    stand_in = HLSStandInServer(args.segments, args.segment_size, args.latency, args.port,
+                                bandwidth=args.bandwidth, error_rate=args.error_rate)
+    print(f"主播放列表: {stand_in.master_url}")
+    print(f"播放列表: {stand_in.playlist_url}")
+    try:
+        stand_in.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
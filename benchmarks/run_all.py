@@ -0,0 +1,63 @@
+# run_all.py
+"""依次运行全部基准测试，全部离线完成
+
+    python benchmarks/run_all.py            # 默认规模
+    python benchmarks/run_all.py --quick    # 缩小规模，用于发布前的快速回归检查
+    python benchmarks/run_all.py --only download capture
+
+每个基准测试在独立的子进程中运行，互不影响内存峰值等进程级统计；任一失败时退出码为1。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 名称: (脚本, 默认参数, --quick参数)
+BENCHMARKS = {
+    "parser": ("bench_parser.py", [], ["--segments", "10000", "--repeat", "3"]),
+    "ws_extract": ("bench_ws_extract.py", [], ["--messages", "5000", "--repeat", "3"]),
+    "capture": ("bench_capture.py", [], ["--events", "5000"]),
+    "capture_batched": ("bench_capture.py", ["--batch", "50"], ["--events", "5000", "--batch", "50"]),
+    "download": ("bench_download.py", [], ["--segments", "100"]),
+    "download_faulty": ("bench_download.py", ["--error-rate", "0.02", "--bandwidth", "4000000"],
+                        ["--segments", "60", "--error-rate", "0.02", "--bandwidth", "4000000"]),
+    "download_memory": ("bench_download.py", ["--trace-memory", "--merge"],
+                        ["--segments", "60", "--trace-memory", "--merge"]),
+    "download_byterange": ("bench_download.py", ["--byterange", "--merge"],
+                           ["--segments", "100", "--byterange", "--merge"]),
+    "download_chunked": ("bench_download.py", ["--segments", "20", "--segment-size", "8000000", "--chunk-size", "2"],
+                         ["--segments", "5", "--segment-size", "8000000", "--chunk-size", "2"]),
+    # 片段小于分块大小：第一个分块就是整个片段
+    "download_chunked_small": ("bench_download.py", ["--segments", "50", "--segment-size", "1000000", "--chunk-size", "2"],
+                               ["--segments", "5", "--segment-size", "1000000", "--chunk-size", "2"]),
+    "engines": ("bench_engines.py", [], ["--segments", "100"]),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="运行全部基准测试")
+    parser.add_argument("--quick", action="store_true", help="使用较小的规模")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="只运行指定的基准测试")
+    args = parser.parse_args()
+
+    failed = []
+    for name in args.only or BENCHMARKS:
+        script, default_args, quick_args = BENCHMARKS[name]
+        command = [sys.executable, os.path.join(BENCH_DIR, script)] + (quick_args if args.quick else default_args)
+        print(f"=== {name}: {' '.join(command[1:])}", flush=True)
+        start = time.perf_counter()
+        code = subprocess.call(command)
+        print(f"=== {name}: {'OK' if code == 0 else f'FAILED ({code})'}  {time.perf_counter() - start:.1f}s\n",
+              flush=True)
+        if code != 0:
+            failed.append(name)
+    if failed:
+        print(f"失败: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+# browser_config.py
+"""浏览器启动配置，server.py和browser_daemon.py共用
+
+只包含常量，不导入Playwright，也不配置日志，守护进程读取这些配置时不需要加载整个采集模块。
+"""
+
+BROWSER_ARGS = [
+    "--disable-features=IsolateOrigins,site-per-process",
+    "--remote-debugging-port=9222",
+    "--disable-web-security",
+    "--allow-running-insecure-content"
+]
+
+EDGE_PATHS = [
+    "C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe",
+    "C:\\Program Files\\Microsoft\\Edge\\Application\\msedge.exe",
+    "/Applications/Microsoft Edge.app/Contents/MacOS/Microsoft Edge",
+    "/usr/bin/microsoft-edge",
+    "/usr/bin/microsoft-edge-stable"
+]
+
+# 轻量采集模式额外使用的低资源启动参数；后台标签页的定时器和渲染不被节流，保证各直播间的监控脚本持续运行
+LIGHTWEIGHT_BROWSER_ARGS = [
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-component-update",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-dev-shm-usage",
+    "--no-first-run",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+    "--disable-background-timer-throttling",
+    "--disable-renderer-backgrounding",
+    "--disable-backgrounding-occluded-windows",
+]
+
+# 旧版手动启动的浏览器使用的调试地址（BROWSER_ARGS中的--remote-debugging-port）
+DEFAULT_CDP_ENDPOINT = "http://localhost:9222"
@@ -0,0 +1,258 @@
+# browser_daemon.py
+"""常驻浏览器守护进程：启动一个开启远程调试端口的浏览器并保持运行，短时的采集任务通过CDP连接它
+
+    python browser_daemon.py start [--headless] [--lightweight] [--port 9222] [--user-data-dir DIR]
+    python browser_daemon.py status
+    python browser_daemon.py stop
+
+守护进程把CDP地址写入状态文件（默认.browser_daemon/state.json），server.py启动时读取它并用
+connect_over_cdp连接，省去每次启动浏览器的数秒，连接后通常不到一秒就开始采集。
+浏览器意外退出或调试端口失去响应时守护进程会重新启动它；停止守护进程时关闭浏览器并删除状态文件。
+本模块只依赖标准库，只有找不到Edge、需要使用Playwright自带的Chromium时才导入Playwright。
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from browser_config import BROWSER_ARGS, EDGE_PATHS, LIGHTWEIGHT_BROWSER_ARGS
+
+logger = logging.getLogger(__name__)
+
+# 状态文件和浏览器配置目录放在downloaded_m3u8之外，采集目录中只有播放列表和片段，补录索引时不会扫描浏览器缓存
+DAEMON_DIR = ".browser_daemon"
+STATE_FILE = os.path.join(DAEMON_DIR, "state.json")
+DEFAULT_PORT = 9222
+# 浏览器配置目录：新版Chrome/Edge不允许默认配置目录开启远程调试
+DEFAULT_USER_DATA_DIR = os.path.join(DAEMON_DIR, "profile")
+# 健康检查间隔（秒）；连续失败多少次后重启浏览器
+HEALTH_INTERVAL = 5
+HEALTH_FAILURES = 3
+# 浏览器启动后等待调试端口就绪的最长时间（秒）
+STARTUP_TIMEOUT = 30
+# 浏览器反复退出时，两次重启之间的最长等待（秒）
+MAX_RESTART_DELAY = 60
+
+
+def fetch_version(endpoint, timeout=1.0):
+    """请求CDP的/json/version，返回浏览器版本信息；端口没有响应时返回None"""
+    try:
+        with urllib.request.urlopen(endpoint.rstrip("/") + "/json/version", timeout=timeout) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def read_state(path=STATE_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(path, state):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def daemon_endpoint(path=STATE_FILE, timeout=0.5):
+    """返回正在运行的守护进程浏览器的CDP地址；没有状态文件或浏览器没有响应时返回None"""
+    state = read_state(path)
+    if not state or not state.get("endpoint"):
+        return None
+    if fetch_version(state["endpoint"], timeout) is None:
+        return None
+    return state["endpoint"]
+
+
+def find_browser_executable():
+    """优先使用Edge，找不到时使用Playwright自带的Chromium"""
+    executable = next((path for path in EDGE_PATHS if os.path.exists(path)), None)
+    if executable:
+        return executable
+    from playwright.sync_api import sync_playwright
+    with sync_playwright() as pw:
+        return pw.chromium.executable_path
+
+
+class BrowserDaemon:
+    """启动并看护一个开启远程调试端口的浏览器进程"""
+
+    def __init__(self, port=DEFAULT_PORT, headless=False, lightweight=False, user_data_dir=DEFAULT_USER_DATA_DIR,
+                 state_path=STATE_FILE, executable=None):
+        self.port = port
+        self.headless = headless or lightweight
+        self.lightweight = lightweight
+        self.user_data_dir = os.path.abspath(user_data_dir)
+        self.state_path = state_path
+        self.executable = executable
+        self.endpoint = f"http://127.0.0.1:{port}"
+        self.process = None
+        self._stopping = False
+
+    def browser_args(self):
+        args = [arg for arg in BROWSER_ARGS if not arg.startswith("--remote-debugging-port")]
+        args += [f"--remote-debugging-port={self.port}", "--remote-debugging-address=127.0.0.1",
+                 f"--user-data-dir={self.user_data_dir}", "--no-first-run", "--no-default-browser-check"]
+        if self.lightweight:
+            args += LIGHTWEIGHT_BROWSER_ARGS
+        if self.headless:
+            args.append("--headless=new")
+        return list(dict.fromkeys(args)) + ["about:blank"]
+
+    def start_browser(self):
+        """启动浏览器并等待调试端口就绪，写入状态文件；端口超时未就绪时抛出RuntimeError"""
+        if fetch_version(self.endpoint) is not None:
+            raise RuntimeError(f"端口 {self.port} 已被其他浏览器占用，请先关闭它或换一个端口")
+        os.makedirs(self.user_data_dir, exist_ok=True)
+        self.process = subprocess.Popen([self.executable] + self.browser_args(), stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while (version := fetch_version(self.endpoint)) is None:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"浏览器启动后立即退出，退出码 {self.process.returncode}")
+            if time.monotonic() > deadline:
+                self.stop_browser()
+                raise RuntimeError(f"浏览器在 {STARTUP_TIMEOUT} 秒内没有开启调试端口 {self.port}")
+            time.sleep(0.2)
+        _write_state(self.state_path, {
+            "endpoint": self.endpoint,
+            "ws_endpoint": version.get("webSocketDebuggerUrl"),
+            "browser": version.get("Browser"),
+            "daemon_pid": os.getpid(),
+            "browser_pid": self.process.pid,
+            "headless": self.headless,
+            "lightweight": self.lightweight,
+            "user_data_dir": self.user_data_dir,
+            "started_at": time.time(),
+        })
+        logger.info(f"[DAEMON] 浏览器已就绪: {version.get('Browser')}，CDP地址 {self.endpoint}")
+
+    def stop_browser(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def _handle_signal(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        """在前台运行直到收到SIGTERM/SIGINT：浏览器退出或连续健康检查失败时按指数退避重新启动"""
+        self.executable = self.executable or find_browser_executable()
+        logger.info(f"[DAEMON] 浏览器路径: {self.executable}")
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        restart_delay = 1
+        try:
+            while not self._stopping:
+                try:
+                    self.start_browser()
+                except RuntimeError as e:
+                    logger.error(f"[DAEMON] {e}")
+                else:
+                    started = time.monotonic()
+                    self._watch()
+                    # 运行超过一分钟才退出的视为偶发崩溃，退避时间从头开始
+                    if time.monotonic() - started > 60:
+                        restart_delay = 1
+                if self._stopping:
+                    break
+                logger.warning(f"[DAEMON] {restart_delay} 秒后重新启动浏览器")
+                self._sleep(restart_delay)
+                restart_delay = min(restart_delay * 2, MAX_RESTART_DELAY)
+        finally:
+            self.stop_browser()
+            if (read_state(self.state_path) or {}).get("daemon_pid") == os.getpid():
+                os.remove(self.state_path)
+            logger.info("[DAEMON] 已停止")
+
+    def _watch(self):
+        """等待浏览器退出或调试端口失去响应"""
+        failures = 0
+        while not self._stopping:
+            self._sleep(HEALTH_INTERVAL)
+            if self.process.poll() is not None:
+                logger.error(f"[DAEMON] 浏览器已退出，退出码 {self.process.returncode}")
+                return
+            failures = 0 if fetch_version(self.endpoint, timeout=2.0) is not None else failures + 1
+            if failures >= HEALTH_FAILURES:
+                logger.error(f"[DAEMON] 调试端口连续 {failures} 次没有响应，重启浏览器")
+                self.stop_browser()
+                return
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self._stopping and time.monotonic() < deadline:
+            time.sleep(min(0.2, deadline - time.monotonic()))
+
+
+def status(state_path=STATE_FILE):
+    state = read_state(state_path)
+    if not state:
+        print("守护进程未运行")
+        return 1
+    version = fetch_version(state["endpoint"])
+    print(f"CDP地址: {state['endpoint']}  守护进程PID: {state['daemon_pid']}  浏览器PID: {state['browser_pid']}")
+    print(f"启动于: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['started_at']))}  "
+          f"浏览器: {version.get('Browser') if version else '没有响应'}")
+    return 0 if version else 1
+
+
+def stop(state_path=STATE_FILE):
+    state = read_state(state_path)
+    if not state:
+        print("守护进程未运行")
+        return 1
+    try:
+        os.kill(state["daemon_pid"], signal.SIGTERM)
+    except OSError as e:
+        # 守护进程已不存在（例如被强制结束），清理遗留的浏览器和状态文件
+        print(f"无法通知守护进程: {e}，直接结束浏览器")
+        try:
+            os.kill(state["browser_pid"], signal.SIGTERM)
+        except OSError:
+            pass
+        os.remove(state_path)
+        return 0
+    print(f"已通知守护进程 {state['daemon_pid']} 停止")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="常驻浏览器守护进程，供server.py通过CDP连接")
+    parser.add_argument("command", choices=["start", "status", "stop"])
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="远程调试端口")
+    parser.add_argument("--headless", action="store_true", help="以无头模式运行浏览器")
+    parser.add_argument("--lightweight", action="store_true", help="使用低资源启动参数（隐含--headless）")
+    parser.add_argument("--user-data-dir", default=DEFAULT_USER_DATA_DIR, help="浏览器配置目录，登录状态保存在其中")
+    parser.add_argument("--executable", help="浏览器可执行文件路径，默认优先使用Edge")
+    parser.add_argument("--state-file", default=STATE_FILE, help="写入CDP地址的状态文件")
+    args = parser.parse_args(argv)
+    if args.command == "status":
+        return status(args.state_file)
+    if args.command == "stop":
+        return stop(args.state_file)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    BrowserDaemon(args.port, args.headless, args.lightweight, args.user_data_dir, args.state_file,
+                  args.executable).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
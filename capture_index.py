@@ -0,0 +1,238 @@
+# capture_index.py
+"""采集索引：用SQLite记录已保存的播放列表和片段下载任务
+
+    playlists  每个保存的m3u8文件一行：直播间、URL及去重键、抓取时间、来源、片段数、总时长、是否已结束
+    jobs       每次片段下载一行：对应的播放列表、输出目录和文件、状态、片段数、起止时间
+
+server.py用它跨重启去重，download_tool.py用它列出播放列表和判断哪些播放列表还没有处理，
+都不需要扫描downloaded_m3u8目录。连接可在多个线程中共享，所有操作由一个锁串行化。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from m3u8_parser import parse_playlist
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "capture_index.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    path TEXT PRIMARY KEY,
+    room TEXT,
+    url TEXT,
+    url_key TEXT,
+    captured_at REAL NOT NULL,
+    source TEXT,
+    is_master INTEGER NOT NULL DEFAULT 0,
+    ended INTEGER NOT NULL DEFAULT 0,
+    segment_count INTEGER,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS playlists_url_key ON playlists (url_key);
+CREATE INDEX IF NOT EXISTS playlists_captured_at ON playlists (captured_at);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist_path TEXT NOT NULL,
+    playlist_captured_at REAL,
+    room TEXT,
+    output_dir TEXT,
+    output_path TEXT,
+    status TEXT NOT NULL,
+    segment_count INTEGER,
+    duration REAL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_playlist_path ON jobs (playlist_path);
+"""
+
+# 鉴权签名、过期时间等每次下发都会变化的query参数，去重时忽略
+VOLATILE_QUERY_PARAMS = frozenset({
+    "auth_key", "auth", "token", "sign", "signature", "expires", "t", "ts", "timestamp", "nonce", "_",
+    "key-pair-id", "policy", "x-oss-signature", "x-oss-expires", "x-oss-access-key-id",
+})
+
+
+def normalize_url_key(url):
+    """去掉易变鉴权参数后的URL，作为播放列表的去重键"""
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name.lower() not in VOLATILE_QUERY_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+# 任务状态
+JOB_RUNNING = "running"
+JOB_OK = "ok"
+JOB_FAILED = "failed"
+
+
+class CaptureIndex:
+    """采集索引，默认保存在downloaded_m3u8/capture_index.sqlite3
+
+    created为True表示索引文件是本次新建的，调用方可据此用backfill导入已有的文件。
+    """
+
+    def __init__(self, path=os.path.join("downloaded_m3u8", INDEX_FILENAME)):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.created = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL模式下读不阻塞写，采集进程和下载工具可以同时打开同一个索引
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def record_playlist(self, path, url=None, url_key=None, room=None, source=None, playlist=None,
+                        captured_at=None):
+        """记录（或更新）一个已保存的播放列表；playlist为m3u8_parser的解析结果，用于记录片段数、时长和是否结束"""
+        is_master = bool(playlist is not None and playlist.is_master)
+        ended = bool(playlist is not None and not is_master and playlist.ended)
+        segment_count = duration = None
+        if playlist is not None and not is_master:
+            segment_count, duration = len(playlist.segments), playlist.total_duration
+        self._execute(
+            "INSERT INTO playlists (path, room, url, url_key, captured_at, source, is_master, ended, segment_count,"
+            " duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET"
+            " room=excluded.room, url=excluded.url, url_key=excluded.url_key, captured_at=excluded.captured_at,"
+            " source=excluded.source, is_master=excluded.is_master, ended=excluded.ended,"
+            " segment_count=excluded.segment_count, duration=excluded.duration",
+            (os.path.normpath(path), room, url, url_key, captured_at or time.time(), source, is_master, ended,
+             segment_count, duration))
+
+    def playlist_url(self, path):
+        """返回记录的播放列表URL；不在索引中或没有记录URL时返回None"""
+        rows = self._execute("SELECT url FROM playlists WHERE path = ?", (os.path.normpath(path),))
+        return rows[0]["url"] if rows else None
+
+    def is_captured(self, url_key):
+        """该去重键对应的播放列表是否已完整保存过
+
+        只有已结束（#EXT-X-ENDLIST）的媒体播放列表算作已保存：直播中的播放列表在重启后需要继续跟随，
+        主播放列表重新请求的代价很小，且需要由它找到码率变体。
+        """
+        return bool(self._execute("SELECT 1 FROM playlists WHERE url_key = ? AND ended = 1 LIMIT 1", (url_key,)))
+
+    def list_playlists(self, directory=None):
+        """按抓取时间从新到旧返回播放列表记录；指定directory时只返回该目录（含子目录）下的
+
+        只查询索引，不检查文件是否还在；文件已被删除的记录由prune_missing清理。
+        """
+        if directory is None:
+            return self._execute("SELECT * FROM playlists ORDER BY captured_at DESC")
+        prefix = os.path.join(os.path.normpath(directory), "")
+        return self._execute("SELECT * FROM playlists WHERE substr(path, 1, ?) = ? ORDER BY captured_at DESC",
+                             (len(prefix), prefix))
+
+    def pending_playlists(self, directory=None):
+        """返回尚未成功处理、或成功处理后又被重新保存的媒体播放列表路径，按抓取时间从旧到新"""
+        rows = self._execute(
+            "SELECT p.path, p.captured_at FROM playlists p WHERE p.is_master = 0 AND p.captured_at > COALESCE("
+            "(SELECT MAX(j.playlist_captured_at) FROM jobs j WHERE j.playlist_path = p.path AND j.status = ?), 0)"
+            " ORDER BY p.captured_at", (JOB_OK,))
+        prefix = os.path.join(os.path.normpath(directory), "") if directory is not None else ""
+        return [row["path"] for row in rows if row["path"].startswith(prefix)]
+
+    def start_job(self, playlist_path, output_dir=None, output_path=None, room=None):
+        """记录一个开始运行的片段下载任务，返回任务id"""
+        playlist_path = os.path.normpath(playlist_path)
+        with self._lock:
+            row = self._conn.execute("SELECT captured_at FROM playlists WHERE path = ?", (playlist_path,)).fetchone()
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (playlist_path, playlist_captured_at, room, output_dir, output_path, status,"
+                " started_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (playlist_path, row["captured_at"] if row else None, room, output_dir, output_path, JOB_RUNNING,
+                 time.time()))
+            return cursor.lastrowid
+
+    def finish_job(self, job_id, ok, segment_count=None, duration=None):
+        self._execute(
+            "UPDATE jobs SET status = ?, segment_count = COALESCE(?, segment_count),"
+            " duration = COALESCE(?, duration), finished_at = ? WHERE id = ?",
+            (JOB_OK if ok else JOB_FAILED, segment_count, duration, time.time(), job_id))
+
+    def jobs(self, playlist_path=None):
+        if playlist_path is None:
+            return self._execute("SELECT * FROM jobs ORDER BY started_at DESC")
+        return self._execute("SELECT * FROM jobs WHERE playlist_path = ? ORDER BY started_at DESC",
+                             (os.path.normpath(playlist_path),))
+
+    def prune_missing(self, directory=None):
+        """删除文件已不存在的播放列表记录（下载任务记录保留），返回删除的数量"""
+        prefix = os.path.join(os.path.normpath(directory), "") if directory is not None else ""
+        missing = [(row["path"],) for row in self._execute("SELECT path FROM playlists")
+                   if row["path"].startswith(prefix) and not os.path.exists(row["path"])]
+        if missing:
+            with self._lock:
+                self._conn.executemany("DELETE FROM playlists WHERE path = ?", missing)
+        return len(missing)
+
+    def backfill(self, directory):
+        """扫描一次directory（含子目录），把索引中还没有的m3u8文件补录进来，返回补录的数量
+
+        抓取时间使用文件修改时间；有server.py保存的.meta.json时从中读取URL和来源。
+        以.开头的目录（例如旧版本放在这里的浏览器配置目录）不扫描。
+        """
+        known = {row["path"] for row in self._execute("SELECT path FROM playlists")}
+        added = 0
+        for root, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for filename in filenames:
+                if not filename.endswith(".m3u8"):
+                    continue
+                path = os.path.normpath(os.path.join(root, filename))
+                if path in known:
+                    continue
+                mod_time = os.path.getmtime(path)
+                metadata = {}
+                try:
+                    with open(path + ".meta.json", "r", encoding="utf-8") as f:
+                        metadata = json.load(f)
+                except (OSError, ValueError):
+                    pass
+                url = metadata.get("url")
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        playlist = parse_playlist(f.read(), url)
+                except (OSError, ValueError):
+                    playlist = None
+                room = os.path.relpath(root, directory)
+                self.record_playlist(path, url=url, url_key=normalize_url_key(url) if url else None,
+                                     room=None if room == "." else room, source=metadata.get("source", "backfill"),
+                                     playlist=playlist, captured_at=mod_time)
+                added += 1
+        return added
+
+
+def open_index(directory="downloaded_m3u8"):
+    """打开directory下的采集索引；索引是新建的时候先从目录中补录已有的播放列表（只扫描这一次）"""
+    index = CaptureIndex(os.path.join(directory, INDEX_FILENAME))
+    if index.created:
+        added = index.backfill(directory)
+        if added:
+            logger.info(f"[INDEX] 新建采集索引 {index.path}，补录已有的播放列表 {added} 个")
+    return index
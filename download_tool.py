@@ -1,31 +1,48 @@
 import os
-import re
-import requests
 from datetime import datetime
+import argparse
 import concurrent.futures
+import contextlib
+import glob
+import sys
 import threading
+import json
+import random
+import shutil
+import subprocess
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
 
+import metrics
+from capture_index import open_index
+from hls_crypto import KeyCache, SegmentDecryptor, check_key_method, sequence_iv
+from m3u8_parser import parse_playlist, resolve_playlist_text, select_variant
+from segment_verify import verify_segment
 
-def list_m3u8_files():
-    """列出downloaded_m3u8目录下的所有文件，并按日期排序"""
+
+def list_m3u8_files(index=None):
+    """列出downloaded_m3u8目录（含各直播间子目录）下的所有m3u8文件，并按日期排序
+
+    文件列表来自采集索引，不扫描目录；索引第一次创建时会从目录中补录已有的文件。
+    返回[(相对于downloaded_m3u8的文件名, 日期字符串, 抓取时间戳)]。
+    """
     directory = "downloaded_m3u8"
 
     if not os.path.exists(directory):
         print(f"目录 {directory} 不存在")
         return []
 
-    # 获取文件列表及其修改时间
+    if index is None:
+        with open_capture_index() as index:
+            return list_m3u8_files(index)
     files = []
-    for filename in os.listdir(directory):
-        if filename.endswith(".m3u8"):
-            filepath = os.path.join(directory, filename)
-            mod_time = os.path.getmtime(filepath)
-            mod_date = datetime.fromtimestamp(mod_time).strftime('%Y-%m-%d %H:%M:%S')
-            files.append((filename, mod_date, mod_time))
-
-    # 按修改时间排序（新的在前）
-    files.sort(key=lambda x: x[2], reverse=True)
+    for row in index.list_playlists(directory):
+        filename = os.path.relpath(row["path"], directory)
+        mod_date = datetime.fromtimestamp(row["captured_at"]).strftime('%Y-%m-%d %H:%M:%S')
+        files.append((filename, mod_date, row["captured_at"]))
 
+    # 索引已按抓取时间排序（新的在前）
     return files
 
 
@@ -37,30 +54,40 @@ def display_files(files):
         print(f"{i}\t{filename}\t{mod_date}")
 
 
-def process_m3u8_file(selected_file, prefix_url):
-    """处理选中的m3u8文件，修改内容并保存到temp目录"""
-    input_path = os.path.join("downloaded_m3u8", selected_file)
+def output_basename(playlist_path, directory="downloaded_m3u8"):
+    """播放列表在输出目录中使用的文件名
+
+    directory下的播放列表取相对路径，各级之间用_连接（room_a/index.m3u8 -> room_a_index.m3u8），
+    各直播间子目录中的同名播放列表不会写入同一个输出文件；其他位置的播放列表只取文件名。
+    """
+    path = os.path.normpath(playlist_path)
+    relative = os.path.relpath(path, directory)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return os.path.basename(path)
+    return relative.replace(os.sep, "_")
+
+
+def process_m3u8_file(selected_file, prefix_url, temp_dir="temp"):
+    """处理选中的m3u8文件，把相对URI解析为以prefix_url为基准的绝对URL，保存到temp_dir目录
+
+    selected_file可以是downloaded_m3u8目录下的文件名，也可以是任意m3u8文件的路径。
+    """
+    if os.path.isfile(selected_file):
+        input_path = selected_file
+    else:
+        input_path = os.path.join("downloaded_m3u8", selected_file)
 
     # 创建temp目录（如果不存在）
-    temp_dir = "temp"
     if not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
 
-    output_path = os.path.join(temp_dir, selected_file)
+    output_path = os.path.join(temp_dir, output_basename(input_path))
 
     with open(input_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
-    modified_lines = []
-    for line in lines:
-        line_strip = line.strip()
-        if line_strip.endswith(".ts") or (".ts?" in line_strip):
-            # 保留原有的.ts链接及其query参数，加上前缀
-            modified_lines.append(prefix_url + line_strip + "\n")
-        else:
-            modified_lines.append(line)
+        content = f.read()
 
-    modified_content = "".join(modified_lines)
+    # 片段和密钥的相对URI按播放列表地址解析为绝对URL，保留原有的query参数
+    modified_content = resolve_playlist_text(content, prefix_url)
 
     # 保存修改后的文件
     with open(output_path, 'w', encoding='utf-8') as f:
@@ -69,83 +96,1048 @@ def process_m3u8_file(selected_file, prefix_url):
     return output_path, modified_content
 
 
-def download_ts_segment(url, segment_name, download_dir):
-    """下载单个TS片段，使用伪造请求头，保留URL的query参数"""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
-                      " Chrome/114.0.0.0 Safari/537.36",
-        "Referer": url,
-        "Accept": "*/*",
-        "Connection": "keep-alive",
-    }
+def playlist_base_url(path, index=None, default=None):
+    """解析播放列表中相对URI使用的基准URL
+
+    依次使用采集索引中记录的播放列表URL、server.py保存在旁边的.meta.json中的URL，都没有时使用default（--base-url）。
+    """
+    url = index.playlist_url(path) if index is not None else None
+    if url:
+        return url
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        if response.status_code == 200:
-            filepath = os.path.join(download_dir, segment_name)
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            return True
-        else:
-            print(f"下载失败: {url}, 状态码: {response.status_code}")
-            return False
+        with open(path + ".meta.json", "r", encoding="utf-8") as f:
+            url = json.load(f).get("url")
+    except (OSError, ValueError):
+        url = None
+    return url or default
+
+
+# 下载TS片段时使用的伪造请求头（Referer按片段URL单独设置）
+SEGMENT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
+                  " Chrome/114.0.0.0 Safari/537.36",
+    "Accept": "*/*",
+    "Connection": "keep-alive",
+}
+
+
+def create_session(pool_size):
+    """创建带连接池的requests会话，供所有下载线程共享，每个主机的连接数上限等于线程数"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    session.headers.update(SEGMENT_HEADERS)
+    # pool_block=True: 连接数达到上限时等待空闲连接，而不是新建一次性连接
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def report_pool_stats(session):
+    """输出会话中每个主机的连接上限与连接复用情况"""
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            reused = max(pool.num_requests - pool.num_connections, 0)
+            print(f"连接池 {pool.scheme}://{pool.host}:{pool.port}: 上限 {pool.pool.maxsize if pool.pool else 0} 个连接，"
+                  f"新建 {pool.num_connections} 个，请求 {pool.num_requests} 次，复用 {reused} 次")
+
+
+# 流式写入时每个线程复用的读缓冲区大小，内存占用与片段大小无关
+STREAM_CHUNK_SIZE = 256 * 1024
+_thread_local = threading.local()
+
+
+def _get_stream_buffer():
+    """获取当前线程复用的读缓冲区"""
+    buffer = getattr(_thread_local, "stream_buffer", None)
+    if buffer is None:
+        buffer = _thread_local.stream_buffer = bytearray(STREAM_CHUNK_SIZE)
+    return buffer
+
+
+def _iter_body(response, skip=0):
+    """按块读取响应体，丢弃开头的skip个字节；产出的memoryview指向线程复用的缓冲区，读取下一块前必须用完"""
+    buffer = _get_stream_buffer()
+    view = memoryview(buffer)
+    # 与iter_content一致，按Content-Encoding解码后再写入
+    response.raw.decode_content = True
+    while True:
+        n = response.raw.readinto(buffer)
+        if not n:
+            return
+        if skip >= n:
+            skip -= n
+            continue
+        yield view[skip:n]
+        skip = 0
+
+
+def stream_to_file(response, filepath, resume_from=0, decryptor=None, skip=0, limit=None):
+    """将响应体分块写入临时文件filepath + ".part"，返回累计接收的字节数（含续传前已有的resume_from字节）
+
+    resume_from大于0时追加写入已有的临时文件（HTTP Range续传），
+    写入中断时保留临时文件，供下次运行继续下载。
+    传入decryptor时在写入前逐块解密，不需要对文件再做一遍解密。
+    skip和limit用于服务器忽略Range、返回完整资源时，只截取其中的[skip, skip + limit)字节。
+    """
+    temp_path = filepath + ".part"
+    received = resume_from
+    with open(temp_path, 'ab' if resume_from else 'wb') as f:
+        for chunk in _iter_body(response, skip):
+            if limit is not None:
+                chunk = chunk[:limit - (received - resume_from)]
+            f.write(decryptor.update(chunk) if decryptor else chunk)
+            received += len(chunk)
+            if limit is not None and received - resume_from >= limit:
+                break
+        if decryptor:
+            f.write(decryptor.finalize())
+    return received
+
+
+# 单个片段的下载结果：是否成功、HTTP状态码、文件字节数、服务器声明的完整大小（未知时为None）
+SegmentResult = namedtuple("SegmentResult", ["ok", "status", "size", "expected_size"])
+
+
+def _http(session):
+    """返回session；没有传入会话时返回requests模块本身（requests导入较慢，只在第一次发起请求时导入）"""
+    if session is not None:
+        return session
+    import requests
+    return requests
+
+
+def fetch_key(uri, session=None):
+    """下载AES-128密钥"""
+    response = _http(session).get(uri, headers=dict(SEGMENT_HEADERS, Referer=uri), timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+def download_ts_segment(url, segment_name, download_dir, session=None, decryptor=None, byterange=None):
+    """下载单个TS片段，使用伪造请求头，保留URL的query参数；传入session时复用其连接池
+
+    如果存在上次中断留下的临时文件，使用HTTP Range请求从断点继续下载。
+    传入decryptor（hls_crypto.SegmentDecryptor）时边下载边解密；CBC解密无法从明文断点继续，
+    因此加密片段总是从头下载。
+    byterange（m3u8_parser.ByteRange）表示片段只是资源中的一段（#EXT-X-BYTERANGE），用Range请求只下载这一段。
+    """
+    filepath = os.path.join(download_dir, segment_name)
+    temp_path = filepath + ".part"
+    resume_from = os.path.getsize(temp_path) if os.path.exists(temp_path) and not decryptor else 0
+    headers = dict(SEGMENT_HEADERS, Referer=url)
+    if byterange:
+        if resume_from >= byterange.length:
+            resume_from = 0
+        end = byterange.offset + byterange.length - 1
+        headers["Range"] = f"bytes={byterange.offset + resume_from}-{end}"
+    elif resume_from:
+        headers["Range"] = f"bytes={resume_from}-"
+    try:
+        with _http(session).get(url, headers=headers, timeout=30, stream=True) as response:
+            status = response.status_code
+            if status == 416 and resume_from:
+                # 临时文件已不可用（例如服务器上的文件发生了变化），丢弃后重新下载
+                os.remove(temp_path)
+                return download_ts_segment(url, segment_name, download_dir, session, byterange=byterange)
+            if status not in (200, 206):
+                print(f"下载失败: {url}, 状态码: {status}")
+                return SegmentResult(False, status, 0, None)
+            if response.headers.get("Content-Type", "").startswith("text/html"):
+                # CDN或网关以200返回的错误页，按可重试的失败处理
+                print(f"下载失败: {url}, 返回的是HTML页面")
+                return SegmentResult(False, status, 0, None)
+            skip = limit = None
+            if status == 200:
+                # 服务器不支持Range时返回完整内容，从头写入；字节范围片段从中截取所需的一段
+                resume_from = 0
+                if byterange:
+                    skip, limit = byterange.offset, byterange.length
+            content_length = response.headers.get("Content-Length")
+            if limit is not None:
+                expected_received = limit
+            # 压缩传输时写入的是解压后的字节数，无法与Content-Length比较
+            elif content_length and "Content-Encoding" not in response.headers:
+                expected_received = resume_from + int(content_length)
+            else:
+                expected_received = None
+            received = stream_to_file(response, filepath, resume_from, decryptor, skip or 0, limit)
+        size = os.path.getsize(temp_path)
+        # 解密后的文件比密文少了填充，此时Content-Length只用于校验接收是否完整
+        expected_size = None if decryptor else expected_received
+        if expected_received is not None and received != expected_received:
+            print(f"下载不完整: {url}, 已接收 {received}/{expected_received} 字节")
+            if decryptor:
+                os.remove(temp_path)
+            return SegmentResult(False, status, size, expected_size)
+        os.replace(temp_path, filepath)
+        return SegmentResult(True, status, size, expected_size)
     except Exception as e:
         print(f"下载出错: {url}, 错误: {str(e)}")
-        return False
+        return SegmentResult(False, None, 0, None)
+
+
+def download_range_group(url, byteranges, filepaths, session=None):
+    """用一个Range请求下载同一资源上首尾相接的多个字节范围，按各自的长度依次切分写入filepaths
+
+    返回与filepaths一一对应的SegmentResult列表；中途断开时已写完的片段保留，其余片段标记为失败。
+    """
+    start = byteranges[0].offset
+    total = sum(byterange.length for byterange in byteranges)
+    headers = dict(SEGMENT_HEADERS, Referer=url, Range=f"bytes={start}-{start + total - 1}")
+    results = [SegmentResult(False, None, 0, None)] * len(filepaths)
+    try:
+        with _http(session).get(url, headers=headers, timeout=30, stream=True) as response:
+            status = response.status_code
+            if status not in (200, 206):
+                print(f"下载失败: {url}, 状态码: {status}")
+                return [SegmentResult(False, status, 0, None)] * len(filepaths)
+            # 服务器不支持Range时返回完整资源，跳过范围之前的字节
+            body = _iter_body(response, start if status == 200 else 0)
+            chunk = memoryview(b"")
+            for k, (byterange, filepath) in enumerate(zip(byteranges, filepaths)):
+                temp_path = filepath + ".part"
+                remaining = byterange.length
+                with open(temp_path, 'wb') as f:
+                    while remaining:
+                        if not chunk:
+                            chunk = next(body, None)
+                            if chunk is None:
+                                break
+                        piece = chunk[:remaining]
+                        f.write(piece)
+                        remaining -= len(piece)
+                        chunk = chunk[len(piece):]
+                if remaining:
+                    print(f"下载不完整: {url}, 第 {k + 1}/{len(filepaths)} 个字节范围已接收 "
+                          f"{byterange.length - remaining}/{byterange.length} 字节")
+                    os.remove(temp_path)
+                    results[k] = SegmentResult(False, status, 0, byterange.length)
+                    break
+                os.replace(temp_path, filepath)
+                results[k] = SegmentResult(True, status, byterange.length, byterange.length)
+    except Exception as e:
+        print(f"下载出错: {url}, 错误: {str(e)}")
+    return results
+
+
+def _parse_content_range_total(value):
+    """从Content-Range（bytes 0-1023/4096）中取出资源总大小，未知时返回None"""
+    total = (value or "").rpartition("/")[2].strip()
+    return int(total) if total.isdigit() else None
+
+
+def download_segment_chunked(url, segment_name, download_dir, session, executor, chunk_size, byterange=None,
+                             budget=None):
+    """把一个大片段拆成多个chunk_size字节的Range请求，在executor中并行下载后写入同一个文件
+
+    片段大小未知时先请求第一个分块，从Content-Range得到总大小，片段不大于一个分块时这一个请求就已下载完整；
+    已知片段不大于一个分块、或服务器不支持Range时退回download_ts_segment。分块写入filepath + ".chunks"，
+    全部完成后才重命名，失败时整个丢弃（不与.part的断点续传混用）。
+    budget为全局并发信号量，每个分块请求各自占用一个名额。
+    """
+    filepath = os.path.join(download_dir, segment_name)
+    temp_path = filepath + ".chunks"
+    base = byterange.offset if byterange else 0
+    size = byterange.length if byterange else None
+    slot = budget or contextlib.nullcontext()
+    if size is not None and size <= chunk_size:
+        with slot:
+            return download_ts_segment(url, segment_name, download_dir, session, byterange=byterange)
+
+    def fetch_chunk(offset, length):
+        """下载片段中[offset, offset + length)的字节，写入临时文件的对应位置，返回(状态码, 字节数, Content-Range)"""
+        headers = dict(SEGMENT_HEADERS, Referer=url, Range=f"bytes={base + offset}-{base + offset + length - 1}")
+        try:
+            with slot, session.get(url, headers=headers, timeout=30, stream=True) as response:
+                if response.status_code != 206:
+                    return response.status_code, 0, None
+                written = 0
+                # 每个分块使用自己的文件句柄，在不同位置写入互不干扰
+                with open(temp_path, 'r+b') as f:
+                    f.seek(offset)
+                    for chunk in _iter_body(response):
+                        chunk = chunk[:length - written]
+                        f.write(chunk)
+                        written += len(chunk)
+                        if written >= length:
+                            break
+                return 206, written, response.headers.get("Content-Range")
+        except Exception as e:
+            print(f"下载出错: {url} 的分块 {offset}-{offset + length - 1}, 错误: {str(e)}")
+            return None, 0, None
+
+    try:
+        with open(temp_path, 'wb'):
+            pass
+        first_length = chunk_size if size is None else min(chunk_size, size)
+        status, written, content_range = fetch_chunk(0, first_length)
+        if status == 200:
+            os.remove(temp_path)
+            with slot:
+                return download_ts_segment(url, segment_name, download_dir, session, byterange=byterange)
+        if status != 206:
+            print(f"下载失败: {url}, 状态码: {status}")
+            os.remove(temp_path)
+            return SegmentResult(False, status, 0, None)
+        if size is None:
+            size = _parse_content_range_total(content_range)
+            if size is None:
+                print(f"下载失败: {url}, 无法从Content-Range得到片段大小: {content_range}")
+                os.remove(temp_path)
+                return SegmentResult(False, None, 0, None)
+            # 片段不大于一个分块时第一个分块就是整个片段
+            first_length = min(first_length, size)
+        chunks = [(offset, min(chunk_size, size - offset)) for offset in range(first_length, size, chunk_size)]
+        results = [(status, written, first_length)]
+        futures = [(executor.submit(fetch_chunk, offset, length), length) for offset, length in chunks]
+        results.extend((*future.result()[:2], length) for future, length in futures)
+        for chunk_status, chunk_written, length in results:
+            if chunk_status != 206 or chunk_written != length:
+                print(f"下载不完整: {url}, 分块状态码 {chunk_status}，已接收 {chunk_written}/{length} 字节")
+                os.remove(temp_path)
+                return SegmentResult(False, chunk_status, 0, size)
+        os.replace(temp_path, filepath)
+        return SegmentResult(True, 206, size, size)
+    except Exception as e:
+        print(f"下载出错: {url}, 错误: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return SegmentResult(False, None, 0, None)
+
+
+class SegmentManifest:
+    """下载任务清单，保存在_segments目录旁，记录每个片段的URL、序号、字节数和状态"""
+
+    # 两次落盘之间的最短间隔（秒），避免每完成一个片段就重写整个清单
+    SAVE_INTERVAL = 2.0
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.segments = {}
+        self._last_save = 0.0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.segments = {entry["index"]: entry for entry in data.get("segments", [])}
+            except (ValueError, KeyError, OSError) as e:
+                print(f"任务清单 {path} 无法读取，将重新下载全部片段: {e}")
+
+    @staticmethod
+    def manifest_path(download_dir):
+        """返回下载目录对应的任务清单路径"""
+        return os.path.normpath(download_dir) + ".manifest.json"
+
+    def sync(self, urls):
+        """用当前播放列表更新清单；同一序号的URL路径不变时保留已有状态（query中的鉴权参数每次可能不同）"""
+        with self.lock:
+            segments = {}
+            for index, url in enumerate(urls):
+                entry = self.segments.get(index)
+                if entry is None or urlsplit(entry["url"]).path != urlsplit(url).path:
+                    entry = {"index": index, "url": url, "size": 0, "expected_size": None, "status": "pending"}
+                entry["url"] = url
+                segments[index] = entry
+            self.segments = segments
+
+    def is_complete(self, index, filepath):
+        """片段已完成：清单状态为done，且磁盘文件大小与记录的大小（以及Content-Length）一致"""
+        entry = self.segments.get(index)
+        if entry is None or entry["status"] != "done" or not os.path.exists(filepath):
+            return False
+        size = os.path.getsize(filepath)
+        if size != entry["size"]:
+            return False
+        return entry["expected_size"] is None or size == entry["expected_size"]
+
+    def update(self, index, result):
+        """记录片段的下载结果，并按间隔落盘"""
+        with self.lock:
+            entry = self.segments[index]
+            entry["status"] = "done" if result.ok else "failed"
+            entry["size"] = result.size
+            entry["expected_size"] = result.expected_size
+            if time.monotonic() - self._last_save >= self.SAVE_INTERVAL:
+                self._save_locked()
+
+    def save(self):
+        """立即将清单写入磁盘"""
+        with self.lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        data = {"segments": [self.segments[index] for index in sorted(self.segments)]}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self._last_save = time.monotonic()
+
+
+class AdaptiveConcurrency:
+    """自适应并发控制器：按观测窗口统计吞吐量、延迟和429/5xx比例，在上下限之间调整并发数
+
+    采用加性增、乘性减：出现限流时并发数减半；平均延迟超过基线的LATENCY_RATIO倍时减一（链路已排队，
+    增加并发只会拉长每个请求）；否则吞吐量仍在提升时加一，吞吐量下降时减一。
+    """
+
+    # 每个观测窗口的最短时长（秒）
+    WINDOW = 2.0
+    # 窗口内429/5xx请求占比超过该值时视为被CDN限流
+    THROTTLE_RATIO = 0.05
+    # 窗口平均延迟超过基线的该倍数时视为排队
+    LATENCY_RATIO = 2.0
+    # 延迟基线取各窗口平均延迟的最小值，但每个窗口最多上浮该比例，网络条件整体变化后基线能逐渐跟上
+    BASELINE_DRIFT = 1.1
+
+    def __init__(self, min_workers=2, max_workers=16, initial=None):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = min(max(initial or self.min_workers, self.min_workers), self.max_workers)
+        self.active = 0
+        self.cond = threading.Condition()
+        self._last_rate = 0.0
+        self._base_latency = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_requests = 0
+        self._window_throttled = 0
+        self._window_latency = 0.0
+
+    def acquire(self):
+        """等待直到当前并发数低于上限"""
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
 
+    def release(self, result, latency, size=None):
+        """归还并发名额，并记录本次请求的状态码、字节数和耗时
 
-def download_all_segments(m3u8_content, download_dir, base_url="https://dtliving-sz.dingtalk.com/live/"):
-    """多线程下载m3u8文件中的所有视频片段，伪造请求头，保留query参数"""
+        size为这次请求实际收到的字节数，省略时取成功结果的result.size；合并下载多个片段时由调用方传入合计值。
+        """
+        with self.cond:
+            self.active -= 1
+            self._window_requests += 1
+            self._window_latency += latency
+            self._window_bytes += (result.size if result.ok else 0) if size is None else size
+            if result.status is not None and (result.status == 429 or result.status >= 500):
+                self._window_throttled += 1
+            if time.monotonic() - self._window_start >= self.WINDOW and self._window_requests >= self.limit:
+                self._adjust()
+            self.cond.notify_all()
+
+    def _adjust(self):
+        elapsed = time.monotonic() - self._window_start
+        rate = self._window_bytes / elapsed
+        throttle_ratio = self._window_throttled / self._window_requests
+        mean_latency = self._window_latency / self._window_requests
+        old_limit = self.limit
+        base_latency = self._base_latency
+        if throttle_ratio > self.THROTTLE_RATIO:
+            self.limit = max(self.min_workers, self.limit // 2)
+        elif base_latency is not None and mean_latency > base_latency * self.LATENCY_RATIO:
+            self.limit = max(self.min_workers, self.limit - 1)
+        elif rate >= self._last_rate * 0.95:
+            self.limit = min(self.max_workers, self.limit + 1)
+        else:
+            self.limit = max(self.min_workers, self.limit - 1)
+        if self.limit != old_limit:
+            print(f"并发数调整: {old_limit} -> {self.limit}（吞吐量 {rate / 1024 / 1024:.2f} MB/s，"
+                  f"平均延迟 {mean_latency:.2f}s，基线 {base_latency or mean_latency:.2f}s，"
+                  f"限流比例 {throttle_ratio:.1%}）")
+        self._base_latency = (mean_latency if base_latency is None
+                              else min(mean_latency, base_latency * self.BASELINE_DRIFT))
+        self._last_rate = rate
+        self._reset_window()
+
+
+class BudgetTimer:
+    """包装全局并发名额，统计至少占用一个名额的总时长
+
+    批处理时多个播放列表共享全局并发预算，等待名额的排队时间不是链路延迟，计入后会让AdaptiveConcurrency
+    误判为排队而降低并发。分块下载时多个分块并行占用名额，重叠的部分只计一次。
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget or contextlib.nullcontext()
+        self.lock = threading.Lock()
+        self.held = 0
+        self.since = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.budget.__enter__()
+        with self.lock:
+            if self.held == 0:
+                self.since = time.monotonic()
+            self.held += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.held -= 1
+            if self.held == 0:
+                self.elapsed += time.monotonic() - self.since
+        return self.budget.__exit__(*exc_info)
+
+
+def is_retryable(result):
+    """网络错误、下载不完整、429和5xx可以重试；其他4xx（如403、404）重试也无意义"""
+    return result.status is None or result.status in (200, 206, 429) or result.status >= 500
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """指数退避加全抖动：在[0, min(cap, base * 2^attempt)]之间随机取值"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# 无法零拷贝时使用的合并缓冲区大小
+MERGE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def append_file(src_path, dst_fd):
+    """将src_path的内容追加到文件描述符dst_fd，优先使用copy_file_range/sendfile零拷贝"""
+    with open(src_path, 'rb') as src:
+        remaining = os.fstat(src.fileno()).st_size
+        src_fd = src.fileno()
+        try:
+            if hasattr(os, "copy_file_range"):
+                while remaining > 0:
+                    copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            else:
+                offset = 0
+                while remaining > 0:
+                    copied = os.sendfile(dst_fd, src_fd, offset, remaining)
+                    if copied == 0:
+                        break
+                    offset += copied
+                    remaining -= copied
+                src.seek(offset)
+        except (OSError, AttributeError):
+            # 文件系统或平台不支持零拷贝（如Windows），从当前位置继续用大缓冲区复制
+            pass
+        while remaining > 0:
+            chunk = src.read(min(MERGE_BUFFER_SIZE, remaining))
+            if not chunk:
+                break
+            os.write(dst_fd, chunk)
+            remaining -= len(chunk)
+
+
+class SegmentMerger:
+    """在下载进行中按播放列表顺序合并片段：每当已完成的片段形成连续前缀，就追加到输出文件
+
+    全部片段合并完成后，临时文件output_path + ".part"才会重命名为output_path。
+    """
+
+    def __init__(self, segment_paths, output_path):
+        self.segment_paths = segment_paths
+        self.output_path = output_path
+        self.done = [False] * len(segment_paths)
+        self.merged_count = 0
+        self.cond = threading.Condition()
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def mark_done(self, index):
+        """通知合并线程第index个片段已下载完成"""
+        with self.cond:
+            self.done[index] = True
+            self.cond.notify()
+
+    def finish(self):
+        """不再有新片段完成：等待合并线程处理完已完成的前缀，返回是否全部合并"""
+        with self.cond:
+            self._finished = True
+            self.cond.notify()
+        self._thread.join()
+        complete = self.merged_count == len(self.segment_paths)
+        if complete:
+            os.replace(self.output_path + ".part", self.output_path)
+            print(f"合并完成: {self.output_path}")
+        else:
+            print(f"合并未完成: 第 {self.merged_count + 1} 个片段缺失，已合并 {self.merged_count}/{len(self.segment_paths)} 个")
+        return complete
+
+    def _run(self):
+        fd = os.open(self.output_path + ".part", os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0))
+        try:
+            while self.merged_count < len(self.segment_paths):
+                with self.cond:
+                    while not self.done[self.merged_count] and not self._finished:
+                        self.cond.wait()
+                    if not self.done[self.merged_count]:
+                        break
+                append_file(self.segment_paths[self.merged_count], fd)
+                self.merged_count += 1
+        finally:
+            os.close(fd)
+
+
+def remux_to_mp4(ts_path, mp4_path=None):
+    """调用本机ffmpeg将合并后的TS无损转封装为MP4，返回MP4路径；未安装ffmpeg或失败时返回None"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        print("未找到ffmpeg，跳过转封装MP4")
+        return None
+    mp4_path = mp4_path or os.path.splitext(ts_path)[0] + ".mp4"
+    command = [ffmpeg, "-y", "-loglevel", "error", "-i", ts_path, "-c", "copy", "-bsf:a", "aac_adtstoasc", mp4_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"转封装MP4失败: {result.stderr.strip()}")
+        return None
+    print(f"已转封装为MP4: {mp4_path}")
+    return mp4_path
+
+
+def load_media_playlist(m3u8_content, base_url, max_bandwidth=None, max_height=None):
+    """解析播放列表；如果是主播放列表，按带宽/分辨率选择变体并下载其媒体播放列表"""
+    playlist = parse_playlist(m3u8_content, base_url)
+    if not playlist.is_master:
+        return playlist
+    variant = select_variant(playlist, max_bandwidth, max_height)
+    if variant is None:
+        print("主播放列表中没有可用的码率变体")
+        return None
+    resolution = "x".join(map(str, variant.resolution)) if variant.resolution else "未知分辨率"
+    print(f"主播放列表包含 {len(playlist.variants)} 个变体，选择 {variant.bandwidth} bps / {resolution}")
+    response = _http(None).get(variant.uri, headers=dict(SEGMENT_HEADERS, Referer=variant.uri), timeout=30)
+    response.raise_for_status()
+    return parse_playlist(response.text, variant.uri)
+
+
+# 合并相邻字节范围时单个请求的最大字节数
+COALESCE_MAX_BYTES = 16 * 1024 * 1024
+# 大片段拆分为并行分块时，额外用于分块请求的线程数
+CHUNK_WORKERS = 4
+
+
+def segment_extension(segment):
+    """片段文件的扩展名：fMP4片段（有#EXT-X-MAP，或URI为.m4s/.mp4）为.m4s，其余保留URI的扩展名（如打包音频的.aac），
+    没有扩展名或扩展名不是简单的字母数字时为.ts
+
+    segment_verify按扩展名选择校验方式，只有.ts片段做MPEG-TS的同步字节和包对齐检查。
+    """
+    if segment.init_section is not None:
+        return ".m4s"
+    extension = os.path.splitext(urlsplit(segment.uri).path)[1].lower()
+    if extension in (".m4s", ".mp4"):
+        return ".m4s"
+    if 1 < len(extension) <= 8 and extension[1:].isascii() and extension[1:].isalnum():
+        return extension
+    return ".ts"
+
+
+def plan_range_requests(pending, max_bytes=COALESCE_MAX_BYTES):
+    """把待下载的(序号, 片段)分组为下载单元，返回单元列表
+
+    同一资源上首尾相接、未加密的字节范围片段（#EXT-X-BYTERANGE）合并为一个单元，用一个Range请求下载，
+    单元合计不超过max_bytes；其余片段各自一个单元。加密片段需要按片段分别解密，不参与合并。
+    """
+    units = []
+    size = 0
+    for i, segment in pending:
+        if units:
+            last_i, last = units[-1][-1]
+            if (last_i == i - 1 and segment.uri == last.uri and segment.key is None and last.key is None
+                    and segment.byterange and last.byterange
+                    and segment.byterange.offset == last.byterange.offset + last.byterange.length
+                    and size + segment.byterange.length <= max_bytes):
+                units[-1].append((i, segment))
+                size += segment.byterange.length
+                continue
+        units.append([(i, segment)])
+        size = segment.byterange.length if segment.byterange else 0
+    return units
+
+
+def init_section_paths(segments, download_dir):
+    """为播放列表中各个不同的初始化片段（#EXT-X-MAP）分配文件路径init_XX.mp4，返回{InitSection: 路径}"""
+    paths = {}
+    for segment in segments:
+        if segment.init_section is not None and segment.init_section not in paths:
+            paths[segment.init_section] = os.path.join(download_dir, f"init_{len(paths):02d}.mp4")
+    return paths
+
+
+def merge_order(segments, segment_paths, init_paths):
+    """计算合并顺序：第一个片段和#EXT-X-MAP发生变化的片段之前先写入对应的初始化片段
+
+    返回(合并的文件路径列表, 每个片段在其中的位置, 初始化片段在其中的位置)。
+    """
+    merge_paths, merge_positions, init_positions = [], [], []
+    current_init = None
+    for segment, path in zip(segments, segment_paths):
+        init_section = getattr(segment, "init_section", None)
+        if init_section is not None and init_section != current_init:
+            current_init = init_section
+            init_positions.append(len(merge_paths))
+            merge_paths.append(init_paths[init_section])
+        merge_positions.append(len(merge_paths))
+        merge_paths.append(path)
+    return merge_paths, merge_positions, init_positions
+
+
+def download_init_sections(init_paths, download_dir, session, max_retries=4, verify=True):
+    """下载尚未下载的初始化片段，失败时按指数退避重试，返回是否全部就绪
+
+    verify为True时与普通片段一样用segment_verify校验，截断的或HTML错误页的初始化片段删除后重新下载。
+    """
+    for init_section, path in init_paths.items():
+        if os.path.exists(path):
+            continue
+        for attempt in range(max_retries + 1):
+            result = download_ts_segment(init_section.uri, os.path.basename(path), download_dir, session,
+                                         byterange=init_section.byterange)
+            if result.ok and verify:
+                verdict = verify_segment(path, result.expected_size)
+                if not verdict.ok:
+                    print(f"初始化片段校验失败 [{verdict.problem}]: {verdict.detail}")
+                    metrics.SEGMENT_VERIFY_FAILURES.inc(engine="threadpool", problem=verdict.problem)
+                    os.remove(path)
+                    result = SegmentResult(False, None, 0, result.expected_size)
+            if result.ok or not is_retryable(result) or attempt == max_retries:
+                break
+            time.sleep(backoff_delay(attempt))
+        if not result.ok:
+            print(f"初始化片段下载失败: {init_section.uri}")
+            return False
+    return True
+
+
+def download_all_segments(m3u8_content, download_dir, base_url="https://dtliving-sz.dingtalk.com/live/",
+                          min_workers=2, max_workers=16, max_retries=4, merge_output=None,
+                          max_bandwidth=None, max_height=None, budget=None, progress=True, chunk_size=None,
+                          verify=True):
+    """多线程下载m3u8文件中的所有视频片段，伪造请求头，保留query参数
+
+    相对URI按base_url解析；主播放列表按max_bandwidth/max_height选择码率变体。
+    下载进度记录在任务清单中，重新运行时跳过已完成的片段，只重试缺失或失败的片段。
+    并发数在min_workers和max_workers之间自适应调整，失败的片段按指数退避重试max_retries次。
+    指定merge_output时，边下载边把已完成的连续片段合并到该文件；fMP4播放列表在开头和每次
+    #EXT-X-MAP变化处写入初始化片段。
+    同一资源上相邻的字节范围片段合并为一个Range请求；指定chunk_size时，大于chunk_size字节的
+    未加密片段拆成多个Range请求并行下载。
+    verify为True时每个片段下载完成后立即用segment_verify校验，校验失败的片段删除后按重试策略重新下载。
+    budget为多个下载任务共享的信号量，限制所有任务合计的并发请求数；progress为False时不输出逐片段进度。
+    """
     # 创建下载目录（如果不存在）
     if not os.path.exists(download_dir):
         os.makedirs(download_dir)
 
-    # 提取所有.ts链接（完整URL，包含query参数）
-    lines = m3u8_content.splitlines()
-    ts_urls = []
-    for line in lines:
-        line_strip = line.strip()
-        if line_strip.startswith("http") and (".ts" in line_strip):
-            ts_urls.append(line_strip)
+    # 提取所有片段链接（完整URL，包含query参数）
+    playlist = load_media_playlist(m3u8_content, base_url, max_bandwidth, max_height)
+    segments = playlist.segments if playlist else []
+    ts_urls = [segment.uri for segment in segments]
 
     if not ts_urls:
         print("未找到TS片段链接")
         return False
+    try:
+        for segment in segments:
+            check_key_method(segment.key)
+    except ValueError as e:
+        print(e)
+        return False
+
+    manifest = SegmentManifest(SegmentManifest.manifest_path(download_dir))
+    manifest.sync(ts_urls)
+    segment_paths = [os.path.join(download_dir, f"segment_{i:04d}{segment_extension(segment)}")
+                     for i, segment in enumerate(segments)]
+    init_paths = init_section_paths(segments, download_dir)
+    merge_paths, merge_positions, init_positions = merge_order(segments, segment_paths, init_paths)
+    merger = SegmentMerger(merge_paths, merge_output).start() if merge_output else None
+    pending = []
+    for i, segment in enumerate(segments):
+        if manifest.is_complete(i, segment_paths[i]):
+            if merger:
+                merger.mark_done(merge_positions[i])
+        else:
+            pending.append((i, segment))
+    skipped = len(ts_urls) - len(pending)
+    if skipped:
+        print(f"跳过 {skipped} 个已完成的片段")
+
+    controller = AdaptiveConcurrency(min_workers, max_workers)
+    # 所有线程共享同一个连接池，避免每个片段都重新进行TCP+TLS握手
+    session = create_session(controller.max_workers + (CHUNK_WORKERS if chunk_size else 0))
+    with session:
+        inits_ok = download_init_sections(init_paths, download_dir, session, max_retries, verify)
+        if inits_ok and merger:
+            for position in init_positions:
+                merger.mark_done(position)
+        if not pending:
+            manifest.save()
+            print(f"下载完成: {len(ts_urls)}/{len(ts_urls)} 个片段成功下载")
+            return (merger.finish() if merger else True) and inits_ok
 
-    # 询问用户并行下载线程数，默认为5
+        coalesce_bytes = min(chunk_size or COALESCE_MAX_BYTES, COALESCE_MAX_BYTES)
+        units = plan_range_requests(pending, coalesce_bytes)
+        coalesced = len(pending) - len(units)
+        print(f"找到 {len(ts_urls)} 个TS片段，需下载 {len(pending)} 个"
+              f"{f'（相邻字节范围合并后 {len(units)} 个请求）' if coalesced else ''}，"
+              f"并发数 {controller.min_workers}-{controller.max_workers} 自适应...")
+        success_count = skipped
+        total = len(ts_urls)
+        success_lock = threading.Lock()
+        key_cache = KeyCache()
+        chunk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CHUNK_WORKERS) if chunk_size else None
+
+        def make_decryptor(segment):
+            """为AES-128加密的片段创建解密器，密钥按URI缓存；IV缺省时由媒体序列号推导"""
+            if segment.key is None:
+                return None
+            key = key_cache.get_or_fetch(segment.key.uri, lambda uri: fetch_key(uri, session))
+            return SegmentDecryptor(key, segment.key.iv or sequence_iv(segment.sequence))
+
+        def fetch_unit(unit, timer):
+            """下载一个单元，返回与unit一一对应的SegmentResult列表；每个请求都通过timer占用全局并发名额
+
+            重试时unit只剩下失败的片段，它们不一定仍然首尾相接，因此重新分组，只合并仍然相邻的片段。
+            """
+            if len(unit) > 1:
+                results = []
+                for group in plan_range_requests(unit, coalesce_bytes):
+                    if len(group) > 1:
+                        with timer:
+                            results.extend(download_range_group(group[0][1].uri, [s.byterange for _, s in group],
+                                                                [segment_paths[i] for i, _ in group], session))
+                    else:
+                        results.extend(fetch_unit(group, timer))
+                return results
+            i, segment = unit[0]
+            segment_name = os.path.basename(segment_paths[i])
+            if chunk_executor and segment.key is None and (segment.byterange is None
+                                                           or segment.byterange.length > chunk_size):
+                # 每个分块请求各自占用一个全局并发名额
+                return [download_segment_chunked(segment.uri, segment_name, download_dir, session, chunk_executor,
+                                                 chunk_size, segment.byterange, timer)]
+            with timer:
+                try:
+                    decryptor = make_decryptor(segment)
+                except Exception as e:
+                    print(f"获取密钥失败: {segment.key.uri}, 错误: {str(e)}")
+                    return [SegmentResult(False, None, 0, None)]
+                return [download_ts_segment(segment.uri, segment_name, download_dir, session, decryptor,
+                                            segment.byterange)]
+
+        def check_result(i, segment, result):
+            """校验下载成功的片段；校验失败时删除文件，返回可重试的失败结果"""
+            if not result.ok or not verify:
+                return result
+            verdict = verify_segment(segment_paths[i], result.expected_size, segment.duration)
+            if verdict.ok:
+                return result
+            print(f"片段 {i+1} 校验失败 [{verdict.problem}]: {verdict.detail}")
+            metrics.SEGMENT_VERIFY_FAILURES.inc(engine="threadpool", problem=verdict.problem)
+            os.remove(segment_paths[i])
+            return SegmentResult(False, None, 0, result.expected_size)
+
+        def download_task(unit):
+            task_start = time.monotonic()
+            results = {}
+            remaining = unit
+            for attempt in range(max_retries + 1):
+                controller.acquire()
+                # 延迟只统计占到全局并发名额之后的时间
+                timer = BudgetTimer(budget)
+                result = SegmentResult(False, None, 0, None)
+                received = 0
+                # 无论下载、校验还是删除文件出错，都要归还并发名额
+                try:
+                    unit_results = fetch_unit(remaining, timer)
+                    unit_results = [check_result(i, segment, r) for (i, segment), r in zip(remaining, unit_results)]
+                    # 合并的请求以第一个失败的片段（全部成功时为最后一个）作为这次请求的结果，字节数取整个单元的合计
+                    result = next((r for r in unit_results if not r.ok), unit_results[-1])
+                    received = sum(r.size for r in unit_results if r.ok)
+                finally:
+                    controller.release(result, timer.elapsed, received)
+                metrics.SEGMENT_LATENCY.observe(timer.elapsed, engine="threadpool")
+                results.update((i, r) for (i, _), r in zip(remaining, unit_results))
+                # 只重试没有下载成功的片段
+                remaining = [(i, segment) for (i, segment), r in zip(remaining, unit_results) if not r.ok]
+                if not remaining or not is_retryable(result) or attempt == max_retries:
+                    break
+                metrics.SEGMENT_RETRIES.inc(engine="threadpool")
+                delay = backoff_delay(attempt)
+                print(f"片段 {remaining[0][0] + 1} 将在 {delay:.1f}s 后第 {attempt + 1} 次重试")
+                time.sleep(delay)
+            nonlocal success_count
+            for i, segment in unit:
+                result = results[i]
+                manifest.update(i, result)
+                metrics.record_segment("threadpool", segment.uri, result, attempt + 1, time.monotonic() - task_start)
+                if result.ok:
+                    if merger:
+                        merger.mark_done(merge_positions[i])
+                    with success_lock:
+                        success_count += 1
+                if progress:
+                    with success_lock:
+                        print(f"下载第 {i+1}/{total} 个片段 ({((i+1)/total)*100:.1f}%)，已成功下载 {success_count} 个")
+            return all(results[i].ok for i, _ in unit)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=controller.max_workers) as executor:
+            try:
+                list(executor.map(download_task, units))
+            finally:
+                if chunk_executor:
+                    chunk_executor.shutdown()
+                manifest.save()
+                merged = merger.finish() if merger else True
+        print(f"下载完成: {success_count}/{len(ts_urls)} 个片段成功下载")
+        report_pool_stats(session)
+
+    return success_count == len(ts_urls) and merged and inits_ok
+
+
+def open_capture_index():
+    """打开downloaded_m3u8下的采集索引，新建时导入目录中已有的播放列表"""
+    return open_index("downloaded_m3u8")
+
+
+def forget_missing(index, path):
+    """播放列表文件打开失败时，清理采集索引中该目录下文件已被删除的记录"""
+    if index is not None:
+        index.prune_missing(os.path.dirname(os.path.normpath(path)))
+
+
+def resolve_playlists(patterns, all_new=False, index=None):
+    """把命令行给出的路径或通配符展开为m3u8文件列表；all_new时追加采集索引中尚未成功处理或之后又更新过的播放列表"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.isfile(pattern) else [])
+        if not matches:
+            print(f"没有匹配的播放列表: {pattern}")
+        paths.extend(matches)
+    if all_new:
+        paths.extend(index.pending_playlists("downloaded_m3u8"))
+    # 去重并保持顺序
+    return list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+
+def process_playlist(path, args, budget, index=None):
+    """批处理模式下处理一个播放列表：改写m3u8、下载片段、合并及转封装，返回是否成功
+
+    传入采集索引时把这次处理记录为一个任务，--all-new据此跳过已成功处理的播放列表；
+    --no-download只改写m3u8，片段还没有下载，不记录任务。
+    """
+    name = os.path.splitext(output_basename(path))[0]
+    download_dir = os.path.join(args.output_dir, name + "_segments")
+    merge_output = os.path.join(args.output_dir, name + ".ts") if args.merge or args.remux_mp4 else None
+    job_id = index.start_job(path, download_dir, merge_output) if index and not args.no_download else None
+    ok = False
     try:
-        thread_count_input = input("请输入并行下载线程数（默认5）: ").strip()
-        thread_count = int(thread_count_input) if thread_count_input else 5
-        if thread_count < 1:
-            print("线程数必须至少为1，使用默认值5")
-            thread_count = 5
-    except ValueError:
-        print("输入无效，使用默认线程数5")
-        thread_count = 5
+        base_url = playlist_base_url(path, index, args.base_url)
+        try:
+            output_path, modified_content = process_m3u8_file(path, base_url, args.output_dir)
+        except FileNotFoundError:
+            print(f"[{name}] 播放列表文件已被删除: {path}")
+            forget_missing(index, path)
+            return ok
+        print(f"[{name}] 文件已处理并保存到: {output_path}")
+        if args.no_download:
+            ok = True
+            return ok
+        ok = download_all_segments(modified_content, download_dir, base_url,
+                                   min_workers=args.min_workers, max_workers=args.max_workers,
+                                   max_retries=args.max_retries, merge_output=merge_output,
+                                   max_bandwidth=args.max_bandwidth, max_height=args.max_height,
+                                   budget=budget, progress=not args.quiet,
+                                   chunk_size=int(args.chunk_size * 1024 * 1024) if args.chunk_size else None,
+                                   verify=not args.no_verify)
+        if ok and args.remux_mp4:
+            ok = remux_to_mp4(merge_output) is not None
+        print(f"[{name}] {'完成' if ok else '失败'}")
+        return ok
+    finally:
+        if job_id is not None:
+            index.finish_job(job_id, ok)
 
-    print(f"找到 {len(ts_urls)} 个TS片段，开始下载，使用 {thread_count} 线程...")
 
-    success_count = 0
-    total = len(ts_urls)
-    success_lock = threading.Lock()
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="处理downloaded_m3u8中的播放列表并下载视频片段；不带参数运行时进入交互模式")
+    parser.add_argument("playlists", nargs="*", help="m3u8文件路径或通配符，例如 'downloaded_m3u8/*.m3u8'")
+    parser.add_argument("--all-new", action="store_true",
+                        help="处理采集索引中还没有成功处理过、或处理后又重新保存过的播放列表")
+    parser.add_argument("--reindex", action="store_true",
+                        help="重新扫描downloaded_m3u8，把不是由server.py保存的m3u8文件补录到采集索引，"
+                             "并清理文件已被删除的记录")
+    parser.add_argument("--base-url", default="https://dtliving-sz.dingtalk.com/live/",
+                        help="采集索引和.meta.json中都没有记录播放列表URL时，解析相对片段URI的基准URL")
+    parser.add_argument("--output-dir", default="temp", help="输出目录（默认temp）")
+    parser.add_argument("--no-download", action="store_true", help="只改写m3u8，不下载片段")
+    parser.add_argument("--merge", action="store_true", help="把片段合并为单个TS文件")
+    parser.add_argument("--remux-mp4", action="store_true", help="合并后用ffmpeg转封装为MP4（隐含--merge）")
+    parser.add_argument("--min-workers", type=int, default=2, help="每个播放列表的最小并发数")
+    parser.add_argument("--max-workers", type=int, default=16, help="每个播放列表的最大并发数")
+    parser.add_argument("--max-retries", type=int, default=4, help="每个片段的最大重试次数")
+    parser.add_argument("--jobs", type=int, default=2, help="同时处理的播放列表数量")
+    parser.add_argument("--global-workers", type=int, default=32, help="所有播放列表合计的最大并发请求数")
+    parser.add_argument("--max-bandwidth", type=int, help="主播放列表选择变体时的带宽上限（bps）")
+    parser.add_argument("--max-height", type=int, help="主播放列表选择变体时的分辨率高度上限")
+    parser.add_argument("--chunk-size", type=float, metavar="MB",
+                        help="大于该大小的片段拆成多个Range请求并行下载（适合高延迟链路上的大片段）")
+    parser.add_argument("--no-verify", action="store_true", help="不校验下载的片段（TS同步字节、大小、时长等）")
+    parser.add_argument("--quiet", action="store_true", help="不输出逐片段的下载进度")
+    parser.add_argument("--metrics-port", type=int, help="在127.0.0.1的该端口提供Prometheus格式的 /metrics")
+    parser.add_argument("--event-log", metavar="PATH", help="把每个片段的下载结果以JSON Lines格式追加写入该文件")
+    return parser
 
-    def download_task(index_url):
-        i, url = index_url
-        segment_name = f"segment_{i:04d}.ts"
-        result = download_ts_segment(url, segment_name, download_dir)
-        nonlocal success_count
-        if result:
-            with success_lock:
-                success_count += 1
-        with success_lock:
-            print(f"下载第 {i+1}/{total} 个片段 ({((i+1)/total)*100:.1f}%)，已成功下载 {success_count} 个")
-        return result
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
-        list(executor.map(download_task, enumerate(ts_urls)))
+def run_batch(args):
+    """非交互批处理：并发处理多个播放列表，所有下载共享一个全局并发预算，返回进程退出码"""
+    with open_capture_index() as index:
+        if args.reindex:
+            print(f"清理 {index.prune_missing('downloaded_m3u8')} 条文件已删除的播放列表记录")
+            print(f"补录 {index.backfill('downloaded_m3u8')} 个播放列表到采集索引")
+        return _run_batch(args, index)
 
-    print(f"下载完成: {success_count}/{len(ts_urls)} 个片段成功下载")
 
-    return success_count == len(ts_urls)
+def _run_batch(args, index):
+    paths = resolve_playlists(args.playlists, args.all_new, index)
+    if not paths:
+        print("没有需要处理的播放列表")
+        return 0
+    print(f"共 {len(paths)} 个播放列表，同时处理 {args.jobs} 个，全局并发上限 {args.global_workers}")
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    metrics.configure_event_log(args.event_log)
+    budget = threading.BoundedSemaphore(max(1, args.global_workers))
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(process_playlist, path, args, budget, index): path for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"处理 {path} 时发生错误: {str(e)}")
+                ok = False
+            if not ok:
+                failed += 1
+    print(f"批处理完成: {len(paths) - failed}/{len(paths)} 个播放列表成功")
+    return 1 if failed else 0
 
 
 def main():
@@ -173,15 +1165,36 @@ def main():
         download_choice = input("是否需要下载视频片段? (y/n, 默认y): ").strip().lower()
         download_segments = download_choice != 'n'
 
-        # 处理m3u8文件
-        prefix_url = "https://dtliving-sz.dingtalk.com/live/"
-        output_path, modified_content = process_m3u8_file(selected_file, prefix_url)
+        # 处理m3u8文件：相对URI按抓取时记录的播放列表URL解析
+        playlist_path = os.path.join("downloaded_m3u8", selected_file)
+        with open_capture_index() as index:
+            prefix_url = playlist_base_url(playlist_path, index, "https://dtliving-sz.dingtalk.com/live/")
+            try:
+                output_path, modified_content = process_m3u8_file(selected_file, prefix_url)
+            except FileNotFoundError:
+                print(f"播放列表文件已被删除: {playlist_path}")
+                forget_missing(index, playlist_path)
+                return
         print(f"文件已处理并保存到: {output_path}")
 
         if download_segments:
-            # 下载所有视频片段
-            download_dir = os.path.join("temp", selected_file.replace(".m3u8", "_segments"))
-            download_all_segments(modified_content, download_dir, prefix_url)
+            merge_choice = input("是否合并为单个视频文件? (y/n, 默认y): ").strip().lower()
+            merge_output = None
+            # 与process_m3u8_file一样按相对于downloaded_m3u8的路径命名，各直播间的同名文件不会冲突
+            base_name = output_basename(playlist_path)
+            if merge_choice != 'n':
+                merge_output = os.path.join("temp", base_name.replace(".m3u8", ".ts"))
+
+            # 下载所有视频片段，并在采集索引中记录这次下载
+            download_dir = os.path.join("temp", base_name.replace(".m3u8", "_segments"))
+            with open_capture_index() as index:
+                job_id = index.start_job(playlist_path, download_dir, merge_output)
+                ok = download_all_segments(modified_content, download_dir, prefix_url, merge_output=merge_output)
+                index.finish_job(job_id, ok)
+            if ok and merge_output:
+                remux_choice = input("是否转封装为MP4（需要ffmpeg）? (y/n, 默认n): ").strip().lower()
+                if remux_choice == 'y':
+                    remux_to_mp4(merge_output)
         else:
             print("已跳过下载视频片段，只输出处理好的m3u8文件")
 
@@ -192,4 +1205,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_batch(build_arg_parser().parse_args()))
     main()
\ No newline at end of file
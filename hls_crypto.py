@@ -0,0 +1,77 @@
+# hls_crypto.py
+"""HLS AES-128片段解密
+
+解密依赖可选的cryptography包（pip install cryptography），只有遇到加密片段时才需要安装，
+也只在创建第一个SegmentDecryptor时才导入，不拖慢下载工具的启动。
+"""
+import threading
+from collections import OrderedDict
+
+
+def sequence_iv(sequence):
+    """#EXT-X-KEY未给出IV时，以片段的媒体序列号作为128位大端整数IV（RFC 8216 5.2）"""
+    return sequence.to_bytes(16, "big")
+
+
+class SegmentDecryptor:
+    """流式AES-128-CBC解密：update可处理任意长度的数据块，finalize输出最后一块并去除PKCS7填充"""
+
+    def __init__(self, key, iv):
+        try:
+            from cryptography.hazmat.primitives import padding
+            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        except ImportError:
+            raise RuntimeError("解密AES-128片段需要安装cryptography: pip install cryptography") from None
+        self._decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        self._unpadder = padding.PKCS7(128).unpadder()
+
+    def update(self, data):
+        return self._unpadder.update(self._decryptor.update(data))
+
+    def finalize(self):
+        return self._unpadder.update(self._decryptor.finalize()) + self._unpadder.finalize()
+
+
+class KeyCache:
+    """按密钥URI缓存密钥的小型LRU，每个URI只下载一次"""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        # 串行化缓存未命中时的下载，保证并发请求同一个URI时只下载一次
+        self._fetch_lock = threading.Lock()
+
+    def get(self, uri):
+        with self._lock:
+            key = self._keys.get(uri)
+            if key is not None:
+                self._keys.move_to_end(uri)
+            return key
+
+    def put(self, uri, key):
+        if len(key) != 16:
+            raise ValueError(f"AES-128密钥长度应为16字节，实际为 {len(key)} 字节: {uri}")
+        with self._lock:
+            self._keys[uri] = key
+            self._keys.move_to_end(uri)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def get_or_fetch(self, uri, fetch):
+        """返回缓存的密钥；未命中时调用fetch(uri)下载并缓存"""
+        key = self.get(uri)
+        if key is not None:
+            return key
+        with self._fetch_lock:
+            key = self.get(uri)
+            if key is None:
+                key = fetch(uri)
+                self.put(uri, key)
+            return key
+
+
+def check_key_method(key):
+    """只支持AES-128整段加密；SAMPLE-AES等方式需要解析媒体格式，无法在下载时解密"""
+    if key is not None and key.method != "AES-128":
+        raise ValueError(f"不支持的加密方式: {key.method}")
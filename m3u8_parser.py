@@ -0,0 +1,223 @@
+# m3u8_parser.py
+"""M3U8播放列表解析
+
+单次遍历播放列表文本，返回结构化的媒体播放列表或主播放列表：
+    MediaPlaylist: 片段的时长、媒体序列号、字节范围、不连续标记、加密信息和初始化片段
+    MasterPlaylist: 各码率变体的带宽、分辨率和编码，可按带宽或分辨率选择变体
+相对URI按播放列表自身的URL解析为绝对URL。
+"""
+import re
+from collections import namedtuple
+from urllib.parse import urljoin
+
+# 属性列表，例如 METHOD=AES-128,URI="https://...",IV=0x0123...
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# 字节范围：length为字节数，offset为在资源中的起始偏移
+ByteRange = namedtuple("ByteRange", ["length", "offset"])
+# 加密信息：method为NONE/AES-128/SAMPLE-AES，iv为16字节bytes或None（None时按媒体序列号推导）
+Key = namedtuple("Key", ["method", "uri", "iv"])
+# fMP4初始化片段（#EXT-X-MAP）
+InitSection = namedtuple("InitSection", ["uri", "byterange"])
+Segment = namedtuple("Segment", ["uri", "duration", "sequence", "byterange", "discontinuity", "key", "init_section"])
+# 码率变体：resolution为(宽, 高)或None
+Variant = namedtuple("Variant", ["uri", "bandwidth", "resolution", "codecs"])
+
+
+class MediaPlaylist:
+    """媒体播放列表"""
+
+    __slots__ = ("url", "target_duration", "media_sequence", "segments", "ended", "playlist_type", "version")
+
+    is_master = False
+
+    def __init__(self, url=None):
+        self.url = url
+        self.target_duration = None
+        self.media_sequence = 0
+        self.segments = []
+        self.ended = False
+        self.playlist_type = None
+        self.version = None
+
+    @property
+    def total_duration(self):
+        return sum(segment.duration for segment in self.segments)
+
+    @property
+    def is_encrypted(self):
+        return any(segment.key is not None for segment in self.segments)
+
+
+class MasterPlaylist:
+    """主播放列表"""
+
+    __slots__ = ("url", "variants")
+
+    is_master = True
+
+    def __init__(self, url=None):
+        self.url = url
+        self.variants = []
+
+
+def parse_attributes(value):
+    """解析属性列表为字典，去掉字符串值两侧的引号"""
+    attributes = {}
+    for name, raw in _ATTRIBUTE_RE.findall(value):
+        attributes[name] = raw[1:-1] if raw.startswith('"') else raw
+    return attributes
+
+
+def _parse_byterange(value, next_offsets, uri_key):
+    """解析"length[@offset]"；省略offset时接着同一资源上一个子范围的末尾"""
+    length, _, offset = value.partition("@")
+    length = int(length)
+    offset = int(offset) if offset else next_offsets.get(uri_key, 0)
+    return ByteRange(length, offset)
+
+
+def _parse_iv(value):
+    if not value:
+        return None
+    value = value[2:] if value[:2] in ("0x", "0X") else value
+    return bytes.fromhex(value.rjust(32, "0"))
+
+
+def _make_resolver(url):
+    """返回把URI解析为绝对URL的函数
+
+    最常见的"同目录文件名"形式直接拼接在播放列表所在目录后面，其余形式交给urljoin，
+    避免在数千个片段上逐个调用urljoin。
+    """
+    if not url:
+        return lambda uri: uri
+    base_dir = url.split("?", 1)[0].split("#", 1)[0].rpartition("/")[0] + "/"
+
+    def resolve(uri):
+        if "://" in uri or uri[0] in "/.?#" or ":" in uri.split("/", 1)[0]:
+            return urljoin(url, uri)
+        return base_dir + uri
+
+    return resolve
+
+
+def parse_playlist(text, url=None):
+    """解析播放列表文本；url为播放列表自身的地址，用于解析相对URI。返回MediaPlaylist或MasterPlaylist"""
+    resolve = _make_resolver(url)
+    media = MediaPlaylist(url)
+    master = None
+
+    sequence = None
+    duration = None
+    byterange_value = None
+    discontinuity = False
+    key = None
+    init_section = None
+    stream_inf = None
+    # 每个资源上一个字节范围的结束位置，用于省略offset的#EXT-X-BYTERANGE
+    next_offsets = {}
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != "#":
+            uri = resolve(line)
+            if stream_inf is not None:
+                resolution = stream_inf.get("RESOLUTION")
+                if resolution and "x" in resolution:
+                    width, _, height = resolution.partition("x")
+                    resolution = (int(width), int(height))
+                else:
+                    resolution = None
+                master.variants.append(Variant(uri, int(stream_inf.get("BANDWIDTH", 0)), resolution,
+                                               stream_inf.get("CODECS")))
+                stream_inf = None
+                continue
+            if sequence is None:
+                sequence = media.media_sequence
+            byterange = None
+            if byterange_value is not None:
+                byterange = _parse_byterange(byterange_value, next_offsets, uri)
+                next_offsets[uri] = byterange.offset + byterange.length
+                byterange_value = None
+            media.segments.append(Segment(uri, duration or 0.0, sequence, byterange, discontinuity, key,
+                                          init_section))
+            sequence += 1
+            duration = None
+            discontinuity = False
+            continue
+
+        tag, _, value = line.partition(":")
+        if tag == "#EXTINF":
+            duration = float(value.partition(",")[0])
+        elif tag == "#EXT-X-BYTERANGE":
+            byterange_value = value
+        elif tag == "#EXT-X-KEY":
+            attributes = parse_attributes(value)
+            method = attributes.get("METHOD", "NONE")
+            if method == "NONE":
+                key = None
+            else:
+                key = Key(method, resolve(attributes["URI"]) if "URI" in attributes else None,
+                          _parse_iv(attributes.get("IV")))
+        elif tag == "#EXT-X-MAP":
+            attributes = parse_attributes(value)
+            map_uri = resolve(attributes["URI"])
+            map_range = None
+            if "BYTERANGE" in attributes:
+                map_range = _parse_byterange(attributes["BYTERANGE"], {}, map_uri)
+            init_section = InitSection(map_uri, map_range)
+        elif tag == "#EXT-X-DISCONTINUITY":
+            discontinuity = True
+        elif tag == "#EXT-X-MEDIA-SEQUENCE":
+            media.media_sequence = int(value)
+        elif tag == "#EXT-X-TARGETDURATION":
+            media.target_duration = float(value)
+        elif tag == "#EXT-X-ENDLIST":
+            media.ended = True
+        elif tag == "#EXT-X-PLAYLIST-TYPE":
+            media.playlist_type = value
+        elif tag == "#EXT-X-VERSION":
+            media.version = int(value)
+        elif tag == "#EXT-X-STREAM-INF":
+            if master is None:
+                master = MasterPlaylist(url)
+            stream_inf = parse_attributes(value)
+
+    return master if master is not None else media
+
+
+def select_variant(master, max_bandwidth=None, max_height=None):
+    """在不超过max_bandwidth（bps）和max_height（像素）的变体中选择码率最高的一个；
+    没有变体满足条件时选择码率最低的，未指定条件时选择码率最高的"""
+    if not master.variants:
+        return None
+
+    def fits(variant):
+        if max_bandwidth is not None and variant.bandwidth > max_bandwidth:
+            return False
+        if max_height is not None and variant.resolution is not None and variant.resolution[1] > max_height:
+            return False
+        return True
+
+    candidates = [variant for variant in master.variants if fits(variant)]
+    if not candidates:
+        return min(master.variants, key=lambda variant: variant.bandwidth)
+    return max(candidates, key=lambda variant: variant.bandwidth)
+
+
+def resolve_playlist_text(text, url):
+    """把播放列表中的相对URI（片段行以及#EXT-X-KEY/#EXT-X-MAP的URI属性）改写为绝对URL，其余内容保持不变"""
+    resolve = _make_resolver(url)
+    lines = []
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and stripped[0] != "#":
+            lines.append(resolve(stripped) + "\n")
+        elif stripped.startswith(("#EXT-X-KEY:", "#EXT-X-MAP:")) and 'URI="' in stripped:
+            lines.append(re.sub(r'URI="([^"]*)"', lambda m: f'URI="{resolve(m.group(1))}"', line))
+        else:
+            lines.append(line)
+    return "".join(lines)
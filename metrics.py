@@ -0,0 +1,303 @@
+# metrics.py
+"""下载和采集过程的指标与结构化事件日志
+
+只依赖标准库：
+    Counter/Gauge/Histogram   Prometheus风格的指标，按标签分别计数，线程安全
+    start_http_server         在后台线程中以Prometheus文本格式提供 /metrics
+    EventLog/log_event        JSON Lines事件日志，每行一个事件，便于脚本分析
+    monitor_event_loop_lag    定期测量asyncio事件循环的调度延迟
+本模块末尾定义了download_tool、async_downloader和server共用的指标。
+download_tool在启动时就会导入本模块，因此asyncio和http.server只在用到它们的函数中导入。
+"""
+import atexit
+import json
+import logging
+import math
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 默认的直方图桶上限（秒），覆盖从局域网片段到慢速CDN的延迟范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """可任意设置的瞬时值"""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """按桶统计观测值分布，同时记录总和与次数，可在Prometheus中计算分位数"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def total(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[1] if state else 0.0
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标集合；同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type_name}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self):
+        """返回Prometheus文本格式（0.0.4）的全部指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """在后台守护线程中提供 http://host:port/metrics，返回HTTP服务器（调用shutdown()停止）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"[METRICS] 指标地址: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class EventLog:
+    """JSON Lines事件日志：每个事件一行，包含事件名、Unix时间戳和附加字段
+
+    emit只把序列化好的行放入队列，由后台线程批量写入并flush，asyncio事件循环中调用也不会等待磁盘。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+        # 进程退出前写完队列中剩余的事件
+        atexit.register(self.close)
+
+    def emit(self, event, **fields):
+        self._queue.put(json.dumps({"event": event, "ts": round(time.time(), 3), **fields},
+                                   ensure_ascii=False, default=str))
+
+    def _run(self):
+        closing = False
+        while not closing:
+            lines = [self._queue.get()]
+            # 一次取走队列中已有的全部事件，合并为一次写入和flush
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lines:
+                closing = True
+                lines = lines[:lines.index(None)]
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+        self._file.close()
+
+    def close(self):
+        """写完已提交的事件后关闭文件；可重复调用"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        atexit.unregister(self.close)
+
+
+_event_log = None
+
+
+def configure_event_log(path):
+    """开启事件日志，之后log_event写入path；path为None时关闭"""
+    global _event_log
+    if _event_log is not None:
+        _event_log.close()
+    _event_log = EventLog(path) if path else None
+    return _event_log
+
+
+def log_event(event, **fields):
+    """写入一个事件；未开启事件日志时不做任何事"""
+    if _event_log is not None:
+        _event_log.emit(event, **fields)
+
+
+def record_segment(engine, url, result, attempts, elapsed):
+    """记录一个片段下载的最终结果；result为download_tool.SegmentResult，elapsed为包括重试在内的总耗时"""
+    SEGMENTS.inc(engine=engine, result="ok" if result.ok else "failed")
+    if result.ok:
+        SEGMENT_BYTES.inc(result.size, engine=engine)
+        LAST_SEGMENT_TIME.set(time.time(), engine=engine)
+    log_event("segment", engine=engine, url=url, ok=result.ok, status=result.status, size=result.size,
+              attempts=attempts, elapsed=round(elapsed, 3))
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    """每隔interval秒测量一次事件循环的调度延迟，记录到EVENT_LOOP_LAG，直到被取消"""
+    import asyncio
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - start - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
+
+
+# engine标签为threadpool（download_tool）或asyncio（async_downloader）
+SEGMENTS = REGISTRY.counter("hls_segments_total", "已结束的片段下载数", ("engine", "result"))
+SEGMENT_BYTES = REGISTRY.counter("hls_segment_bytes_total", "成功下载的片段字节数", ("engine",))
+SEGMENT_LATENCY = REGISTRY.histogram("hls_segment_seconds", "单次片段请求耗时", ("engine",))
+SEGMENT_RETRIES = REGISTRY.counter("hls_segment_retries_total", "片段重试次数", ("engine",))
+# problem标签为segment_verify.VerifyResult.problem（empty/size/text/sync/alignment/boxes/duration）
+SEGMENT_VERIFY_FAILURES = REGISTRY.counter("hls_segment_verify_failures_total", "校验失败后重新下载的片段数",
+                                           ("engine", "problem"))
+# 最近一次片段下载成功的Unix时间，与当前时间相差过大说明下载已停滞
+LAST_SEGMENT_TIME = REGISTRY.gauge("hls_last_segment_timestamp_seconds", "最近一次片段下载成功的时间", ("engine",))
+
+# source标签为ws、xhr或network
+PLAYLISTS_DISCOVERED = REGISTRY.counter("capture_playlists_discovered_total", "页面上发现的m3u8 URL数", ("source",))
+# source标签为browser（浏览器响应体）或fetch（重新请求）
+PLAYLISTS_SAVED = REGISTRY.counter("capture_playlists_saved_total", "已保存的m3u8文件数", ("source",))
+WS_MESSAGES = REGISTRY.counter("capture_ws_messages_total", "处理的WebSocket消息数")
+WRITER_QUEUE_DEPTH = REGISTRY.gauge("capture_writer_queue_depth", "写入线程中排队的文件操作数", ("writer",))
+EVENT_LOOP_LAG = REGISTRY.histogram("capture_event_loop_lag_seconds", "事件循环调度延迟",
+                                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+EVENT_LOOP_LAG_LAST = REGISTRY.gauge("capture_event_loop_lag_last_seconds", "最近一次测量的事件循环调度延迟")
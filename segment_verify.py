@@ -0,0 +1,216 @@
+# segment_verify.py
+"""下载片段的完整性校验
+
+只通过mmap读取文件头尾的少量字节，单个片段的校验耗时与片段大小基本无关，可以在下载线程中逐个运行：
+    大小          空文件、与Content-Length不一致
+    错误页        以200返回的HTML/JSON等文本内容
+    MPEG-TS       开头和结尾若干个包的同步字节0x47、文件大小是否为188字节的整数倍
+    时长          开头和结尾PES的PTS之差与#EXTINF相差过大（只针对TS）
+    fMP4          顶层box的头部能否首尾相接地覆盖整个文件
+download_tool和async_downloader在每个片段下载完成后调用verify_segment，校验失败的片段删除后重新下载。
+
+也可以单独运行，检查已有的片段目录，--repair把损坏的片段在任务清单中标记为失败，下次下载时自动重新下载：
+    python segment_verify.py temp/xxx_segments --playlist temp/xxx.m3u8 --repair
+"""
+import argparse
+import json
+import mmap
+import os
+import sys
+from collections import namedtuple
+
+from m3u8_parser import parse_playlist
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# 检查同步字节的包数：开头HEAD_PACKETS个，结尾TAIL_PACKETS个（结尾同时用于查找最后一个PTS）
+HEAD_PACKETS = 64
+TAIL_PACKETS = 512
+# 判断是否为文本错误页时检查的字节数
+TEXT_SNIFF_SIZE = 512
+# 实测时长与#EXTINF的允许误差：取max(MIN_DURATION_SLACK, extinf * DURATION_TOLERANCE)秒。
+# 结尾PTS取的是最后一个PES的开始时间，实测值会比实际时长少一帧左右
+DURATION_TOLERANCE = 0.5
+MIN_DURATION_SLACK = 1.0
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+
+# fMP4片段和初始化片段中可能出现的顶层box
+MP4_BOX_TYPES = frozenset({b"ftyp", b"styp", b"moov", b"moof", b"mdat", b"sidx", b"ssix", b"emsg", b"prft",
+                           b"free", b"skip", b"uuid", b"meta", b"mfra"})
+
+# 校验结果：problem为None或问题类型（empty/size/text/sync/alignment/boxes/duration），detail为说明，
+# duration为从PTS测得的时长（秒，无法测量时为None）
+VerifyResult = namedtuple("VerifyResult", ["ok", "problem", "detail", "duration"])
+
+
+def _fail(problem, detail, duration=None):
+    return VerifyResult(False, problem, detail, duration)
+
+
+def _looks_like_text(head):
+    """开头的字节全部是可打印ASCII或空白：HTML错误页、JSON错误信息等"""
+    if not head:
+        return False
+    stripped = head.lstrip()
+    if stripped[:1] in (b"<", b"{", b"["):
+        return True
+    return all(32 <= byte < 127 or byte in (9, 10, 13) for byte in head)
+
+
+def _read_pts(packet):
+    """如果TS包是带PTS的PES的起始包，返回(PID, PTS)，否则返回None"""
+    if not packet[1] & 0x40:  # payload_unit_start_indicator
+        return None
+    adaptation = (packet[3] >> 4) & 0x3
+    if not adaptation & 0x1:
+        return None
+    offset = 4
+    if adaptation & 0x2:
+        offset += 1 + packet[4]
+    pes = packet[offset:offset + 14]
+    if len(pes) < 14 or pes[0:3] != b"\x00\x00\x01" or not 0xC0 <= pes[3] <= 0xEF or not pes[7] & 0x80:
+        return None
+    pts = (((pes[9] >> 1) & 0x07) << 30 | pes[10] << 22 | (pes[11] >> 1) << 15 | pes[12] << 7 | pes[13] >> 1)
+    return ((packet[1] & 0x1F) << 8 | packet[2]), pts
+
+
+def _verify_ts(data, size, extinf):
+    if size % TS_PACKET_SIZE:
+        return _fail("alignment", f"文件大小 {size} 不是 {TS_PACKET_SIZE} 字节的整数倍")
+    packets = size // TS_PACKET_SIZE
+    head = range(min(HEAD_PACKETS, packets))
+    # 短片段的头尾会重叠，结尾仍从最后一个包往前找PTS
+    tail = range(max(packets - TAIL_PACKETS, 0), packets)
+    first = None
+    for n in head:
+        packet = data[n * TS_PACKET_SIZE:(n + 1) * TS_PACKET_SIZE]
+        if packet[0] != TS_SYNC_BYTE:
+            return _fail("sync", f"第 {n + 1} 个TS包缺少同步字节")
+        if first is None:
+            first = _read_pts(packet)
+    last = None
+    for n in reversed(tail):
+        packet = data[n * TS_PACKET_SIZE:(n + 1) * TS_PACKET_SIZE]
+        if packet[0] != TS_SYNC_BYTE:
+            return _fail("sync", f"第 {n + 1}/{packets} 个TS包缺少同步字节")
+        if last is None and first is not None:
+            found = _read_pts(packet)
+            if found is not None and found[0] == first[0]:
+                last = found
+    duration = None
+    if first is not None and last is not None:
+        duration = ((last[1] - first[1]) % PTS_WRAP) / PTS_CLOCK
+    if duration is not None and extinf:
+        slack = max(MIN_DURATION_SLACK, extinf * DURATION_TOLERANCE)
+        if abs(duration - extinf) > slack:
+            return _fail("duration", f"PTS时长 {duration:.2f}s 与#EXTINF {extinf:.2f}s 相差过大", duration)
+    return VerifyResult(True, None, None, duration)
+
+
+def _verify_mp4(data, size):
+    offset = 0
+    while offset < size:
+        if size - offset < 8:
+            return _fail("boxes", f"偏移 {offset} 处剩余 {size - offset} 字节，不足一个box头")
+        box_size = int.from_bytes(data[offset:offset + 4], "big")
+        box_type = bytes(data[offset + 4:offset + 8])
+        if box_type not in MP4_BOX_TYPES:
+            return _fail("boxes", f"偏移 {offset} 处的box类型 {box_type!r} 无法识别")
+        if box_size == 1:
+            if size - offset < 16:
+                return _fail("boxes", f"偏移 {offset} 处的box缺少64位大小")
+            box_size = int.from_bytes(data[offset + 8:offset + 16], "big")
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < 8 or offset + box_size > size:
+            return _fail("boxes", f"{box_type.decode('latin-1')} box大小 {box_size} 超出文件末尾（偏移 {offset}/{size}）")
+        offset += box_size
+    return VerifyResult(True, None, None, None)
+
+
+def verify_segment(path, expected_size=None, extinf=None):
+    """校验一个已下载的片段，返回VerifyResult
+
+    expected_size为服务器声明的大小（未知时为None），extinf为播放列表中的时长（秒）。
+    格式按扩展名判断：.ts按MPEG-TS校验，.m4s/.mp4按fMP4校验，其他扩展名按开头字节识别，无法识别的格式只检查大小和文本错误页。
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return _fail("empty", "文件为空")
+    if expected_size is not None and size != expected_size:
+        return _fail("size", f"文件大小 {size} 与服务器声明的 {expected_size} 不一致")
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        head = data[:TEXT_SNIFF_SIZE]
+        if _looks_like_text(head):
+            return _fail("text", f"内容是文本而不是媒体数据: {head[:80]!r}")
+        if extension == ".ts" or (extension not in (".m4s", ".mp4") and head[0] == TS_SYNC_BYTE):
+            return _verify_ts(data, size, extinf)
+        if extension in (".m4s", ".mp4") or head[4:8] in MP4_BOX_TYPES:
+            return _verify_mp4(data, size)
+    return VerifyResult(True, None, None, None)
+
+
+def verify_directory(download_dir, playlist=None, repair=False):
+    """校验片段目录中任务清单记录为已完成的片段，返回[(序号, 路径, VerifyResult)]（只含校验失败的）
+
+    playlist为m3u8_parser.MediaPlaylist时按序号取#EXTINF校验时长。
+    repair为True时删除损坏的片段，并在任务清单中标记为失败，下次下载时只重新下载这些片段。
+    """
+    # 与download_tool.SegmentManifest.manifest_path一致；这里不导入download_tool，避免引入requests
+    manifest_path = os.path.normpath(download_dir) + ".manifest.json"
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    names = {}
+    for name in os.listdir(download_dir):
+        stem, extension = os.path.splitext(name)
+        # 片段保留原始扩展名（.ts、.m4s、.aac等），.part等临时文件的stem不是纯数字
+        if stem.startswith("segment_") and stem[len("segment_"):].isdigit():
+            names[int(stem[len("segment_"):])] = name
+    bad = []
+    for entry in manifest.get("segments", []):
+        index = entry["index"]
+        if entry.get("status") != "done" or index not in names:
+            continue
+        path = os.path.join(download_dir, names[index])
+        extinf = playlist.segments[index].duration if playlist and index < len(playlist.segments) else None
+        result = verify_segment(path, entry.get("expected_size"), extinf)
+        if result.ok:
+            continue
+        bad.append((index, path, result))
+        if repair:
+            os.remove(path)
+            entry.update(status="failed", size=0)
+    if repair and bad:
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, manifest_path)
+    return bad
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="校验已下载的片段目录")
+    parser.add_argument("download_dir", help="片段目录，例如 temp/xxx_segments")
+    parser.add_argument("--playlist", help="对应的m3u8文件，用于按#EXTINF校验时长")
+    parser.add_argument("--repair", action="store_true", help="删除损坏的片段并在任务清单中标记为失败")
+    args = parser.parse_args(argv)
+    playlist = None
+    if args.playlist:
+        with open(args.playlist, "r", encoding="utf-8") as f:
+            playlist = parse_playlist(f.read(), args.playlist)
+        if playlist.is_master:
+            playlist = None
+    bad = verify_directory(args.download_dir, playlist, args.repair)
+    for index, path, result in bad:
+        print(f"片段 {index + 1} 校验失败 [{result.problem}]: {result.detail} ({path})")
+    if not bad:
+        print("所有已完成的片段校验通过")
+    elif args.repair:
+        print(f"{len(bad)} 个片段已标记为失败，重新运行下载即可只下载这些片段")
+    return 1 if bad and not args.repair else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
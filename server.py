@@ -1,26 +1,58 @@
 # listen_dingtalk.py
+import argparse
 import asyncio
 import json
-from playwright.async_api import async_playwright
 import os
-import aiohttp
 import re
 from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+from datetime import datetime
 import logging
 
+import metrics
+from async_writer import AsyncFileWriter
+from browser_config import BROWSER_ARGS, DEFAULT_CDP_ENDPOINT, EDGE_PATHS, LIGHTWEIGHT_BROWSER_ARGS
+from capture_index import normalize_url_key, open_index
+from m3u8_parser import parse_playlist, select_variant
+
+# Playwright和aiohttp导入较慢（合计约0.2秒），只在用到它们的函数中导入，
+# 使 --help、配置检查和连接常驻浏览器（browser_daemon.py）的短任务尽快开始采集
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 LIVE_SHARE_URL = "https://n.dingtalk.com/dingding/live-room/index.html?roomId=LHnQZUXktD&liveUuid=62d3f452-504d-44f0-855f-f86aa1fb3932"
 
-# 修改INJECT_JS，增加截断长度到10000
+# 页面内监控脚本：拦截XHR、fetch和WebSocket，通过pyReceive绑定把事件发给Python。
+# 行为由window.__PY_MONITOR_CONFIG__控制（见build_inject_js）：
+#   filter      只转发URL或内容中包含任一标记（不区分大小写）的事件，null表示全部转发
+#   batchMs     大于0时把这段时间内的事件合并为一个{kind: "batch", events: [...]}调用
+#   maxPreview  内容预览的截断长度，null表示不截断
 INJECT_JS = r"""
 (() => {
   if (window.__PY_MONITOR_INSTALLED__) return;
   window.__PY_MONITOR_INSTALLED__ = true;
 
-  function sendToPy(payload) {
+  const CONFIG = Object.assign({ filter: null, batchMs: 0, maxPreview: 10000, maxBatch: 200 },
+                               window.__PY_MONITOR_CONFIG__ || {});
+  const FILTER_RE = (CONFIG.filter && CONFIG.filter.length)
+    ? new RegExp(CONFIG.filter.map(m => m.replace(/[.*+?^${}()|[\]\\]/g, "\\$&")).join("|"), "i")
+    : null;
+  // 这些事件很少出现，不参与过滤
+  const UNFILTERED = { ping: true, ws_close: true, ws_error: true };
+
+  function preview(text) {
+    if (typeof text !== "string") return null;
+    return CONFIG.maxPreview == null ? text : text.slice(0, CONFIG.maxPreview);
+  }
+
+  function wanted(kind, url, text) {
+    if (!FILTER_RE || UNFILTERED[kind]) return true;
+    return (typeof url === "string" && FILTER_RE.test(url)) || (typeof text === "string" && FILTER_RE.test(text));
+  }
+
+  function deliver(payload) {
     try {
       if (window.pyReceive) {
         window.pyReceive(JSON.stringify(payload));
@@ -32,6 +64,30 @@ INJECT_JS = r"""
     }
   }
 
+  let queue = [];
+  let flushTimer = null;
+  function flush() {
+    flushTimer = null;
+    if (!queue.length) return;
+    const events = queue;
+    queue = [];
+    deliver(events.length === 1 ? events[0] : { kind: "batch", events: events });
+  }
+
+  function sendToPy(payload) {
+    if (!(CONFIG.batchMs > 0)) {
+      deliver(payload);
+      return;
+    }
+    queue.push(payload);
+    if (queue.length >= CONFIG.maxBatch) {
+      if (flushTimer !== null) clearTimeout(flushTimer);
+      flush();
+    } else if (flushTimer === null) {
+      flushTimer = setTimeout(flush, CONFIG.batchMs);
+    }
+  }
+
   (function() {
     const OrigXhr = window.XMLHttpRequest;
     function WrappedXhr() {
@@ -47,22 +103,27 @@ INJECT_JS = r"""
       xhr.send = function(body) {
         _startTs = Date.now();
         try {
-          sendToPy({
-            kind: "xhr_request",
-            method: _method,
-            url: _url,
-            body: (typeof body === "string" ? body : (body ? "[non-string body]" : null)),
-            ts: _startTs
-          });
+          const bodyText = (typeof body === "string" ? body : (body ? "[non-string body]" : null));
+          if (wanted("xhr_request", _url, bodyText)) {
+            sendToPy({
+              kind: "xhr_request",
+              method: _method,
+              url: _url,
+              body: preview(bodyText),
+              ts: _startTs
+            });
+          }
         } catch (e) {}
         this.addEventListener('loadend', () => {
           try {
+            const text = (this.responseType === "" || this.responseType === "text") ? this.responseText : null;
+            if (!wanted("xhr_response", _url, text)) return;
             sendToPy({
               kind: "xhr_response",
               method: _method,
               url: _url,
               status: this.status,
-              responseTextPreview: (typeof this.responseText === "string") ? this.responseText.slice(0, 10000) : null,
+              responseTextPreview: preview(text),
               duration_ms: Date.now() - _startTs
             });
           } catch (e) {}
@@ -81,26 +142,27 @@ INJECT_JS = r"""
       const url = (typeof input === "string") ? input : (input && input.url) || "";
       const method = (init && init.method) || (input && input.method) || "GET";
       const start = Date.now();
-      let bodyPreview = null;
       try {
-        if (init && init.body && typeof init.body === "string") bodyPreview = init.body.slice(0, 10000);
-      } catch (e) {}
-      try {
-        sendToPy({ kind: "fetch_request", method, url, bodyPreview, ts: start });
+        const bodyText = (init && typeof init.body === "string") ? init.body : null;
+        if (wanted("fetch_request", url, bodyText)) {
+          sendToPy({ kind: "fetch_request", method, url, bodyPreview: preview(bodyText), ts: start });
+        }
       } catch (e) {}
       return origFetch(input, init).then((resp) => {
         try {
           const clone = resp.clone();
           return clone.text().then(text => {
             try {
-              sendToPy({
-                kind: "fetch_response",
-                method,
-                url,
-                status: resp.status,
-                textPreview: (typeof text === "string") ? text.slice(0, 10000) : null,
-                duration_ms: Date.now() - start
-              });
+              if (wanted("fetch_response", url, text)) {
+                sendToPy({
+                  kind: "fetch_response",
+                  method,
+                  url,
+                  status: resp.status,
+                  textPreview: preview(text),
+                  duration_ms: Date.now() - start
+                });
+              }
             } catch (e) {}
             return resp;
           }).catch(_ => resp);
@@ -116,25 +178,35 @@ INJECT_JS = r"""
     function WrappedWebSocket(url, protocols) {
       const ws = protocols ? new OrigWS(url, protocols) : new OrigWS(url);
       const createdAt = Date.now();
-      try { sendToPy({ kind: "ws_created", url: String(url), protocols: protocols || null, ts: createdAt }); } catch (e) {}
+      try {
+        if (wanted("ws_created", String(url), null)) {
+          sendToPy({ kind: "ws_created", url: String(url), protocols: protocols || null, ts: createdAt });
+        }
+      } catch (e) {}
 
       const origSend = ws.send;
       ws.send = function(data) {
-        try { sendToPy({ kind: "ws_send", url: String(url), dataPreview: (typeof data === "string" ? data.slice(0,10000) : "[non-string]"), ts: Date.now() }); } catch (e) {}
+        try {
+          const dataStr = typeof data === "string" ? data : "[non-string]";
+          if (wanted("ws_send", String(url), dataStr)) {
+            sendToPy({ kind: "ws_send", url: String(url), dataPreview: preview(dataStr), ts: Date.now() });
+          }
+        } catch (e) {}
         return origSend.call(this, data);
       };
 
       ws.addEventListener('message', function(ev) {
-        try { 
+        try {
           const dataStr = typeof ev.data === "string" ? ev.data : "[non-string]";
-          sendToPy({ 
-            kind: "ws_message", 
-            url: String(url), 
-            dataPreview: dataStr.slice(0, 10000),
+          if (!wanted("ws_message", String(url), dataStr)) return;
+          sendToPy({
+            kind: "ws_message",
+            url: String(url),
+            dataPreview: preview(dataStr),
             dataLength: dataStr.length,
-            direction: "recv", 
-            ts: Date.now() 
-          }); 
+            direction: "recv",
+            ts: Date.now()
+          });
         } catch (e) {}
       });
 
@@ -161,22 +233,254 @@ INJECT_JS = r"""
 })();
 """
 
+# 默认只转发包含这些标记的事件，其余XHR/fetch/WS流量与拉流地址发现无关
+DEFAULT_MONITOR_FILTER = (".m3u8",)
+
+
+def build_inject_js(monitor_filter=DEFAULT_MONITOR_FILTER, batch_ms=250, max_preview=10000):
+    """生成带配置的页面监控脚本
+
+    monitor_filter: 标记列表，只转发包含其中任一标记的事件；None表示全部转发
+    batch_ms: 事件批量发送的间隔（毫秒），0表示逐条发送
+    max_preview: 内容预览的截断长度，None表示不截断
+    """
+    config = {
+        "filter": list(monitor_filter) if monitor_filter else None,
+        "batchMs": batch_ms,
+        "maxPreview": max_preview,
+    }
+    return f"window.__PY_MONITOR_CONFIG__ = {json.dumps(config)};\n" + INJECT_JS
+
+
+# 请求m3u8时使用的请求头，模拟浏览器
+PLAYLIST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Referer': 'https://n.dingtalk.com/',
+}
+
+
+class LivePlaylistFollower:
+    """直播跟随模式：按#EXT-X-TARGETDURATION周期重新拉取媒体播放列表，
+    根据#EXT-X-MEDIA-SEQUENCE只下载新出现的片段，遇到#EXT-X-ENDLIST后下载完剩余片段并结束。
+
+    片段按媒体序列号命名为segment_{序列号:08d}.ts（fMP4为.m4s），重启跟随时已下载的片段不会重复下载；
+    初始化片段（#EXT-X-MAP）在第一个用到它的片段之前下载。
+    """
+
+    # 连续拉取失败多少次后放弃（例如鉴权参数已过期）
+    MAX_CONSECUTIVE_FAILURES = 10
+
+    def __init__(self, url, segment_dir, segment_downloader, workers=4, session=None):
+        self.url = url
+        self.segment_dir = segment_dir
+        self.segment_downloader = segment_downloader
+        # 拉取播放列表使用的会话，默认与片段下载器共享
+        self.session = session or segment_downloader.session
+        self.workers = workers
+        self.last_sequence = None
+        self.target_duration = 6.0
+        self.queue = asyncio.Queue()
+
+    async def run(self, initial_text=None):
+        """持续跟随播放列表直到#EXT-X-ENDLIST或连续拉取失败，返回是否跟随到了直播结束"""
+        await asyncio.to_thread(os.makedirs, self.segment_dir, exist_ok=True)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        failures = 0
+        ended = False
+        text = initial_text
+        try:
+            while True:
+                if text is None:
+                    text = await self._fetch_playlist()
+                if text is None:
+                    failures += 1
+                    if failures >= self.MAX_CONSECUTIVE_FAILURES:
+                        logger.error(f"[LIVE] 连续 {failures} 次拉取失败，停止跟随: {self.url}")
+                        break
+                    new_count = 0
+                else:
+                    failures = 0
+                    new_count, ended = self._process(text)
+                    if ended:
+                        logger.info(f"[LIVE] 检测到#EXT-X-ENDLIST，直播结束: {self.url}")
+                        break
+                # 播放列表没有变化时按目标时长的一半重试（RFC 8216 6.3.4）
+                await asyncio.sleep(self.target_duration if new_count else self.target_duration / 2)
+                text = None
+            await self.queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        logger.info(f"[LIVE] 跟随结束，最后的媒体序列号: {self.last_sequence}")
+        return ended
+
+    async def _fetch_playlist(self):
+        import aiohttp
+        try:
+            async with self.session.get(
+                    self.url, headers=PLAYLIST_HEADERS, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                if resp.status != 200:
+                    logger.warning(f"[LIVE] 拉取播放列表失败 HTTP {resp.status}: {self.url}")
+                    return None
+                return await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"[LIVE] 拉取播放列表出错 {e!r}: {self.url}")
+            return None
+
+    def _process(self, text):
+        """将新出现的片段加入下载队列，返回(新片段数, 是否已结束)"""
+        playlist = parse_playlist(text, self.url)
+        if playlist.is_master:
+            logger.warning(f"[LIVE] 跟随的是主播放列表，无法直接下载片段: {self.url}")
+            return 0, True
+        media_sequence = playlist.media_sequence
+        if playlist.target_duration:
+            self.target_duration = playlist.target_duration
+        if self.last_sequence is not None:
+            if media_sequence + len(playlist.segments) - 1 < self.last_sequence:
+                logger.warning(f"[LIVE] 媒体序列号回退到 {media_sequence}，视为直播流重启")
+                self.last_sequence = media_sequence - 1
+            elif media_sequence > self.last_sequence + 1:
+                logger.warning(f"[LIVE] 跟随落后，丢失片段 {self.last_sequence + 1}-{media_sequence - 1}")
+        new_count = 0
+        for segment in playlist.segments:
+            if self.last_sequence is None or segment.sequence > self.last_sequence:
+                self.queue.put_nowait(segment)
+                self.last_sequence = segment.sequence
+                new_count += 1
+        if new_count:
+            logger.info(f"[LIVE] 新增 {new_count} 个片段，最新媒体序列号 {self.last_sequence}")
+        return new_count, playlist.ended
+
+    async def _worker(self):
+        from download_tool import segment_extension
+        while True:
+            segment = await self.queue.get()
+            try:
+                filepath = os.path.join(self.segment_dir,
+                                        f"segment_{segment.sequence:08d}{segment_extension(segment)}")
+                if not await asyncio.to_thread(os.path.exists, filepath):
+                    if segment.init_section is not None:
+                        await self.segment_downloader.ensure_init_section(segment.init_section, self.segment_dir)
+                    await self.segment_downloader.download_segment(segment, filepath)
+            except Exception as e:
+                logger.error(f"[LIVE] 片段 {segment.sequence} 下载出错: {e}")
+            finally:
+                self.queue.task_done()
+
+
+# WS消息中的m3u8 URL（预编译，http和https共用一个模式）
+M3U8_URL_RE = re.compile(r'https?://[^\s<>"\'{}|\\^`]+?\.m3u8[^\s<>"\'{}|\\^`]*', re.IGNORECASE)
+
+
+def is_m3u8_url(url):
+    """URL中是否含有.m3u8，与M3U8_URL_RE和页面脚本的过滤一样不区分大小写"""
+    return '.m3u8' in url.lower()
+
+
+def extract_m3u8_urls(text):
+    """从WS消息文本中提取m3u8 URL，按出现顺序去重
+
+    直播间的聊天、点赞消息绝大多数不含m3u8，先用子串判断跳过，避免对每条消息运行正则。
+    正则和页面脚本的过滤都不区分大小写，子串判断也要覆盖.M3u8之类的写法：数字3没有大小写，
+    只需查找3u8和3U8，不必为每条消息生成小写副本。
+    """
+    if '3u8' not in text and '3U8' not in text:
+        return []
+    # JSON字符串中的斜杠可能被转义为\/
+    if '\\/' in text:
+        text = text.replace('\\/', '/')
+    return list(dict.fromkeys(M3U8_URL_RE.findall(text)))
+
+
+def create_playlist_session():
+    """创建拉取m3u8使用的aiohttp会话（连接池和DNS缓存在整个采集过程中复用）"""
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector, headers=PLAYLIST_HEADERS,
+                                 timeout=aiohttp.ClientTimeout(total=30))
+
 
 class M3U8Downloader:
-    def __init__(self):
-        self.downloaded_urls = set()
-        self.download_dir = "downloaded_m3u8"
-        os.makedirs(self.download_dir, exist_ok=True)
-        logger.info(f"M3U8下载目录: {os.path.abspath(self.download_dir)}")
+    # 去重记录的最大条数，超过后淘汰最久未出现的URL，长时间运行时内存不会持续增长
+    MAX_SEEN_URLS = 4096
+
+    def __init__(self, segment_downloader=None, live_follow=False, max_bandwidth=None, max_height=None,
+                 writer=None, download_dir="downloaded_m3u8", session=None, index=None, room=None):
+        # 已处理过的URL去重键（见normalize_url_key），按最近出现顺序排列的有界LRU
+        self.seen_keys = OrderedDict()
+        # 正在下载的播放列表：同一个URL被WS、XHR和网络事件同时报告时共享一个任务
+        self.inflight = {}
+        # 由本下载器启动的后台任务（播放列表下载、片段下载、直播跟随），关闭时一并取消
+        self.tasks = set()
+        self.stream_count = 0
+        # 多个直播间可共享同一个会话和写入线程，外部传入的由调用方负责关闭
+        self.session = session
+        self._owns_session = session is None
+        # m3u8文件在写入线程中原子写入，慢速磁盘不会阻塞事件循环中的消息处理
+        self.writer = writer or AsyncFileWriter()
+        self._owns_writer = writer is None
+        # 传入AsyncSegmentDownloader时，保存m3u8后直接在当前事件循环中下载其中的TS片段
+        self.segment_downloader = segment_downloader
+        # 直播跟随模式：未结束的播放列表会被持续轮询，需要同时传入segment_downloader
+        self.live_follow = live_follow and segment_downloader is not None
+        # 遇到主播放列表时按带宽（bps）/分辨率高度选择变体，避免下载超出需要的码率
+        self.max_bandwidth = max_bandwidth
+        self.max_height = max_height
+        self.download_dir = download_dir
+        # 采集索引（capture_index.CaptureIndex）：跨重启去重并记录保存的播放列表和片段下载任务
+        self.index = index
+        self.room = room
+        self._dir_ready = False
+
+    async def start(self):
+        """创建下载目录和整个监听过程共用的连接池会话"""
+        if not self._dir_ready:
+            await asyncio.to_thread(os.makedirs, self.download_dir, exist_ok=True)
+            self._dir_ready = True
+            logger.info(f"M3U8下载目录: {os.path.abspath(self.download_dir)}")
+        if self.session is None:
+            self.session = create_playlist_session()
+        return self
+
+    async def close(self):
+        """取消仍在运行的后台任务，关闭自己创建的会话和写入线程"""
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self._owns_writer:
+            await asyncio.to_thread(self.writer.close)
+
+    def spawn(self, coro):
+        """在后台运行coro并保留任务引用，关闭下载器时会被取消"""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _remember(self, key):
+        """记录去重键并淘汰超出上限的最旧记录"""
+        self.seen_keys[key] = True
+        self.seen_keys.move_to_end(key)
+        while len(self.seen_keys) > self.MAX_SEEN_URLS:
+            self.seen_keys.popitem(last=False)
 
     def should_download(self, url):
-        """检查是否应该下载这个URL"""
-        if url in self.downloaded_urls:
+        """检查是否应该下载这个URL；采集索引的查询涉及磁盘，在_fetch_m3u8中通过写入线程进行"""
+        key = normalize_url_key(url)
+        if key in self.seen_keys:
+            self.seen_keys.move_to_end(key)
             logger.debug(f"URL已下载过: {url}")
             return False
 
         # 放宽条件：只要包含m3u8就下载
-        if '.m3u8' in url:
+        if is_m3u8_url(url):
             logger.info(f"检测到m3u8 URL: {url}")
             return True
 
@@ -187,202 +491,701 @@ class M3U8Downloader:
 
         return False
 
-    async def download_m3u8(self, url):
-        """异步下载m3u8文件"""
-        if not self.should_download(url):
+    def handle_playlist(self, url, filename, content_text, playlist=None, filepath=None):
+        """解析已保存的m3u8：主播放列表按带宽/分辨率选择变体继续下载，媒体播放列表交给片段下载器或直播跟随器
+
+        playlist为已解析的结果（省略时解析content_text），filepath为保存的路径，用于在采集索引中记录下载任务。
+        """
+        if '#EXTM3U' not in content_text:
+            return
+        logger.info(f"[M3U8] 成功下载有效的m3u8文件: {filename}")
+        if playlist is None:
+            playlist = parse_playlist(content_text, url)
+        if playlist.is_master:
+            variant = select_variant(playlist, self.max_bandwidth, self.max_height)
+            if variant is not None:
+                logger.info(f"[M3U8] 主播放列表包含 {len(playlist.variants)} 个变体，"
+                            f"选择 {variant.bandwidth} bps {variant.resolution or ''}: {variant.uri}")
+                self.spawn(self.download_m3u8(variant.uri))
             return
 
-        self.downloaded_urls.add(url)
-        logger.info(f"开始下载: {url}")
+        segment_dir = os.path.join(self.download_dir, os.path.splitext(filename)[0] + "_segments")
+        if self.live_follow and not playlist.ended:
+            # 直播中的播放列表：持续跟随，由跟随器下载现有和后续新增的片段
+            logger.info(f"[LIVE] 播放列表未结束，进入直播跟随模式: {filename}")
+            follower = LivePlaylistFollower(url, segment_dir, self.segment_downloader, session=self.session)
+            self.spawn(self._segment_job(self._follow(follower, content_text), filepath, segment_dir))
+            return
+        if playlist.segments:
+            logger.info(f"[M3U8] 包含 {len(playlist.segments)} 个片段，总时长 {playlist.total_duration:.1f}s")
+            # 记录前几个片段链接
+            for i, segment in enumerate(playlist.segments[:3]):
+                logger.info(f"[TS{i + 1}] {segment.uri}")
+            if self.segment_downloader is not None:
+                self.spawn(self._segment_job(self.segment_downloader.download(playlist.segments, segment_dir),
+                                             filepath, segment_dir, playlist))
 
+    async def _follow(self, follower, initial_text):
+        """运行直播跟随；没有跟随到#EXT-X-ENDLIST就停止时（例如鉴权参数过期后连续403）移除去重键，
+        之后页面换新签名请求同一播放列表时还能重新开始跟随，已下载的片段不会重复下载"""
+        ended = False
         try:
-            # 从URL中提取文件名
-            parsed_url = urlparse(url)
-            filename = os.path.basename(parsed_url.path)
-            if not filename or '.' not in filename:
-                # 如果没有扩展名，添加m3u8扩展名
-                filename = f"stream_{len(self.downloaded_urls)}.m3u8"
-            elif not filename.endswith('.m3u8'):
-                # 如果已有扩展名但不是m3u8，保留原扩展名
-                pass
+            ended = await follower.run(initial_text)
+        finally:
+            if not ended:
+                self.seen_keys.pop(normalize_url_key(follower.url), None)
+        return ended
 
-            filepath = os.path.join(self.download_dir, filename)
+    async def _segment_job(self, coro, playlist_path, segment_dir, playlist=None):
+        """运行片段下载或直播跟随，并在采集索引中记录任务的开始和结果；直播跟随的片段数事先未知"""
+        if self.index is None or playlist_path is None:
+            return await coro
+        job_id = await self.writer.call(self.index.start_job, playlist_path, segment_dir, None, self.room)
+        ok = False
+        try:
+            ok = await coro
+        finally:
+            await self.writer.call(self.index.finish_job, job_id, bool(ok),
+                                   len(playlist.segments) if playlist else None,
+                                   playlist.total_duration if playlist else None)
+        return ok
 
-            # 设置请求头，模拟浏览器
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Referer': 'https://n.dingtalk.com/',
-            }
+    async def download_m3u8(self, url, response=None):
+        """异步下载m3u8文件；同一播放列表正在下载时等待已有的任务，不重复请求
+
+        传入浏览器中的Playwright Response时直接使用浏览器已收到的响应体，
+        读取不到时（重定向、非200、响应体已被释放）再通过HTTP重新请求。
+        """
+        key = normalize_url_key(url)
+        task = self.inflight.get(key)
+        if task is None:
+            if not self.should_download(url):
+                return
+            # 去重键在保存成功后才记入（见_fetch_m3u8），失败的播放列表（例如签名过期的403）之后换新签名还能重新请求
+            task = self.inflight[key] = self.spawn(self._fetch_m3u8(url, response))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            logger.debug(f"合并到进行中的下载: {url}")
+        await asyncio.shield(task)
+
+    def _playlist_filename(self, url):
+        # 从URL中提取文件名
+        filename = os.path.basename(urlparse(url).path)
+        if not filename or '.' not in filename:
+            # 如果没有扩展名，添加m3u8扩展名
+            filename = f"stream_{self.stream_count}.m3u8"
+        # 如果已有扩展名但不是m3u8，保留原扩展名
+        return filename
+
+    @staticmethod
+    async def _read_browser_response(url, response):
+        """读取浏览器响应的(状态码, 响应头, 响应体)，不可用时返回None"""
+        try:
+            if response.status != 200:
+                logger.debug(f"[M3U8] 浏览器响应 HTTP {response.status}，改为直接请求: {url}")
+                return None
+            return response.status, await response.all_headers(), await response.body()
+        except Exception as e:
+            logger.debug(f"[M3U8] 无法读取浏览器响应体，改为直接请求: {e!r} {url}")
+            return None
+
+    async def _fetch_m3u8(self, url, response=None):
+        key = normalize_url_key(url)
+        # 在写入线程中查询索引，SQLite与写入共用一个锁，不能在事件循环中等待
+        if self.index is not None and await self.writer.call(self.index.is_captured, key):
+            # 之前的运行中已经完整保存过，记入内存LRU，之后不再查询索引
+            self._remember(key)
+            logger.debug(f"URL已在采集索引中: {url}")
+            return
+        await self.start()
+        self.stream_count += 1
+        filename = self._playlist_filename(url)
+        filepath = os.path.join(self.download_dir, filename)
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                    if resp.status == 200:
-                        content = await resp.read()
-                        with open(filepath, "wb") as f:
-                            f.write(content)
-                        logger.info(f"[SAVED] {filename} ({len(content)} bytes)")
-
-                        # 尝试解析m3u8内容
-                        try:
-                            content_text = content.decode('utf-8')
-                            if '#EXTM3U' in content_text:
-                                logger.info(f"[M3U8] 成功下载有效的m3u8文件: {filename}")
-                                # 提取所有ts文件链接
-                                ts_links = re.findall(r'^[^#].*\.ts(?:\?.*)?$', content_text, re.MULTILINE)
-                                if ts_links:
-                                    logger.info(f"[M3U8] 包含 {len(ts_links)} 个TS片段")
-                                    # 记录前几个TS链接
-                                    for i, ts_link in enumerate(ts_links[:3]):
-                                        logger.info(f"[TS{i + 1}] {ts_link}")
-                        except UnicodeDecodeError:
-                            logger.warning(f"[M3U8] 文件 {filename} 内容无法解码为UTF-8")
-                        except Exception as e:
-                            logger.error(f"[M3U8] 解析错误: {e}")
-                    else:
+        try:
+            captured = await self._read_browser_response(url, response) if response is not None else None
+            if captured is not None:
+                source = "browser"
+                status, headers, content = captured
+            else:
+                source = "fetch"
+                logger.info(f"开始下载: {url}")
+                async with self.session.get(url) as resp:
+                    if resp.status != 200:
                         logger.warning(f"[DOWNLOAD FAILED] HTTP {resp.status} for {url}")
+                        return
+                    status, headers, content = resp.status, dict(resp.headers), await resp.read()
+
+            await self.writer.write(filepath, content)
+            # 元数据与播放列表放在一起，记录来源和抓取时间，便于之后判断签名参数是否已过期
+            metadata = {
+                "url": url,
+                "status": status,
+                "headers": headers,
+                "captured_at": datetime.now().isoformat(timespec="seconds"),
+                "source": source,
+                "size": len(content),
+            }
+            await self.writer.write(filepath + ".meta.json",
+                                    json.dumps(metadata, ensure_ascii=False, indent=2).encode("utf-8"))
+            self._remember(key)
+            logger.info(f"[SAVED] {filename} ({len(content)} bytes, {source})")
+            metrics.PLAYLISTS_SAVED.inc(source=source)
+            metrics.log_event("playlist_saved", url=url, path=filepath, source=source, size=len(content))
+
+            # 尝试解析m3u8内容
+            try:
+                text = content.decode('utf-8')
+                playlist = parse_playlist(text, url) if '#EXTM3U' in text else None
+                if self.index is not None:
+                    await self.writer.call(self.index.record_playlist, filepath, url, key, self.room, source, playlist)
+                self.handle_playlist(url, filename, text, playlist, filepath)
+            except UnicodeDecodeError:
+                logger.warning(f"[M3U8] 文件 {filename} 内容无法解码为UTF-8")
+            except Exception as e:
+                logger.error(f"[M3U8] 解析错误: {e}")
         except asyncio.TimeoutError:
             logger.error(f"[DOWNLOAD TIMEOUT] {url}")
         except Exception as e:
             logger.error(f"[DOWNLOAD ERROR] {e} for {url}")
 
 
-async def open_and_listen(live_share_url=LIVE_SHARE_URL, headful=True, user_data_dir=None):
-    downloader = M3U8Downloader()
+# 轻量采集模式拦截的资源类型：发现m3u8只需要页面脚本、XHR/fetch和WebSocket
+BLOCKED_RESOURCE_TYPES = frozenset(("image", "font", "stylesheet", "media"))
+
 
-    async with async_playwright() as pw:
+async def launch_browser(pw, headful=True, lightweight=False, cdp_endpoint=None):
+    """优先连接已在运行的浏览器，否则启动Edge，找不到Edge时使用Chromium
+
+    依次尝试cdp_endpoint、browser_daemon.py守护进程状态文件中的地址和9222端口；
+    lightweight为True时附加LIGHTWEIGHT_BROWSER_ARGS，连接已运行的浏览器时启动参数不起作用。
+    """
+    from browser_daemon import daemon_endpoint
+    endpoints = [cdp_endpoint, await asyncio.to_thread(daemon_endpoint), DEFAULT_CDP_ENDPOINT]
+    for endpoint in dict.fromkeys(filter(None, endpoints)):
         try:
-            browser = await pw.chromium.connect_over_cdp("http://localhost:9222")
-            logger.info("已连接到正在运行的 Edge 浏览器实例")
+            browser = await pw.chromium.connect_over_cdp(endpoint)
+            logger.info(f"已连接到正在运行的浏览器实例: {endpoint}")
+            return browser
         except Exception as e:
-            logger.warning(f"无法连接到正在运行的 Edge 浏览器: {e}")
-            logger.info("将启动新的 Edge 浏览器实例...")
-            edge_paths = [
-                "C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe",
-                "C:\\Program Files\\Microsoft\\Edge\\Application\\msedge.exe",
-                "/Applications/Microsoft Edge.app/Contents/MacOS/Microsoft Edge",
-                "/usr/bin/microsoft-edge",
-                "/usr/bin/microsoft-edge-stable"
-            ]
-            edge_executable_path = None
-            for path in edge_paths:
-                if os.path.exists(path):
-                    edge_executable_path = path
-                    break
-            if edge_executable_path:
-                logger.info(f"使用 Edge 浏览器路径: {edge_executable_path}")
-                browser = await pw.chromium.launch(
-                    executable_path=edge_executable_path,
-                    headless=not headful,
-                    args=[
-                        "--disable-features=IsolateOrigins,site-per-process",
-                        "--remote-debugging-port=9222",
-                        "--disable-web-security",
-                        "--allow-running-insecure-content"
-                    ]
-                )
-            else:
-                logger.info("未找到 Edge 浏览器，使用 Chromium")
-                browser = await pw.chromium.launch(
-                    headless=not headful,
-                    args=[
-                        "--disable-features=IsolateOrigins,site-per-process",
-                        "--remote-debugging-port=9222",
-                        "--disable-web-security",
-                        "--allow-running-insecure-content"
-                    ]
-                )
-
-        context_args = {}
-        if user_data_dir:
-            context_args["user_data_dir"] = user_data_dir
-            logger.info(f"使用用户数据目录: {user_data_dir}")
-
-        context = await browser.new_context(**context_args)
-        page = await context.new_page()
-
-        async def handle_from_page(source, payload_json_str):
-            try:
-                data = json.loads(payload_json_str)
-            except Exception:
-                data = {"raw": payload_json_str}
+            logger.warning(f"无法连接到正在运行的浏览器 {endpoint}: {e}")
+    logger.info("将启动新的 Edge 浏览器实例...")
+    return await pw.chromium.launch(**_launch_options(headful, lightweight))
 
-            try:
-                kind = data.get("kind")
-                url = data.get("url") or ""
-
-                # 处理WebSocket消息
-                if kind and "ws_message" in kind:
-                    data_length = data.get("dataLength", 0)
-                    data_preview = data.get("dataPreview", "")
-
-                    if data_length > 0:
-                        logger.debug(f"[WS] {kind} | {url[:80]} | 长度: {data_length}")
-
-                        # 提取并下载m3u8文件
-                        m3u8_patterns = [
-                            r'(https?://[^\s<>"\'{}|\\^`]+?\.m3u8[^\s<>"\'{}|\\^`]*)',
-                            r'(https?://[^\s<>"\'{}|\\^`]*?/live/[^\s<>"\'{}|\\^`]*\.m3u8[^\s<>"\'{}|\\^`]*)',
-                            r'(http?://[^\s<>"\'{}|\\^`]+?\.m3u8[^\s<>"\'{}|\\^`]*)',
-                            r'(http?://[^\s<>"\'{}|\\^`]*?/live/[^\s<>"\'{}|\\^`]*\.m3u8[^\s<>"\'{}|\\^`]*)'
-                        ]
-
-                        for pattern in m3u8_patterns:
-                            matches = re.findall(pattern, data_preview, re.IGNORECASE)
-                            for m3u8_url in matches:
-                                logger.info(f"[M3U8 FOUND IN WS] {m3u8_url}")
-                                # 立即下载，不等待
-                                asyncio.create_task(downloader.download_m3u8(m3u8_url))
-
-                # 处理其他类型的消息
-                elif kind and ("xhr_response" in kind or "fetch_response" in kind):
-                    url = data.get("url", "")
-                    if '.m3u8' in url:
-                        logger.info(f"[M3U8 RESPONSE] {kind} | {url}")
-                        asyncio.create_task(downloader.download_m3u8(url))
 
+def _launch_options(headful, lightweight):
+    """启动新浏览器的参数：找到Edge时使用Edge，否则使用Playwright自带的Chromium"""
+    options = {"headless": not headful, "args": BROWSER_ARGS + (LIGHTWEIGHT_BROWSER_ARGS if lightweight else [])}
+    edge_executable_path = next((path for path in EDGE_PATHS if os.path.exists(path)), None)
+    if edge_executable_path:
+        logger.info(f"使用 Edge 浏览器路径: {edge_executable_path}")
+        options["executable_path"] = edge_executable_path
+    else:
+        logger.info("未找到 Edge 浏览器，使用 Chromium")
+    return options
+
+
+class ResourceBlocker:
+    """拦截采集不需要的资源请求（图片、字体、样式表、音视频），m3u8请求始终放行"""
+
+    def __init__(self, blocked_types=BLOCKED_RESOURCE_TYPES):
+        self.blocked_types = blocked_types
+        self.blocked = 0
+        self.allowed = 0
+
+    async def handle(self, route):
+        request = route.request
+        if request.resource_type in self.blocked_types and not is_m3u8_url(request.url):
+            self.blocked += 1
+            await route.abort()
+        else:
+            self.allowed += 1
+            await route.continue_()
+
+
+async def open_browser_context(pw, headful=True, lightweight=False, cdp_endpoint=None, user_data_dir=None):
+    """打开浏览器和上下文，返回(browser, context)
+
+    指定user_data_dir时用launch_persistent_context启动使用该目录的新浏览器（登录状态保存在其中），
+    此时browser为None，关闭context即退出浏览器；否则按launch_browser连接或启动浏览器。
+    通过CDP连接的浏览器（如browser_daemon.py）使用其默认上下文，页面共享其配置目录中的登录状态，
+    该上下文标记为shared，由close_browser_context保留；新启动的浏览器没有上下文，此时新建一个。
+    lightweight为True时在上下文上注册ResourceBlocker，对其中所有页面生效。
+    """
+    if user_data_dir:
+        logger.info(f"使用用户数据目录: {user_data_dir}")
+        browser = None
+        context = await pw.chromium.launch_persistent_context(user_data_dir, **_launch_options(headful, lightweight))
+        context.shared = False
+    else:
+        browser = await launch_browser(pw, headful, lightweight, cdp_endpoint)
+        if browser.contexts:
+            context = browser.contexts[0]
+            context.shared = True
+        else:
+            context = await browser.new_context()
+            context.shared = False
+    if lightweight:
+        context.resource_blocker = ResourceBlocker()
+        await context.route("**/*", context.resource_blocker.handle)
+        logger.info(f"轻量采集模式: 拦截 {', '.join(sorted(BLOCKED_RESOURCE_TYPES))} 请求")
+    return browser, context
+
+
+async def close_browser_context(browser, context):
+    """关闭open_browser_context打开的上下文和浏览器
+
+    共享的默认上下文不关闭，只撤销本进程注册的资源拦截；对通过CDP连接的浏览器，browser.close()只断开连接。
+    """
+    if context.shared:
+        blocker = getattr(context, "resource_blocker", None)
+        if blocker is not None:
+            await context.unroute("**/*", blocker.handle)
+    else:
+        await context.close()
+    if browser is not None:
+        await browser.close()
+
+
+async def create_segment_downloader(concurrency=64):
+    """创建所有直播间共用的片段下载器及其写入线程"""
+    from async_downloader import AsyncSegmentDownloader
+    segment_writer = AsyncFileWriter(workers=4, warn_depth=concurrency * 4, name="segment-writer")
+    segment_downloader = AsyncSegmentDownloader(concurrency=concurrency, writer=segment_writer)
+    await segment_downloader.__aenter__()
+    return segment_downloader, segment_writer
+
+
+async def log_resource_usage(rooms, context=None):
+    """输出各直播间页面的内存和CPU占用，以及轻量模式拦截的请求数"""
+    for room in rooms:
+        try:
+            usage = await room.resource_usage()
+        except Exception as e:
+            logger.debug(f"[RESOURCE] {room.name} 无法读取页面指标: {e}")
+            continue
+        if usage is not None:
+            cpu = f"{usage['cpu_percent']:.1f}%" if usage["cpu_percent"] is not None else "-"
+            logger.info(f"[RESOURCE] {room.name}: JS堆 {usage['js_heap_used_mb']:.1f}/{usage['js_heap_total_mb']:.1f} MB，"
+                        f"DOM节点 {usage['nodes']}，CPU {cpu}")
+    blocker = getattr(context, "resource_blocker", None)
+    if blocker is not None:
+        logger.info(f"[RESOURCE] 已拦截 {blocker.blocked} 个请求，放行 {blocker.allowed} 个")
+
+
+def log_writer_depths(writers):
+    if any(writer.queue_depth for writer in writers):
+        logger.info("[WRITER] 写入队列深度: " + ", ".join(
+            f"当前 {writer.queue_depth} / 峰值 {writer.max_queue_depth}" for writer in writers))
+
+
+def room_name_from_url(url):
+    """直播间名称：优先使用URL中的roomId参数，否则使用URL路径的最后一段"""
+    parsed = urlparse(url)
+    room_id = parse_qs(parsed.query).get("roomId")
+    name = room_id[0] if room_id else os.path.basename(parsed.path.rstrip("/")) or parsed.netloc
+    # 名称会用作输出目录名
+    return re.sub(r"[^\w.-]", "_", name) or "room"
+
+
+def load_room_config(path):
+    """读取直播间配置，返回{名称: URL}
+
+    配置文件为JSON，可以是URL列表，也可以是{"rooms": [...]}；
+    每一项是URL字符串或{"name": "...", "url": "..."}，省略name时由URL推导（见room_name_from_url）。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    entries = config.get("rooms", []) if isinstance(config, dict) else config
+    if not isinstance(entries, list):
+        raise ValueError(f"rooms应为列表: {path}")
+    rooms = OrderedDict()
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        if not isinstance(entry, dict) or not entry.get("url"):
+            raise ValueError(f"无效的直播间配置项: {entry!r}")
+        name = entry.get("name")
+        name = re.sub(r"[^\w.-]", "_", name) if name else room_name_from_url(entry["url"])
+        if name in rooms:
+            raise ValueError(f"直播间名称重复: {name}")
+        rooms[name] = entry["url"]
+    return rooms
+
+
+class RoomCapture:
+    """一个直播间的采集：在浏览器上下文中打开直播页面，把页面上发现的m3u8交给该直播间的M3U8Downloader"""
+
+    def __init__(self, name, url, downloader):
+        self.name = name
+        self.url = url
+        self.downloader = downloader
+        self.page = None
+        self.cdp = None
+        # 上一次读取的(TaskDuration, Timestamp)，用于计算两次读取之间的CPU占用
+        self._last_cpu_sample = None
+
+    def handle_event(self, data):
+        kind = data.get("kind")
+        url = data.get("url") or ""
+
+        # 处理WebSocket消息
+        if kind and "ws_message" in kind:
+            data_length = data.get("dataLength", 0)
+            data_preview = data.get("dataPreview", "")
+
+            metrics.WS_MESSAGES.inc()
+            if data_length > 0:
+                logger.debug(f"[WS] {self.name} {kind} | {url[:80]} | 长度: {data_length}")
+
+                # 提取并下载m3u8文件（同一条消息中重复出现的URL只处理一次）
+                for m3u8_url in extract_m3u8_urls(data_preview):
+                    logger.info(f"[M3U8 FOUND IN WS] {self.name} {m3u8_url}")
+                    self.record_discovery(m3u8_url, "ws")
+                    # 立即下载，不等待
+                    self.downloader.spawn(self.downloader.download_m3u8(m3u8_url))
+
+        # 处理其他类型的消息
+        elif kind and ("xhr_response" in kind or "fetch_response" in kind):
+            if is_m3u8_url(url):
+                logger.info(f"[M3U8 RESPONSE] {self.name} {kind} | {url}")
+                self.record_discovery(url, "xhr")
+                self.downloader.spawn(self.downloader.download_m3u8(url))
+
+    def record_discovery(self, url, source):
+        metrics.PLAYLISTS_DISCOVERED.inc(source=source)
+        metrics.log_event("playlist_discovered", room=self.name, url=url, source=source)
+
+    async def handle_from_page(self, source, payload_json_str):
+        try:
+            data = json.loads(payload_json_str)
+        except Exception:
+            data = {"raw": payload_json_str}
+
+        # 页面上的其他脚本也可能调用pyReceive，不是对象的载荷直接忽略
+        if not isinstance(data, dict):
+            logger.debug(f"忽略非对象载荷: {payload_json_str[:100]!r}")
+            return
+        # 页面脚本按batchMs批量发送时，一次调用携带多个事件
+        events = data.get("events") if data.get("kind") == "batch" else [data]
+        if not isinstance(events, list):
+            return
+        for event in events:
+            if not isinstance(event, dict):
+                continue
+            try:
+                self.handle_event(event)
             except Exception as e:
                 logger.error(f"handle_from_page error: {e}")
 
-        await page.expose_binding("pyReceive", handle_from_page)
+    async def on_response(self, resp):
+        """监听网络响应"""
+        try:
+            url = resp.url
+            if is_m3u8_url(url):
+                logger.info(f"[M3U8 NET RESPONSE] {self.name} {resp.status} {url}")
+                self.record_discovery(url, "network")
+                # 浏览器已经收到了播放列表，直接使用其响应体，避免再请求一次
+                self.downloader.spawn(self.downloader.download_m3u8(url, resp))
+            elif any(ext in url for ext in ['.ts', '.m4s', '.mp4']):
+                logger.debug(f"[MEDIA RESPONSE] {resp.status} {url}")
+        except Exception as e:
+            logger.error(f"[RESPONSE ERROR] {e}")
 
-        # 监听网络响应
-        async def on_response(resp):
+    async def open(self, context, inject_js):
+        """在context中新建页面、注册监听并打开直播间"""
+        await self.downloader.start()
+        page = self.page = await context.new_page()
+        await page.expose_binding("pyReceive", self.handle_from_page)
+        page.on("response", lambda resp: self.downloader.spawn(self.on_response(resp)))
+        # 初始化脚本需要在导航之前注册，才能在直播页面自身的脚本运行前完成拦截
+        await page.add_init_script(inject_js)
+        logger.info(f"Opening page: {self.name} {self.url}")
+        try:
+            await page.goto(self.url, wait_until="networkidle")
+        except Exception as e:
+            # 直播页面持续有网络请求时可能等不到networkidle，页面本身已打开，监听仍然有效
+            logger.warning(f"[ROOM] {self.name} 页面加载未完成: {e}")
+
+    async def resource_usage(self):
+        """通过CDP的Performance.getMetrics读取页面的JS堆内存、DOM节点数和CPU占用
+
+        cpu_percent为距上次调用期间页面主线程任务耗时占比，第一次调用时为None。
+        """
+        if self.page is None:
+            return None
+        if self.cdp is None:
+            self.cdp = await self.page.context.new_cdp_session(self.page)
+            await self.cdp.send("Performance.enable")
+        result = await self.cdp.send("Performance.getMetrics")
+        usage = {metric["name"]: metric["value"] for metric in result["metrics"]}
+        sample = (usage.get("TaskDuration", 0.0), usage.get("Timestamp", 0.0))
+        cpu_percent = None
+        if self._last_cpu_sample is not None and sample[1] > self._last_cpu_sample[1]:
+            cpu_percent = (sample[0] - self._last_cpu_sample[0]) / (sample[1] - self._last_cpu_sample[1]) * 100
+        self._last_cpu_sample = sample
+        return {
+            "js_heap_used_mb": usage.get("JSHeapUsedSize", 0) / 2 ** 20,
+            "js_heap_total_mb": usage.get("JSHeapTotalSize", 0) / 2 ** 20,
+            "nodes": int(usage.get("Nodes", 0)),
+            "cpu_percent": cpu_percent,
+        }
+
+    async def close(self):
+        """关闭页面并停止该直播间的下载任务"""
+        if self.cdp is not None:
+            try:
+                await self.cdp.detach()
+            except Exception:
+                pass
+            self.cdp = None
+        if self.page is not None:
             try:
-                url = resp.url
-                if '.m3u8' in url:
-                    logger.info(f"[M3U8 NET RESPONSE] {resp.status} {url}")
-                    asyncio.create_task(downloader.download_m3u8(url))
-                elif any(ext in url for ext in ['.ts', '.m4s', '.mp4']):
-                    logger.debug(f"[MEDIA RESPONSE] {resp.status} {url}")
+                await self.page.close()
             except Exception as e:
-                logger.error(f"[RESPONSE ERROR] {e}")
+                logger.warning(f"[ROOM] {self.name} 关闭页面出错: {e}")
+            self.page = None
+        await self.downloader.close()
+
+
+class CaptureSupervisor:
+    """多直播间采集：所有直播间的页面共用一个浏览器上下文、m3u8会话和片段下载器
+
+    直播间列表从JSON配置文件读取（格式见load_room_config），运行中定期检查文件修改时间，
+    新增的直播间会打开页面，移除的直播间会关闭页面并停止其下载任务，不需要重启进程。
+    每个直播间的文件保存在output_root/<直播间名称>下。
+    """
 
-        page.on("response", lambda resp: asyncio.create_task(on_response(resp)))
+    CONFIG_POLL_INTERVAL = 5
 
-        logger.info(f"Opening page: {live_share_url}")
-        await page.goto(live_share_url, wait_until="networkidle")
-        await page.add_init_script(INJECT_JS)
-        await page.evaluate("() => { /* injected monitor active */ }")
-        logger.info("注入完成。浏览器窗口已打开。")
+    def __init__(self, config_path, output_root="downloaded_m3u8", headful=True, user_data_dir=None,
+                 download_segments=False, segment_concurrency=64, live_follow=False, max_bandwidth=None,
+                 max_height=None, monitor_filter=DEFAULT_MONITOR_FILTER, monitor_batch_ms=250,
+                 monitor_max_preview=10000, lightweight=False, cdp_endpoint=None):
+        self.config_path = config_path
+        self.output_root = output_root
+        # 轻量模式总是无头运行
+        self.headful = headful and not lightweight
+        self.lightweight = lightweight
+        self.cdp_endpoint = cdp_endpoint
+        self.user_data_dir = user_data_dir
+        self.download_segments = download_segments or live_follow
+        self.segment_concurrency = segment_concurrency
+        self.live_follow = live_follow
+        self.max_bandwidth = max_bandwidth
+        self.max_height = max_height
+        self.inject_js = build_inject_js(monitor_filter, monitor_batch_ms, monitor_max_preview)
+        self.rooms = {}
+        self.index = None
+        self.context = None
+        self.session = None
+        self.writer = None
+        self.segment_downloader = None
+        self.segment_writer = None
+        self._config_mtime = None
 
+    async def add_room(self, name, url):
+        downloader = M3U8Downloader(self.segment_downloader, self.live_follow, self.max_bandwidth, self.max_height,
+                                    writer=self.writer, download_dir=os.path.join(self.output_root, name),
+                                    session=self.session, index=self.index, room=name)
+        room = self.rooms[name] = RoomCapture(name, url, downloader)
         try:
-            while True:
-                await asyncio.sleep(1)
-        except asyncio.CancelledError:
-            pass
+            await room.open(self.context, self.inject_js)
+        except Exception as e:
+            logger.error(f"[ROOM] {name} 打开失败: {e}")
+            self.rooms.pop(name, None)
+            await room.close()
+            return
+        logger.info(f"[ROOM] 已加入直播间 {name}，当前共 {len(self.rooms)} 个")
+        metrics.log_event("room_added", room=name, url=url)
+
+    async def remove_room(self, name):
+        room = self.rooms.pop(name, None)
+        if room is not None:
+            await room.close()
+            logger.info(f"[ROOM] 已移除直播间 {name}，当前共 {len(self.rooms)} 个")
+            metrics.log_event("room_removed", room=name, url=room.url)
+
+    async def reload_config(self):
+        """配置文件有变化时重新读取，打开新增的直播间并关闭已移除或URL已变更的直播间"""
+        try:
+            mtime = (await asyncio.to_thread(os.stat, self.config_path)).st_mtime_ns
+        except OSError as e:
+            if self._config_mtime is not None:
+                logger.warning(f"[ROOM] 无法读取配置文件，保持当前直播间: {e}")
+                self._config_mtime = None
+            return
+        if mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        try:
+            rooms = await asyncio.to_thread(load_room_config, self.config_path)
+        except (OSError, ValueError) as e:
+            # 编辑中的配置文件可能暂时不是合法JSON，等下次修改后再读取
+            logger.error(f"[ROOM] 配置文件无效，保持当前直播间: {e}")
+            return
+        removed = [name for name, room in self.rooms.items() if rooms.get(name) != room.url]
+        await asyncio.gather(*(self.remove_room(name) for name in removed))
+        added = [(name, url) for name, url in rooms.items() if name not in self.rooms]
+        await asyncio.gather(*(self.add_room(name, url) for name, url in added))
+
+    async def run(self):
+        writers = []
+        lag_monitor = None
+        try:
+            if self.download_segments:
+                self.segment_downloader, self.segment_writer = await create_segment_downloader(
+                    self.segment_concurrency)
+                writers.append(self.segment_writer)
+            self.writer = AsyncFileWriter(name="playlist-writer")
+            writers.insert(0, self.writer)
+            # 所有直播间共用output_root下的一个采集索引
+            self.index = await asyncio.to_thread(open_index, self.output_root)
+            self.session = create_playlist_session()
+            lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+            from playwright.async_api import async_playwright
+            async with async_playwright() as pw:
+                browser, self.context = await open_browser_context(pw, self.headful, self.lightweight,
+                                                                   self.cdp_endpoint, self.user_data_dir)
+                try:
+                    ticks = 0
+                    while True:
+                        await self.reload_config()
+                        await asyncio.sleep(self.CONFIG_POLL_INTERVAL)
+                        ticks += self.CONFIG_POLL_INTERVAL
+                        if ticks % 60 == 0:
+                            log_writer_depths(writers)
+                            await log_resource_usage(list(self.rooms.values()), self.context)
+                except asyncio.CancelledError:
+                    pass
+                finally:
+                    await asyncio.gather(*(self.remove_room(name) for name in list(self.rooms)))
+                    await close_browser_context(browser, self.context)
         finally:
-            await context.close()
-            await browser.close()
+            if lag_monitor is not None:
+                lag_monitor.cancel()
+            if self.session is not None:
+                await self.session.close()
+            if self.segment_downloader is not None:
+                await self.segment_downloader.close()
+            for writer in writers:
+                await asyncio.to_thread(writer.close)
+            if self.index is not None:
+                self.index.close()
+
+
+async def open_and_listen(live_share_url=LIVE_SHARE_URL, headful=True, user_data_dir=None,
+                          download_segments=False, segment_concurrency=64, live_follow=False,
+                          monitor_filter=DEFAULT_MONITOR_FILTER, monitor_batch_ms=250, monitor_max_preview=10000,
+                          lightweight=False, cdp_endpoint=None, max_bandwidth=None, max_height=None):
+    """监听单个直播间，文件直接保存在downloaded_m3u8下；同时监听多个直播间见CaptureSupervisor
+
+    lightweight为True时总是无头运行。
+    """
+    headful = headful and not lightweight
+    segment_downloader = segment_writer = index = downloader = lag_monitor = None
+    # 打开浏览器失败时也要停止延迟监测、关闭索引和下载器
+    try:
+        if download_segments or live_follow:
+            segment_downloader, segment_writer = await create_segment_downloader(segment_concurrency)
+        index = await asyncio.to_thread(open_index, "downloaded_m3u8")
+        room_name = room_name_from_url(live_share_url)
+        downloader = M3U8Downloader(segment_downloader, live_follow, max_bandwidth, max_height, index=index,
+                                    room=room_name)
+        room = RoomCapture(room_name, live_share_url, downloader)
+        lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+
+        from playwright.async_api import async_playwright
+        async with async_playwright() as pw:
+            browser, context = await open_browser_context(pw, headful, lightweight, cdp_endpoint, user_data_dir)
+            try:
+                await room.open(context, build_inject_js(monitor_filter, monitor_batch_ms, monitor_max_preview))
+                logger.info("注入完成。浏览器窗口已打开。")
+                ticks = 0
+                while True:
+                    await asyncio.sleep(1)
+                    ticks += 1
+                    if ticks % 60 == 0:
+                        log_writer_depths([downloader.writer] + ([segment_writer] if segment_writer else []))
+                        await log_resource_usage([room], context)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                await room.close()
+                await close_browser_context(browser, context)
+    finally:
+        if lag_monitor is not None:
+            lag_monitor.cancel()
+        if downloader is not None:
+            # 页面没有打开时room.close()不会执行，关闭下载器自己的写入线程（重复关闭没有影响）
+            await downloader.close()
+        if segment_downloader is not None:
+            await segment_downloader.close()
+            await asyncio.to_thread(segment_writer.close)
+        if index is not None:
+            index.close()
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="监听直播页面并下载其中的m3u8播放列表")
+    parser.add_argument("--url", default=LIVE_SHARE_URL, help="要监听的直播间URL（单直播间模式）")
+    parser.add_argument("--rooms", metavar="CONFIG",
+                        help="直播间配置JSON文件，指定后同时监听其中所有直播间，修改文件即可增删直播间")
+    parser.add_argument("--output-dir", default="downloaded_m3u8", help="多直播间模式的输出根目录")
+    parser.add_argument("--headless", action="store_true", help="以无头模式启动浏览器")
+    parser.add_argument("--lightweight", action="store_true",
+                        help="轻量采集模式：无头运行、使用低资源启动参数并拦截图片/字体/样式表/音视频请求")
+    parser.add_argument("--user-data-dir",
+                        help="浏览器用户数据目录（保存登录状态）；指定时启动使用该目录的新浏览器，不连接已运行的浏览器")
+    parser.add_argument("--cdp-endpoint", metavar="URL",
+                        help="连接该CDP地址上已在运行的浏览器；默认使用browser_daemon.py守护进程的地址")
+    parser.add_argument("--download-segments", action="store_true", help="保存m3u8后下载其中的片段")
+    parser.add_argument("--live-follow", action="store_true", help="持续跟随未结束的直播播放列表")
+    parser.add_argument("--segment-concurrency", type=int, default=64, help="所有直播间共用的片段下载并发数")
+    parser.add_argument("--max-bandwidth", type=int, help="遇到主播放列表时选择变体的带宽上限（bps），对每个直播间生效")
+    parser.add_argument("--max-height", type=int, help="遇到主播放列表时选择变体的分辨率高度上限，对每个直播间生效")
+    parser.add_argument("--monitor-filter", nargs="*", metavar="MARKER", default=list(DEFAULT_MONITOR_FILTER),
+                        help="页面脚本只转发URL或内容中包含任一标记（不区分大小写）的事件，默认 .m3u8；"
+                             "只写 --monitor-filter 不带标记时转发全部事件")
+    parser.add_argument("--monitor-batch-ms", type=int, default=250,
+                        help="页面脚本合并事件批量发送的间隔（毫秒），0表示逐条发送")
+    parser.add_argument("--monitor-max-preview", type=int, default=10000,
+                        help="页面脚本转发的内容预览截断长度（字符），0表示不截断")
+    parser.add_argument("--metrics-port", type=int, help="在127.0.0.1的该端口提供Prometheus格式的 /metrics")
+    parser.add_argument("--event-log", metavar="PATH", help="把结构化事件以JSON Lines格式追加写入该文件")
+    return parser
 
 
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    metrics.configure_event_log(args.event_log)
     try:
-        asyncio.run(open_and_listen(
-            LIVE_SHARE_URL,
-            headful=True,
-            # user_data_dir="./edge_profile"  # 使用持久化用户数据
-        ))
+        if args.rooms:
+            asyncio.run(CaptureSupervisor(
+                args.rooms, output_root=args.output_dir, headful=not args.headless,
+                user_data_dir=args.user_data_dir, download_segments=args.download_segments,
+                segment_concurrency=args.segment_concurrency, live_follow=args.live_follow,
+                max_bandwidth=args.max_bandwidth, max_height=args.max_height,
+                monitor_filter=args.monitor_filter, monitor_batch_ms=args.monitor_batch_ms,
+                monitor_max_preview=args.monitor_max_preview or None,
+                lightweight=args.lightweight, cdp_endpoint=args.cdp_endpoint).run())
+        else:
+            asyncio.run(open_and_listen(
+                args.url,
+                headful=not args.headless,
+                user_data_dir=args.user_data_dir,  # 例如 ./edge_profile，使用持久化用户数据
+                download_segments=args.download_segments,
+                segment_concurrency=args.segment_concurrency,
+                live_follow=args.live_follow,
+                max_bandwidth=args.max_bandwidth,
+                max_height=args.max_height,
+                monitor_filter=args.monitor_filter,
+                monitor_batch_ms=args.monitor_batch_ms,
+                monitor_max_preview=args.monitor_max_preview or None,
+                lightweight=args.lightweight,
+                cdp_endpoint=args.cdp_endpoint,
+            ))
     except KeyboardInterrupt:
-        logger.info("已停止监听。")
\ No newline at end of file
+        logger.info("已停止监听。")
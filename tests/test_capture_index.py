@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+from capture_index import CaptureIndex, normalize_url_key, open_index
+from m3u8_parser import parse_playlist
+
+URL = "https://cdn.example.com/live/room/index.m3u8"
+ENDED = "#EXTM3U\n#EXTINF:4,\na.ts\n#EXT-X-ENDLIST\n"
+LIVE = "#EXTM3U\n#EXTINF:4,\na.ts\n"
+MASTER = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow.m3u8\n"
+
+
+@pytest.fixture
+def index(tmp_path):
+    with CaptureIndex(str(tmp_path / "capture_index.sqlite3")) as capture_index:
+        yield capture_index
+
+
+def save(tmp_path, name, text):
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_url_key_ignores_volatile_auth_params():
+    assert normalize_url_key(URL + "?auth_key=1-2-3&quality=hd") == normalize_url_key(URL + "?quality=hd&auth_key=x")
+    assert normalize_url_key(URL + "?quality=hd") != normalize_url_key(URL + "?quality=sd")
+
+
+def test_only_ended_media_playlists_count_as_captured(index, tmp_path):
+    key = normalize_url_key(URL)
+    assert not index.is_captured(key)
+    index.record_playlist(save(tmp_path, "master.m3u8", MASTER), URL, key, playlist=parse_playlist(MASTER, URL))
+    assert not index.is_captured(key)
+    path = save(tmp_path, "index.m3u8", LIVE)
+    index.record_playlist(path, URL, key, playlist=parse_playlist(LIVE, URL))
+    assert not index.is_captured(key)
+    # 同一路径再次保存时更新记录，直播结束后算作已保存
+    index.record_playlist(path, URL + "?auth_key=new", key, playlist=parse_playlist(ENDED, URL))
+    assert index.is_captured(key)
+    assert index.playlist_url(path) == URL + "?auth_key=new"
+
+
+def test_pending_playlists_reappear_after_resave(index, tmp_path):
+    first = save(tmp_path, "room_a/index.m3u8", ENDED)
+    second = save(tmp_path, "room_b/index.m3u8", ENDED)
+    master = save(tmp_path, "room_b/master.m3u8", MASTER)
+    index.record_playlist(first, URL, playlist=parse_playlist(ENDED, URL), captured_at=100)
+    index.record_playlist(second, URL, playlist=parse_playlist(ENDED, URL), captured_at=200)
+    index.record_playlist(master, URL, playlist=parse_playlist(MASTER, URL), captured_at=300)
+    assert index.pending_playlists(str(tmp_path)) == [first, second]
+    assert index.pending_playlists(str(tmp_path / "room_b")) == [second]
+
+    index.finish_job(index.start_job(first), True)
+    # 失败的任务不算处理过
+    index.finish_job(index.start_job(second), False)
+    assert index.pending_playlists(str(tmp_path)) == [second]
+
+    index.record_playlist(first, URL, playlist=parse_playlist(ENDED, URL), captured_at=400)
+    assert index.pending_playlists(str(tmp_path)) == [second, first]
+
+
+def test_list_playlists_newest_first_within_directory(index, tmp_path):
+    old = save(tmp_path, "downloaded_m3u8/a.m3u8", ENDED)
+    new = save(tmp_path, "downloaded_m3u8/room/b.m3u8", ENDED)
+    # 前缀相同但不在该目录下
+    other = save(tmp_path, "downloaded_m3u8_old/c.m3u8", ENDED)
+    for path, captured_at in ((old, 1), (new, 2), (other, 3)):
+        index.record_playlist(path, captured_at=captured_at)
+    rows = index.list_playlists(str(tmp_path / "downloaded_m3u8"))
+    assert [row["path"] for row in rows] == [new, old]
+
+
+def test_backfill_imports_existing_files_once(tmp_path):
+    directory = tmp_path / "downloaded_m3u8"
+    ended = save(directory, "room_a/index.m3u8", ENDED)
+    save(directory, "room_a/index.m3u8.meta.json", json.dumps({"url": URL, "source": "browser"}))
+    live = save(directory, "stream_0.m3u8", LIVE)
+    os.utime(ended, (1000, 1000))
+    save(directory, "notes.txt", "not a playlist")
+    # 隐藏目录（例如浏览器配置目录的缓存）中的m3u8不是采集结果
+    save(directory, ".browser_daemon_profile/Default/Cache/cached.m3u8", ENDED)
+
+    with open_index(str(directory)) as index:
+        rows = {row["path"]: row for row in index.list_playlists(str(directory))}
+        assert set(rows) == {ended, live}
+        assert rows[ended]["room"] == "room_a"
+        assert rows[ended]["url"] == URL
+        assert rows[ended]["source"] == "browser"
+        assert rows[ended]["captured_at"] == 1000
+        assert rows[live]["room"] is None
+        assert rows[live]["source"] == "backfill"
+        assert index.is_captured(normalize_url_key(URL))
+        assert index.backfill(str(directory)) == 0
+
+    # 索引已存在时打开不再扫描目录
+    save(directory, "later.m3u8", ENDED)
+    with open_index(str(directory)) as index:
+        assert len(index.list_playlists(str(directory))) == 2
+        assert index.backfill(str(directory)) == 1
+
+
+def test_prune_missing_keeps_jobs(index, tmp_path):
+    kept = save(tmp_path, "room/kept.m3u8", ENDED)
+    deleted = save(tmp_path, "room/deleted.m3u8", ENDED)
+    elsewhere = str(tmp_path / "other" / "gone.m3u8")
+    for path in (kept, deleted, elsewhere):
+        index.record_playlist(path)
+    index.finish_job(index.start_job(deleted), True)
+    os.remove(deleted)
+
+    # 列表只查询索引，删除的文件在清理前仍会列出
+    assert len(index.list_playlists(str(tmp_path / "room"))) == 2
+    assert index.prune_missing(str(tmp_path / "room")) == 1
+    assert [row["path"] for row in index.list_playlists(str(tmp_path / "room"))] == [kept]
+    assert len(index.jobs(deleted)) == 1
+    assert index.prune_missing() == 1
+    assert [row["path"] for row in index.list_playlists()] == [kept]
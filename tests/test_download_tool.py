@@ -0,0 +1,210 @@
+import os
+
+import pytest
+
+import download_tool
+from capture_index import CaptureIndex
+from download_tool import (AdaptiveConcurrency, BudgetTimer, SegmentManifest, SegmentMerger, SegmentResult,
+                           build_arg_parser, init_section_paths, merge_order, process_playlist)
+from m3u8_parser import parse_playlist
+
+URLS = [f"https://cdn.example.com/live/seg_{i}.ts?auth_key={i}-a" for i in range(3)]
+
+
+def write_segment(tmp_path, i, data):
+    path = tmp_path / f"segment_{i:04d}.ts"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_manifest_resumes_completed_segments(tmp_path):
+    path = SegmentManifest.manifest_path(str(tmp_path / "job_segments"))
+    assert path == str(tmp_path / "job_segments.manifest.json")
+    manifest = SegmentManifest(path)
+    manifest.sync(URLS)
+    done = write_segment(tmp_path, 0, b"x" * 10)
+    manifest.update(0, SegmentResult(True, 200, 10, 10))
+    manifest.update(1, SegmentResult(False, 503, 0, None))
+    manifest.save()
+
+    # 重新运行时鉴权参数已变化，但片段路径相同，保留已完成的状态
+    resumed = SegmentManifest(path)
+    resumed.sync([url.replace("-a", "-b") for url in URLS])
+    assert resumed.is_complete(0, done)
+    assert resumed.segments[0]["url"].endswith("auth_key=0-b")
+    assert not resumed.is_complete(1, write_segment(tmp_path, 1, b""))
+    assert resumed.segments[2]["status"] == "pending"
+
+
+def test_manifest_rejects_changed_or_resized_segments(tmp_path):
+    path = SegmentManifest.manifest_path(str(tmp_path / "job_segments"))
+    manifest = SegmentManifest(path)
+    manifest.sync(URLS)
+    first = write_segment(tmp_path, 0, b"x" * 10)
+    second = write_segment(tmp_path, 1, b"x" * 10)
+    manifest.update(0, SegmentResult(True, 200, 10, 10))
+    manifest.update(1, SegmentResult(True, 200, 10, 10))
+    manifest.save()
+
+    # 片段文件被截断
+    write_segment(tmp_path, 1, b"x" * 5)
+    resumed = SegmentManifest(path)
+    resumed.sync(URLS)
+    assert resumed.is_complete(0, first)
+    assert not resumed.is_complete(1, second)
+    # 同一序号对应了另一个片段（播放列表已变化）
+    resumed.sync(["https://cdn.example.com/live/other_0.ts"] + URLS[1:])
+    assert not resumed.is_complete(0, first)
+
+
+def test_unreadable_manifest_starts_over(tmp_path):
+    path = tmp_path / "job_segments.manifest.json"
+    path.write_text("{not json", encoding="utf-8")
+    manifest = SegmentManifest(str(path))
+    manifest.sync(URLS)
+    assert [entry["status"] for entry in manifest.segments.values()] == ["pending"] * 3
+
+
+def test_part_file_resumes_with_range_request(tmp_path):
+    pytest.importorskip("requests")
+    from benchmarks.hls_server import HLSStandInServer
+    from download_tool import create_session, download_ts_segment
+
+    with HLSStandInServer(segment_count=1, segment_size=188 * 100) as server, create_session(2) as session:
+        body = server.segment_body
+        (tmp_path / "segment_0000.ts.part").write_bytes(body[:5000])
+        result = download_ts_segment(server.segment_urls()[0], "segment_0000.ts", str(tmp_path), session)
+
+        assert result == SegmentResult(True, 206, len(body), len(body))
+        assert (tmp_path / "segment_0000.ts").read_bytes() == body
+        assert not (tmp_path / "segment_0000.ts.part").exists()
+
+        # .part已经比资源还大时服务器返回416，丢弃后重新下载
+        (tmp_path / "segment_0001.ts.part").write_bytes(body + b"stale")
+        result = download_ts_segment(server.segment_urls()[0], "segment_0001.ts", str(tmp_path), session)
+        assert result.ok and result.status == 200
+        assert (tmp_path / "segment_0001.ts").read_bytes() == body
+
+
+def test_merger_appends_only_the_finished_prefix(tmp_path):
+    paths = [write_segment(tmp_path, i, bytes([i]) * (i + 1) * 1000) for i in range(4)]
+    output = str(tmp_path / "merged.ts")
+    merger = SegmentMerger(paths, output).start()
+    # 乱序完成，合并仍按播放列表顺序进行
+    merger.mark_done(2)
+    merger.mark_done(1)
+    merger.mark_done(0)
+    merger.mark_done(3)
+    assert merger.finish()
+
+    with open(output, "rb") as f:
+        assert f.read() == b"".join(bytes([i]) * (i + 1) * 1000 for i in range(4))
+    assert not os.path.exists(output + ".part")
+
+
+def test_merger_stops_at_the_first_missing_segment(tmp_path):
+    paths = [write_segment(tmp_path, i, bytes([i]) * 100) for i in range(4)]
+    output = str(tmp_path / "merged.ts")
+    merger = SegmentMerger(paths, output).start()
+    for i in (0, 1, 3):
+        merger.mark_done(i)
+    assert not merger.finish()
+
+    assert merger.merged_count == 2
+    assert not os.path.exists(output)
+    with open(output + ".part", "rb") as f:
+        assert f.read() == bytes([0]) * 100 + bytes([1]) * 100
+
+
+def test_merge_order_inserts_init_sections():
+    segments = parse_playlist(
+        "#EXTM3U\n"
+        '#EXT-X-MAP:URI="init_a.mp4"\n#EXTINF:4,\na.m4s\n#EXTINF:4,\nb.m4s\n'
+        '#EXT-X-MAP:URI="init_b.mp4"\n#EXTINF:4,\nc.m4s\n', "https://cdn.example.com/live/index.m3u8").segments
+    segment_paths = ["a", "b", "c"]
+    init_paths = init_section_paths(segments, "job_segments")
+    merge_paths, merge_positions, init_positions = merge_order(segments, segment_paths, init_paths)
+
+    init_a, init_b = init_paths.values()
+    assert merge_paths == [init_a, "a", "b", init_b, "c"]
+    assert merge_positions == [1, 2, 4]
+    assert init_positions == [0, 3]
+
+
+def test_rewrite_only_run_leaves_playlist_pending(tmp_path):
+    playlist = tmp_path / "room" / "index.m3u8"
+    playlist.parent.mkdir()
+    playlist.write_text("#EXTM3U\n#EXTINF:4,\nseg_0.ts\n#EXT-X-ENDLIST\n", encoding="utf-8")
+    args = build_arg_parser().parse_args(["--no-download", "--output-dir", str(tmp_path / "out")])
+    with CaptureIndex(str(tmp_path / "capture_index.sqlite3")) as index:
+        index.record_playlist(str(playlist), "https://cdn.example.com/live/index.m3u8")
+        assert process_playlist(str(playlist), args, budget=None, index=index)
+        assert index.jobs(str(playlist)) == []
+        assert index.pending_playlists(str(tmp_path)) == [str(playlist)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(download_tool, "time", fake)
+    return fake
+
+
+def run_window(controller, clock, latency=0.1, size=1000, throttled=0):
+    """经过一个观测窗口后完成limit个请求，最后一个请求触发调整"""
+    clock.now += AdaptiveConcurrency.WINDOW
+    requests = controller.limit
+    for k in range(requests):
+        controller.acquire()
+        result = SegmentResult(False, 503, 0, None) if k < throttled else SegmentResult(True, 200, size, size)
+        controller.release(result, latency)
+    return controller.limit
+
+
+def test_concurrency_halves_when_throttled(clock):
+    controller = AdaptiveConcurrency(min_workers=2, max_workers=16, initial=8)
+    assert run_window(controller, clock, throttled=1) == 4
+    assert run_window(controller, clock, throttled=4) == 2
+    # 不低于下限
+    assert run_window(controller, clock, throttled=2) == 2
+
+
+def test_concurrency_shrinks_when_latency_exceeds_baseline(clock):
+    controller = AdaptiveConcurrency(min_workers=2, max_workers=16, initial=4)
+    # 第一个窗口确定延迟基线
+    assert run_window(controller, clock, latency=0.1) == 5
+    assert run_window(controller, clock, latency=0.3) == 4
+    # 基线每个窗口最多上浮10%，延迟长期偏高时不会一直降低并发
+    assert controller._base_latency == pytest.approx(0.11)
+
+
+def test_concurrency_follows_throughput(clock):
+    controller = AdaptiveConcurrency(min_workers=2, max_workers=6, initial=4)
+    assert run_window(controller, clock) == 5
+    # 每个请求的字节数不变，并发更高时吞吐量也更高
+    assert run_window(controller, clock) == 6
+    assert run_window(controller, clock) == 6
+    # 吞吐量下降超过5%
+    assert run_window(controller, clock, size=500) == 5
+
+
+def test_budget_timer_counts_overlapping_holds_once(clock):
+    timer = BudgetTimer()
+    with timer:
+        clock.now = 1.0
+        with timer:
+            clock.now = 2.0
+        clock.now = 3.0
+    # 两次占用之间没有占用名额的时间（例如等待名额）不计入
+    clock.now = 10.0
+    with timer:
+        clock.now = 11.0
+    assert timer.elapsed == pytest.approx(4.0)
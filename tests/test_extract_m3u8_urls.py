@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from server import M3U8Downloader, RoomCapture, extract_m3u8_urls
+
+URL = "https://dtliving-sz.dingtalk.com/live/abc/index.m3u8?auth_key=1700000000-0-0-abc"
+
+
+def test_message_without_m3u8_is_skipped():
+    assert extract_m3u8_urls('{"type":"like","count":3,"url":"https://example.com/a.ts"}') == []
+    assert extract_m3u8_urls("") == []
+
+
+def test_urls_in_order_without_duplicates():
+    other = "http://cdn.example.com/hd/stream.m3u8"
+    text = f"first {URL} then {other} and again {URL}"
+    assert extract_m3u8_urls(text) == [URL, other]
+
+
+def test_url_ends_at_json_quote():
+    text = json.dumps({"playUrl": URL, "title": "直播"}, ensure_ascii=False)
+    assert extract_m3u8_urls(text) == [URL]
+
+
+def test_escaped_slashes_in_json():
+    text = '{"playUrl":"https:\\/\\/dtliving-sz.dingtalk.com\\/live\\/abc\\/index.m3u8?auth_key=x"}'
+    assert extract_m3u8_urls(text) == ["https://dtliving-sz.dingtalk.com/live/abc/index.m3u8?auth_key=x"]
+
+
+def test_mixed_case_extension():
+    for extension in (".M3U8", ".M3u8", ".m3U8"):
+        url = f"https://cdn.example.com/live/index{extension}?token=1"
+        assert extract_m3u8_urls(f'{{"url":"{url}"}}') == [url]
+
+
+def test_mixed_case_urls_start_a_download():
+    urls = [f"https://cdn.example.com/live/{name}?token=1" for name in ("a.M3U8", "b.M3u8", "c.m3U8")]
+
+    async def run():
+        downloader = M3U8Downloader(session=object())
+        fetched = []
+
+        async def fetch(url, response=None):
+            fetched.append(url)
+
+        downloader._fetch_m3u8 = fetch
+        room = RoomCapture("room", "https://example.com/live", downloader)
+        room.handle_event({"kind": "xhr_response", "url": urls[0]})
+        room.handle_event({"kind": "fetch_response", "url": urls[1]})
+        preview = json.dumps({"playUrl": urls[2]})
+        room.handle_event({"kind": "ws_message", "url": "wss://example.com/ws", "dataLength": len(preview),
+                           "dataPreview": preview})
+        while downloader.tasks:
+            await asyncio.gather(*downloader.tasks)
+        return fetched
+
+    assert sorted(asyncio.run(run())) == urls
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from hls_crypto import KeyCache, SegmentDecryptor, check_key_method, sequence_iv
+from m3u8_parser import Key
+
+KEY = bytes(range(16))
+
+
+def encrypt(data, key, iv):
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+def test_sequence_iv_is_big_endian_media_sequence():
+    assert sequence_iv(0) == bytes(16)
+    assert sequence_iv(1) == bytes(15) + b"\x01"
+    assert sequence_iv(0x0102) == bytes(14) + b"\x01\x02"
+
+
+def test_only_aes_128_is_supported():
+    check_key_method(None)
+    check_key_method(Key("AES-128", "k", None))
+    with pytest.raises(ValueError):
+        check_key_method(Key("SAMPLE-AES", "k", None))
+
+
+@pytest.mark.parametrize("size", [0, 15, 16, 1880, 100000])
+def test_decryptor_round_trip_in_uneven_chunks(size):
+    pytest.importorskip("cryptography")
+    plain = bytes(i % 251 for i in range(size))
+    ciphertext = encrypt(plain, KEY, sequence_iv(7))
+    decryptor = SegmentDecryptor(KEY, sequence_iv(7))
+    out = b"".join(decryptor.update(ciphertext[i:i + 1000]) for i in range(0, len(ciphertext), 1000))
+    assert out + decryptor.finalize() == plain
+
+
+def test_decryptor_rejects_truncated_ciphertext():
+    pytest.importorskip("cryptography")
+    decryptor = SegmentDecryptor(KEY, sequence_iv(0))
+    decryptor.update(encrypt(b"x" * 100, KEY, sequence_iv(0))[:-8])
+    with pytest.raises(ValueError):
+        decryptor.finalize()
+
+
+def test_key_cache_evicts_least_recently_used():
+    cache = KeyCache(maxsize=2)
+    cache.put("a", b"a" * 16)
+    cache.put("b", b"b" * 16)
+    assert cache.get("a") == b"a" * 16
+    cache.put("c", b"c" * 16)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 16
+    assert cache.get("c") == b"c" * 16
+    with pytest.raises(ValueError):
+        cache.put("short", b"x" * 8)
+
+
+def test_key_cache_fetches_each_uri_once():
+    cache = KeyCache()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def fetch(uri):
+        calls.append(uri)
+        return KEY
+
+    def worker():
+        barrier.wait()
+        assert cache.get_or_fetch("https://keys.example.com/k1", fetch) == KEY
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["https://keys.example.com/k1"]
+    # 下载到的密钥长度不对时不缓存
+    with pytest.raises(ValueError):
+        cache.get_or_fetch("https://keys.example.com/bad", lambda uri: b"<html>")
+    assert cache.get("https://keys.example.com/bad") is None
+
+
+@pytest.fixture(scope="module")
+def server():
+    pytest.importorskip("cryptography")
+    from benchmarks.hls_server import HLSStandInServer
+    # 1880字节的明文片段不是16字节的整数倍，当作密文解密时会出错
+    with HLSStandInServer(segment_count=5, segment_size=188 * 10) as stand_in:
+        yield stand_in
+
+
+def broken_playlist():
+    """密钥有效但第一个片段是未加密的TS，解密失败"""
+    return ('#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="key.bin"\n'
+            "#EXTINF:4,\nseg_0.ts\n#EXTINF:4,\nenc_1.ts\n#EXT-X-ENDLIST\n")
+
+
+def read_segments(directory):
+    names = sorted(name for name in os.listdir(directory) if name.startswith("segment_") and name.endswith(".ts"))
+    return names, [open(os.path.join(directory, name), "rb").read() for name in names]
+
+
+def test_threadpool_engine_decrypts(server, tmp_path):
+    pytest.importorskip("requests")
+    from download_tool import download_all_segments
+    directory = str(tmp_path / "segments")
+    assert download_all_segments(server.encrypted_playlist(), directory, server.encrypted_url, min_workers=2,
+                                 max_workers=2, progress=False)
+    names, bodies = read_segments(directory)
+    assert len(names) == server.segment_count
+    assert bodies == [server.segment_body] * server.segment_count
+
+
+def test_threadpool_engine_fails_only_the_undecryptable_segment(server, tmp_path):
+    pytest.importorskip("requests")
+    from download_tool import download_all_segments
+    directory = str(tmp_path / "segments")
+    assert not download_all_segments(broken_playlist(), directory, server.encrypted_url, max_retries=0,
+                                     progress=False)
+    assert read_segments(directory) == (["segment_0001.ts"], [server.segment_body])
+
+
+def run_async(server, text, directory):
+    pytest.importorskip("aiohttp")
+    from async_downloader import AsyncSegmentDownloader
+    from m3u8_parser import parse_playlist
+
+    async def run():
+        async with AsyncSegmentDownloader(concurrency=4, max_retries=0) as downloader:
+            return await downloader.download(parse_playlist(text, server.encrypted_url).segments, directory)
+
+    return asyncio.run(run())
+
+
+def test_asyncio_engine_decrypts(server, tmp_path):
+    directory = str(tmp_path / "segments")
+    assert run_async(server, server.encrypted_playlist(), directory)
+    names, bodies = read_segments(directory)
+    assert len(names) == server.segment_count
+    assert bodies == [server.segment_body] * server.segment_count
+
+
+def test_asyncio_engine_fails_only_the_undecryptable_segment(server, tmp_path):
+    directory = str(tmp_path / "segments")
+    assert not run_async(server, broken_playlist(), directory)
+    assert read_segments(directory) == (["segment_0001.ts"], [server.segment_body])
+    assert not any(name.endswith(".part") for name in os.listdir(directory))
@@ -0,0 +1,95 @@
+import asyncio
+
+from capture_index import normalize_url_key
+from server import LivePlaylistFollower, M3U8Downloader
+
+URL = "https://cdn.example.com/live/room/index.m3u8"
+
+
+def live_playlist(first, count, ended=False, target_duration=4):
+    lines = ["#EXTM3U", f"#EXT-X-TARGETDURATION:{target_duration}", f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+    for sequence in range(first, first + count):
+        lines += ["#EXTINF:4,", f"seg_{sequence}.ts"]
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def make_follower():
+    return LivePlaylistFollower(URL, "segments", segment_downloader=None, session=object())
+
+
+def drain(follower):
+    sequences = []
+    while not follower.queue.empty():
+        sequences.append(follower.queue.get_nowait().sequence)
+    return sequences
+
+
+def test_only_new_sequences_are_queued():
+    follower = make_follower()
+    assert follower._process(live_playlist(10, 3, target_duration=6)) == (3, False)
+    assert drain(follower) == [10, 11, 12]
+    assert follower.target_duration == 6
+
+    # 播放列表没有变化
+    assert follower._process(live_playlist(10, 3)) == (0, False)
+    # 滑动窗口前进：只有13和14是新的
+    assert follower._process(live_playlist(12, 3)) == (2, False)
+    assert drain(follower) == [13, 14]
+    assert follower.last_sequence == 14
+
+
+def test_endlist_finishes_after_queueing_remaining_segments():
+    follower = make_follower()
+    follower._process(live_playlist(0, 2))
+    drain(follower)
+    assert follower._process(live_playlist(0, 4, ended=True)) == (2, True)
+    assert drain(follower) == [2, 3]
+
+
+def test_falling_behind_skips_to_the_current_window():
+    follower = make_follower()
+    follower._process(live_playlist(0, 2))
+    drain(follower)
+    assert follower._process(live_playlist(10, 2)) == (2, False)
+    assert drain(follower) == [10, 11]
+
+
+def test_sequence_reset_is_treated_as_a_restart():
+    follower = make_follower()
+    follower._process(live_playlist(100, 3))
+    drain(follower)
+    assert follower._process(live_playlist(0, 2)) == (2, False)
+    assert drain(follower) == [0, 1]
+
+
+def test_master_playlist_stops_following():
+    follower = make_follower()
+    assert follower._process("#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nlow.m3u8\n") == (0, True)
+    assert follower.queue.empty()
+
+
+def follow(downloader, follower, initial_text=None):
+    async def expired():
+        return None
+
+    # 签名过期：之后的每次拉取都失败
+    follower._fetch_playlist = expired
+    follower.MAX_CONSECUTIVE_FAILURES = 1
+    downloader._remember(normalize_url_key(follower.url))
+    return asyncio.run(downloader._follow(follower, initial_text))
+
+
+def test_abandoned_follow_can_restart_with_a_new_signature(tmp_path):
+    downloader = M3U8Downloader(segment_downloader=object(), live_follow=True, session=object())
+    follower = LivePlaylistFollower(URL + "?auth_key=old", str(tmp_path / "segments"), None, session=object())
+    assert follow(downloader, follower) is False
+    assert downloader.should_download(URL + "?auth_key=new")
+
+
+def test_ended_follow_stays_deduplicated(tmp_path):
+    downloader = M3U8Downloader(segment_downloader=object(), live_follow=True, session=object())
+    follower = LivePlaylistFollower(URL + "?auth_key=old", str(tmp_path / "segments"), None, session=object())
+    assert follow(downloader, follower, live_playlist(0, 0, ended=True)) is True
+    assert not downloader.should_download(URL + "?auth_key=new")
@@ -0,0 +1,177 @@
+from m3u8_parser import (ByteRange, InitSection, Key, MasterPlaylist, MediaPlaylist, parse_attributes, parse_playlist,
+                         resolve_playlist_text, select_variant)
+
+BASE_URL = "https://cdn.example.com/live/stream/index.m3u8?auth_key=abc"
+
+
+def test_media_playlist_durations_and_sequence():
+    playlist = parse_playlist(
+        "#EXTM3U\n"
+        "#EXT-X-VERSION:3\n"
+        "#EXT-X-TARGETDURATION:6\n"
+        "#EXT-X-MEDIA-SEQUENCE:100\n"
+        "#EXT-X-PLAYLIST-TYPE:VOD\n"
+        "#EXTINF:5.005,\n"
+        "seg100.ts\n"
+        "#EXTINF:4.5,title\n"
+        "seg101.ts\n"
+        "#EXTINF:6\n"
+        "seg102.ts\n"
+        "#EXT-X-ENDLIST\n", BASE_URL)
+
+    assert isinstance(playlist, MediaPlaylist)
+    assert not playlist.is_master
+    assert playlist.version == 3
+    assert playlist.target_duration == 6.0
+    assert playlist.media_sequence == 100
+    assert playlist.playlist_type == "VOD"
+    assert playlist.ended
+    assert [segment.duration for segment in playlist.segments] == [5.005, 4.5, 6.0]
+    assert [segment.sequence for segment in playlist.segments] == [100, 101, 102]
+    assert abs(playlist.total_duration - 15.505) < 1e-9
+
+
+def test_live_playlist_is_not_ended():
+    playlist = parse_playlist("#EXTM3U\n#EXTINF:4,\na.ts\n#EXTINF:4,\nb.ts\n", BASE_URL)
+    assert not playlist.ended
+    assert len(playlist.segments) == 2
+
+
+def test_discontinuity_applies_to_next_segment_only():
+    playlist = parse_playlist(
+        "#EXTM3U\n"
+        "#EXTINF:4,\na.ts\n"
+        "#EXT-X-DISCONTINUITY\n"
+        "#EXTINF:4,\nad.ts\n"
+        "#EXTINF:4,\nb.ts\n", BASE_URL)
+    assert [segment.discontinuity for segment in playlist.segments] == [False, True, False]
+
+
+def test_key_is_inherited_until_changed():
+    playlist = parse_playlist(
+        "#EXTM3U\n"
+        "#EXT-X-MEDIA-SEQUENCE:7\n"
+        "#EXTINF:4,\nclear.ts\n"
+        '#EXT-X-KEY:METHOD=AES-128,URI="keys/k1.bin"\n'
+        "#EXTINF:4,\na.ts\n"
+        "#EXTINF:4,\nb.ts\n"
+        '#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example.com/k2?x=1",IV=0x000102030405060708090A0B0C0D0E0F\n'
+        "#EXTINF:4,\nc.ts\n"
+        "#EXT-X-KEY:METHOD=NONE\n"
+        "#EXTINF:4,\nd.ts\n", BASE_URL)
+    keys = [segment.key for segment in playlist.segments]
+
+    assert keys[0] is None
+    # 省略IV时为None，由下载器按媒体序列号推导
+    assert keys[1] == Key("AES-128", "https://cdn.example.com/live/stream/keys/k1.bin", None)
+    assert keys[2] is keys[1]
+    assert keys[3] == Key("AES-128", "https://keys.example.com/k2?x=1", bytes(range(16)))
+    assert keys[4] is None
+    assert playlist.is_encrypted
+
+
+def test_short_iv_is_left_padded():
+    playlist = parse_playlist('#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="k",IV=0x1F\n#EXTINF:4,\na.ts\n', BASE_URL)
+    assert playlist.segments[0].key.iv == bytes(15) + b"\x1f"
+
+
+def test_byterange_offsets_carry_over_from_previous_segment():
+    playlist = parse_playlist(
+        "#EXTM3U\n"
+        "#EXT-X-VERSION:4\n"
+        '#EXT-X-MAP:URI="media.mp4",BYTERANGE="720@0"\n'
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:1000@720\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:2000\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:500\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:300@10000\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100\nmedia.mp4\n"
+        "#EXTINF:4,\nwhole.ts\n", BASE_URL)
+    ranges = [segment.byterange for segment in playlist.segments]
+
+    assert ranges == [ByteRange(1000, 720), ByteRange(2000, 1720), ByteRange(500, 3720), ByteRange(300, 10000),
+                      ByteRange(100, 10300), None]
+    init = InitSection("https://cdn.example.com/live/stream/media.mp4", ByteRange(720, 0))
+    assert all(segment.init_section == init for segment in playlist.segments)
+
+
+def test_byterange_without_offset_on_first_segment_starts_at_zero():
+    # #EXT-X-MAP的字节范围不算作上一个片段
+    playlist = parse_playlist(
+        '#EXTM3U\n#EXT-X-MAP:URI="media.mp4",BYTERANGE="720@0"\n'
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:1000\nmedia.mp4\n", BASE_URL)
+    assert playlist.segments[0].byterange == ByteRange(1000, 0)
+
+
+def test_relative_uris_are_resolved_against_playlist_url():
+    playlist = parse_playlist(
+        "#EXTM3U\n"
+        "#EXTINF:4,\nseg0.ts?t=1\n"
+        "#EXTINF:4,\nsub/seg1.ts\n"
+        "#EXTINF:4,\n../other/seg2.ts\n"
+        "#EXTINF:4,\n/abs/seg3.ts\n"
+        "#EXTINF:4,\nhttps://other.example.com/seg4.ts\n"
+        "#EXTINF:4,\n//cdn2.example.com/seg5.ts\n", BASE_URL)
+    assert [segment.uri for segment in playlist.segments] == [
+        "https://cdn.example.com/live/stream/seg0.ts?t=1",
+        "https://cdn.example.com/live/stream/sub/seg1.ts",
+        "https://cdn.example.com/live/other/seg2.ts",
+        "https://cdn.example.com/abs/seg3.ts",
+        "https://other.example.com/seg4.ts",
+        "https://cdn2.example.com/seg5.ts",
+    ]
+
+
+def test_uris_are_kept_without_playlist_url():
+    playlist = parse_playlist("#EXTM3U\n#EXTINF:4,\nseg0.ts\n")
+    assert playlist.segments[0].uri == "seg0.ts"
+
+
+def test_resolve_playlist_text_rewrites_uris_only():
+    text = ('#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="k.bin"\n#EXT-X-MAP:URI="init.mp4"\n'
+            "#EXTINF:4,\nseg0.ts\n#EXT-X-ENDLIST\n")
+    assert resolve_playlist_text(text, BASE_URL) == (
+        '#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="https://cdn.example.com/live/stream/k.bin"\n'
+        '#EXT-X-MAP:URI="https://cdn.example.com/live/stream/init.mp4"\n'
+        "#EXTINF:4,\nhttps://cdn.example.com/live/stream/seg0.ts\n#EXT-X-ENDLIST\n")
+
+
+def test_parse_attributes_handles_quoted_commas():
+    assert parse_attributes('BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2",RESOLUTION=1280x720') == {
+        "BANDWIDTH": "1280000", "CODECS": "avc1.4d401f,mp4a.40.2", "RESOLUTION": "1280x720"}
+
+
+MASTER = (
+    "#EXTM3U\n"
+    '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"\n'
+    "low/index.m3u8\n"
+    "#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720\n"
+    "mid/index.m3u8\n"
+    "#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080\n"
+    "high/index.m3u8\n"
+    "#EXT-X-STREAM-INF:BANDWIDTH=64000\n"
+    "audio/index.m3u8\n"
+)
+
+
+def test_master_playlist_variants():
+    master = parse_playlist(MASTER, BASE_URL)
+
+    assert isinstance(master, MasterPlaylist)
+    assert master.is_master
+    assert [variant.bandwidth for variant in master.variants] == [800000, 2500000, 5000000, 64000]
+    assert master.variants[0].resolution == (640, 360)
+    assert master.variants[0].codecs == "avc1.4d401e,mp4a.40.2"
+    assert master.variants[3].resolution is None
+    assert master.variants[1].uri == "https://cdn.example.com/live/stream/mid/index.m3u8"
+
+
+def test_select_variant():
+    master = parse_playlist(MASTER, BASE_URL)
+
+    assert select_variant(master).bandwidth == 5000000
+    assert select_variant(master, max_bandwidth=3000000).bandwidth == 2500000
+    assert select_variant(master, max_height=720).bandwidth == 2500000
+    assert select_variant(master, max_bandwidth=1000000, max_height=1080).bandwidth == 800000
+    # 没有满足条件的变体时选择码率最低的
+    assert select_variant(master, max_bandwidth=1000).bandwidth == 64000
+    assert select_variant(MasterPlaylist(BASE_URL)) is None
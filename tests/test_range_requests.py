@@ -0,0 +1,126 @@
+import concurrent.futures
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+from benchmarks.hls_server import HLSStandInServer
+from download_tool import create_session, download_range_group, download_segment_chunked, plan_range_requests
+from m3u8_parser import ByteRange, parse_playlist
+
+BASE_URL = "https://cdn.example.com/live/index.m3u8"
+
+
+def byterange_segments(*lines):
+    return parse_playlist("#EXTM3U\n" + "".join(f"#EXTINF:4,\n{line}\n" for line in lines), BASE_URL).segments
+
+
+def test_adjacent_byteranges_are_coalesced():
+    segments = parse_playlist(
+        "#EXTM3U\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@0\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100\nmedia.mp4\n", BASE_URL).segments
+    units = plan_range_requests(list(enumerate(segments)))
+    assert [[i for i, _ in unit] for unit in units] == [[0, 1, 2]]
+
+
+def test_gap_other_resource_and_missing_index_break_a_group():
+    segments = parse_playlist(
+        "#EXTM3U\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@0\nmedia.mp4\n"
+        # 与上一段之间空出100字节
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@200\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@300\nother.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@400\nother.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@500\nother.mp4\n", BASE_URL).segments
+    # 序号3已下载完成，4虽然在字节上紧接着3，但与2之间不连续
+    pending = [(i, segment) for i, segment in enumerate(segments) if i != 3]
+    units = plan_range_requests(pending)
+    assert [[i for i, _ in unit] for unit in units] == [[0], [1], [2], [4]]
+
+
+def test_group_size_limit():
+    segments = parse_playlist(
+        "#EXTM3U\n" + "#EXTINF:4,\n#EXT-X-BYTERANGE:100\nmedia.mp4\n" * 5, BASE_URL).segments
+    units = plan_range_requests(list(enumerate(segments)), max_bytes=250)
+    assert [[i for i, _ in unit] for unit in units] == [[0, 1], [2, 3], [4]]
+
+
+def test_encrypted_and_plain_segments_are_not_coalesced():
+    segments = parse_playlist(
+        "#EXTM3U\n"
+        '#EXT-X-KEY:METHOD=AES-128,URI="k"\n'
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100@0\nmedia.mp4\n"
+        "#EXTINF:4,\n#EXT-X-BYTERANGE:100\nmedia.mp4\n", BASE_URL).segments
+    assert len(plan_range_requests(list(enumerate(segments)))) == 2
+    plain = byterange_segments("a.ts", "b.ts")
+    assert len(plan_range_requests(list(enumerate(plain)))) == 2
+
+
+@pytest.fixture(scope="module")
+def server():
+    with HLSStandInServer(segment_count=6, segment_size=188 * 50) as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def session():
+    with create_session(8) as http_session:
+        yield http_session
+
+
+def media_ranges(server, count):
+    offset = len(server.init_body)
+    return [ByteRange(server.segment_size, offset + i * server.segment_size) for i in range(count)]
+
+
+def test_range_group_splits_one_response_into_segment_files(server, session, tmp_path):
+    byteranges = media_ranges(server, 4)
+    paths = [str(tmp_path / f"segment_{i:04d}.m4s") for i in range(4)]
+    results = download_range_group(server.base_url + "media.mp4", byteranges, paths, session)
+
+    assert all(result.ok for result in results)
+    assert [result.size for result in results] == [server.segment_size] * 4
+    for i, path in enumerate(paths):
+        with open(path, "rb") as f:
+            assert f.read() == server.fmp4_segment(i)
+    assert not any(name.endswith(".part") for name in os.listdir(tmp_path))
+
+
+def test_range_group_keeps_finished_segments_when_body_ends_early(server, session, tmp_path):
+    # 最后一个字节范围超出资源末尾，服务器只返回到末尾为止
+    byteranges = media_ranges(server, 6)[4:] + [ByteRange(100, len(server.media_body))]
+    paths = [str(tmp_path / f"segment_{i:04d}.m4s") for i in range(3)]
+    results = download_range_group(server.base_url + "media.mp4", byteranges, paths, session)
+
+    assert [result.ok for result in results] == [True, True, False]
+    with open(paths[1], "rb") as f:
+        assert f.read() == server.fmp4_segment(5)
+    assert not os.path.exists(paths[2])
+    assert not os.path.exists(paths[2] + ".part")
+
+
+def test_chunked_byterange_segment(server, session, tmp_path):
+    byterange = media_ranges(server, 3)[2]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        result = download_segment_chunked(server.base_url + "media.mp4", "segment_0002.m4s", str(tmp_path),
+                                          session, executor, chunk_size=1000, byterange=byterange)
+
+    assert result.ok and result.size == server.segment_size
+    with open(tmp_path / "segment_0002.m4s", "rb") as f:
+        assert f.read() == server.fmp4_segment(2)
+    assert os.listdir(tmp_path) == ["segment_0002.m4s"]
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 188 * 50, 1 << 20])
+def test_chunked_segment_of_unknown_size(server, session, tmp_path, chunk_size):
+    # 大小未知时从第一个分块的Content-Range得到总大小；不大于一个分块时一个请求就下载完整
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        result = download_segment_chunked(server.segment_urls()[0], "segment_0000.ts", str(tmp_path), session,
+                                          executor, chunk_size=chunk_size)
+
+    assert result.ok and result.size == server.segment_size
+    with open(tmp_path / "segment_0000.ts", "rb") as f:
+        assert f.read() == server.segment_body
@@ -0,0 +1,103 @@
+import pytest
+
+from segment_verify import PTS_CLOCK, TS_PACKET_SIZE, verify_segment
+
+VIDEO_PID = 0x100
+
+
+def ts_packet(pts=None, pid=VIDEO_PID):
+    """一个TS包；给出pts时是带PTS的视频PES的起始包"""
+    if pts is None:
+        header = bytes([0x47, pid >> 8, pid & 0xFF, 0x10])
+        return header + b"\xff" * (TS_PACKET_SIZE - len(header))
+    header = bytes([0x47, 0x40 | pid >> 8, pid & 0xFF, 0x10])
+    pes = b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + bytes([
+        0x21 | (pts >> 29) & 0x0E, (pts >> 22) & 0xFF, (pts >> 14) & 0xFE | 1, (pts >> 7) & 0xFF,
+        (pts << 1) & 0xFE | 1])
+    packet = header + pes
+    return packet + b"\xff" * (TS_PACKET_SIZE - len(packet))
+
+
+def ts_segment(seconds, start_pts=900000, packets=20):
+    """开头和结尾各有一个PES的TS片段，两者的PTS相差seconds秒"""
+    middle = [ts_packet() for _ in range(packets - 2)]
+    return ts_packet(start_pts) + b"".join(middle) + ts_packet(start_pts + int(seconds * PTS_CLOCK))
+
+
+def box(box_type, payload=b""):
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_valid_ts_and_pts_duration(tmp_path):
+    path = write(tmp_path, "segment_0000.ts", ts_segment(4.0))
+    result = verify_segment(path, expected_size=20 * TS_PACKET_SIZE, extinf=4.0)
+    assert result.ok
+    assert result.duration == pytest.approx(4.0)
+
+
+def test_pts_duration_far_from_extinf(tmp_path):
+    path = write(tmp_path, "segment_0000.ts", ts_segment(1.0))
+    result = verify_segment(path, extinf=6.0)
+    assert not result.ok
+    assert result.problem == "duration"
+    assert result.duration == pytest.approx(1.0)
+
+
+def test_pts_duration_across_wraparound(tmp_path):
+    path = write(tmp_path, "segment_0000.ts", ts_segment(4.0, start_pts=(1 << 33) - PTS_CLOCK))
+    assert verify_segment(path, extinf=4.0).duration == pytest.approx(4.0)
+
+
+def test_truncated_ts(tmp_path):
+    data = ts_segment(4.0)
+    # 在包中间断开：比服务器声明的小，也不是188字节的整数倍
+    path = write(tmp_path, "segment_0000.ts", data[:-100])
+    assert verify_segment(path, expected_size=len(data)).problem == "size"
+    assert verify_segment(path).problem == "alignment"
+
+
+def test_misaligned_ts(tmp_path):
+    # 开头多出4个字节，之后每个包的同步字节都不在188字节的边界上
+    data = b"\x00\x00\x00\x00" + ts_segment(4.0)[:-4]
+    path = write(tmp_path, "segment_0000.ts", data)
+    assert verify_segment(path).problem == "sync"
+
+
+def test_html_error_page(tmp_path):
+    page = b"<!DOCTYPE html><html><body>403 Forbidden</body></html>"
+    for name in ("segment_0000.ts", "segment_0001.m4s", "segment_0002.aac"):
+        assert verify_segment(write(tmp_path, name, page)).problem == "text"
+
+
+def test_empty_file(tmp_path):
+    assert verify_segment(write(tmp_path, "segment_0000.ts", b"")).problem == "empty"
+
+
+def test_valid_fmp4_box_chain(tmp_path):
+    init = write(tmp_path, "init_00.mp4", box(b"ftyp", b"iso6\x00\x00\x00\x00") + box(b"moov", b"\x00" * 32))
+    segment = write(tmp_path, "segment_0000.m4s",
+                    box(b"styp") + box(b"moof", b"\x00" * 16) + box(b"mdat", b"\x01" * 100))
+    assert verify_segment(init).ok
+    assert verify_segment(segment).ok
+
+
+def test_broken_fmp4_box_chain(tmp_path):
+    mdat = box(b"mdat", b"\x01" * 100)
+    # mdat声明的大小超出文件末尾
+    truncated = write(tmp_path, "segment_0000.m4s", box(b"moof", b"\x00" * 16) + mdat[:-10])
+    assert verify_segment(truncated).problem == "boxes"
+    # box之间夹杂无法识别的数据
+    garbage = write(tmp_path, "segment_0001.m4s", box(b"moof", b"\x00" * 16) + b"\x00\x00\x00\x10junk" + mdat)
+    assert verify_segment(garbage).problem == "boxes"
+
+
+def test_packed_audio_is_not_checked_as_ts(tmp_path):
+    # ADTS帧头以0xFFF开头，大小不是188的整数倍
+    adts = (b"\xff\xf1\x50\x80\x02\x1f\xfc" + b"\x21" * 100) * 3
+    assert verify_segment(write(tmp_path, "segment_0000.aac", adts)).ok